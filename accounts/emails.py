@@ -0,0 +1,40 @@
+# accounts/emails.py
+"""Account emails, sent in the background through core.jobs"""
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from core.jobs import enqueue_email
+from .models import EmailVerification
+
+
+def queue_verification_email(verification):
+    return enqueue_email(
+        'email_verification', f'email-verification:{verification.token}', {'verification_id': verification.id}
+    )
+
+
+def build_verification_email(payload):
+    """The verify-your-email message, unless the link has been used in the meantime"""
+    verification = EmailVerification.objects.select_related('user').filter(
+        pk=payload['verification_id'], is_used=False
+    ).first()
+    if verification is None:
+        return None
+
+    user = verification.user
+    context = {
+        'user': user,
+        'verification_url': f"{settings.SITE_URL}/accounts/verify-email/{verification.token}/",
+    }
+    # HTML version plus a plain text fallback for old email clients
+    html_message = render_to_string('accounts/verification_email.html', context)
+    email = EmailMultiAlternatives(
+        subject='Verify Your Email - AriFarm Shop',
+        body=strip_tags(html_message),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[user.email],
+    )
+    email.attach_alternative(html_message, "text/html")
+    return email
@@ -2,10 +2,6 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.mail import send_mail
-from django.conf import settings
-from django.template.loader import render_to_string  # <--- NEW IMPORT
-from django.utils.html import strip_tags             # <--- NEW IMPORT
 from django.contrib.auth.views import (
     PasswordResetView,
     PasswordResetDoneView,
@@ -15,8 +11,10 @@ from django.contrib.auth.views import (
 from django.urls import reverse_lazy
 import uuid
 
+from .emails import queue_verification_email
 from .forms import EmailRegistrationForm, ProfileUpdateForm
 from .models import User, EmailVerification
+from checkout.models import Order
 
 
 # ========================== REGISTRATION & VERIFICATION ==========================
@@ -33,34 +31,10 @@ def email_register(request):
             user.user_type = 'customer'
             user.save()
 
-            # Generate verification token
+            # Generate verification token; the email is sent by the email worker
             token = str(uuid.uuid4())
-            EmailVerification.objects.create(user=user, token=token)
-
-            # Prepare Email Data
-            verification_url = f"{settings.SITE_URL}/accounts/verify-email/{token}/"
-            
-            # Context for the HTML template
-            context = {
-                'user': user,
-                'verification_url': verification_url,
-            }
-
-            # Render HTML content
-            html_message = render_to_string('accounts/verification_email.html', context)
-            
-            # Create Plain Text fallback (strips HTML tags)
-            plain_message = strip_tags(html_message)
-
-            # Send Email (Both HTML and Plain Text)
-            send_mail(
-                subject='Verify Your Email - AriFarm Shop',
-                message=plain_message,            # Fallback for old email clients
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                html_message=html_message,        # The beautiful HTML version
-                fail_silently=False,
-            )
+            verification = EmailVerification.objects.create(user=user, token=token)
+            queue_verification_email(verification)
 
             # Save email in session so verification_sent page can show it
             request.session['registered_email'] = user.email
@@ -173,15 +147,16 @@ def profile(request):
     else:
         form = ProfileUpdateForm(instance=request.user)
 
-    # Calculate order statistics for dashboard cards
-    total_orders = request.user.orders.count()
-    paid_orders = request.user.orders.filter(status='paid').count()          # typically "Processing / Pending Delivery"
-    pending_orders = request.user.orders.filter(status='pending').count()    # Awaiting Payment/Confirmation
+    # Order statistics for dashboard cards, all statuses in one query
+    order_counts = Order.status_counts(request.user.orders.all())
+    total_orders = order_counts['total']
+    paid_orders = order_counts['paid']          # typically "Processing / Pending Delivery"
+    pending_orders = order_counts['pending']    # Awaiting Payment/Confirmation
 
-    # Optional additional stats (uncomment if you want to use them)
-    # processing_orders = request.user.orders.filter(status='processing').count()
-    # delivered_orders = request.user.orders.filter(status='delivered').count()
-    # failed_orders = request.user.orders.filter(status__in=['failed', 'cancelled']).count()
+    # Optional additional stats (already counted above)
+    # processing_orders = order_counts['processing']
+    # delivered_orders = order_counts['delivered']
+    # failed_orders = order_counts['failed'] + order_counts['cancelled']
 
     context = {
         'form': form,
@@ -3,6 +3,15 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the site with uvicorn (in requirments.txt) so the pending page's
+payment status stream (checkout.views.payment_events_view) holds one cheap
+connection per waiting customer instead of tying up a worker thread:
+
+    uvicorn backend.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+Under runserver or a WSGI server the stream is refused and the page polls
+stk_status_view instead.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
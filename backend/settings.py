@@ -3,6 +3,7 @@ Django settings for backend project.
 """
 
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 from django.urls import reverse_lazy
@@ -56,11 +57,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the other middleware's queries and time are part of the measurement
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After authentication: on-demand profiles are for staff only
+    'core.middleware.RequestProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     
@@ -90,6 +95,7 @@ TEMPLATES = [
                 'social_django.context_processors.backends',
                 'social_django.context_processors.login_redirect',
                 'core.context_processors.promotional_popup',
+                'cart.context_processors.cart_summary',
             ],
         },
     },
@@ -107,6 +113,40 @@ DATABASES = {
 }
 
 
+# ==================== CACHE ====================
+# Shared by all worker processes on the host, so a signal-driven invalidation
+# in one process is seen by the others. Point CACHE_BACKEND / CACHE_LOCATION
+# at Redis or Memcached when running on more than one machine.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'arifarm_cache')),
+        'TIMEOUT': 300,
+    }
+}
+
+
+# ==================== REQUEST METRICS ====================
+# core/metrics.py: share of requests measured, how often each process writes
+# its numbers to the RequestStat rollup, and how long the rollup is kept
+REQUEST_METRICS_SAMPLE_RATE = float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', '0.1'))
+REQUEST_METRICS_FLUSH_INTERVAL = int(os.getenv('REQUEST_METRICS_FLUSH_INTERVAL', '60'))
+REQUEST_METRICS_RETENTION_DAYS = 14
+
+# ==================== REQUEST PROFILER ====================
+# core/profiler.py: staff add ?_profile=1 (or an X-Profile header) to any
+# request for a sampled profile; the views below are also profiled all the
+# time at a lower sampling rate, on a fraction (REQUEST_PROFILER_CONTINUOUS_RATE)
+# of their requests. Collapsed-stack files go to REQUEST_PROFILER_DIR and are
+# listed under Request Profiles in the admin.
+REQUEST_PROFILER_DIR = os.getenv('REQUEST_PROFILER_DIR', BASE_DIR / 'profiles')
+REQUEST_PROFILER_INTERVAL_MS = 1
+REQUEST_PROFILER_CONTINUOUS_VIEWS = ['checkout:checkout', 'checkout:stk_status', 'checkout:payment_callback']
+REQUEST_PROFILER_CONTINUOUS_RATE = float(os.getenv('REQUEST_PROFILER_CONTINUOUS_RATE', '0.05'))
+REQUEST_PROFILER_CONTINUOUS_INTERVAL_MS = 10
+REQUEST_PROFILER_FLUSH_INTERVAL = int(os.getenv('REQUEST_PROFILER_FLUSH_INTERVAL', '60'))
+REQUEST_PROFILER_RETENTION_DAYS = 7
+
 # ==================== PASSWORD VALIDATION ====================
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -265,7 +305,7 @@ UNFOLD = {
                         "title": "Orders",
                         "icon": "shopping_cart_checkout",
                         "link": reverse_lazy("admin:checkout_order_changelist"),
-                        "badge": "sample_pending_count", # You can create a template tag for this later
+                        "badge": "checkout.admin.pending_orders_badge",
                     },
                     {
                         "title": "Delivery Zones",
@@ -347,6 +387,27 @@ UNFOLD = {
                     },
                 ],
             },
+            {
+                "title": "Performance",
+                "separator": True,
+                "items": [
+                    {
+                        "title": "Performance Report",
+                        "icon": "speed",
+                        "link": reverse_lazy("admin:core_requeststat_report"),
+                    },
+                    {
+                        "title": "Request Metrics",
+                        "icon": "monitoring",
+                        "link": reverse_lazy("admin:core_requeststat_changelist"),
+                    },
+                    {
+                        "title": "Request Profiles",
+                        "icon": "local_fire_department",
+                        "link": reverse_lazy("admin:core_requestprofile_changelist"),
+                    },
+                ],
+            },
         ],
     },
     
@@ -0,0 +1,104 @@
+# cart/cache.py
+"""
+Cached per-user cart summary for the header badge.
+
+The summary (distinct items, total quantity, subtotal) is one aggregate
+query, cached per user. CartItem changes delete it (cart/signals.py) and the
+key includes the catalog version, so price changes are picked up too.
+Items whose product, basket or merchandise was deleted are left out, as
+cart.pricing.price_cart leaves them out of the cart page.
+
+A transaction that changes many items (clearing a cart after payment)
+looks each cart's owner up once and drops the summaries in one
+delete_many when it commits.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from products.cache import catalog_version
+from .models import Cart, CartItem
+
+SUMMARY_TIMEOUT = 60 * 60
+
+CartSummary = namedtuple('CartSummary', ['item_count', 'total_items', 'subtotal'])
+
+EMPTY_SUMMARY = CartSummary(0, 0, Decimal('0.00'))
+
+
+def _summary_key(user_id):
+    return f'cart:summary:{user_id}:{catalog_version()}'
+
+
+def build_cart_summary(user_id):
+    """Compute the summary of a user's cart with one query"""
+    unit_price = Coalesce(
+        'product__price', 'basket__price', 'merchandise__price', Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=10, decimal_places=2)
+    )
+    priceable = Q(product__isnull=False) | Q(basket__isnull=False) | Q(merchandise__isnull=False)
+    values = CartItem.objects.filter(priceable, cart__user_id=user_id).aggregate(
+        item_count=Count('id'),
+        total_items=Coalesce(Sum('quantity'), Value(0), output_field=IntegerField()),
+        subtotal=Coalesce(
+            Sum(F('quantity') * unit_price, output_field=DecimalField(max_digits=12, decimal_places=2)),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        ),
+    )
+    return CartSummary(**values)
+
+
+def get_cart_summary(user):
+    """The user's cart summary, from the cache when possible (empty for anonymous users)"""
+    if not user.is_authenticated:
+        return EMPTY_SUMMARY
+    key = _summary_key(user.pk)
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_cart_summary(user.pk)
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+class _Invalidation:
+    """on_commit callback dropping the summaries of the carts a transaction changed"""
+
+    def __init__(self):
+        # cart id -> owner's user id (None for a cart that no longer exists)
+        self.user_ids = {}
+
+    def __call__(self):
+        keys = [_summary_key(user_id) for user_id in set(self.user_ids.values()) if user_id is not None]
+        if keys:
+            cache.delete_many(keys)
+
+
+def _pending_invalidation():
+    """This transaction's _Invalidation (it goes away with the transaction, committed or rolled back)"""
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for sids, func, robust in connection.run_on_commit:
+            if isinstance(func, _Invalidation):
+                return func
+    return None
+
+
+def invalidate_cart_summary(cart_id, user_id=None):
+    """Forget a cart's summary once the current transaction commits (pass user_id when it is known)"""
+    pending = _pending_invalidation()
+    if pending is not None and cart_id in pending.user_ids:
+        return
+    if user_id is None:
+        user_id = Cart.objects.filter(pk=cart_id).values_list('user_id', flat=True).first()
+    new = pending is None
+    if new:
+        pending = _Invalidation()
+    pending.user_ids[cart_id] = user_id
+    if new:
+        # Outside a transaction this runs right away
+        transaction.on_commit(pending)
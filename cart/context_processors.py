@@ -0,0 +1,17 @@
+# cart/context_processors.py
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_cart_summary
+
+
+def _summary(request):
+    # Views that priced the cart already (cart page, checkout) have the numbers
+    priced_cart = getattr(request, 'priced_cart', None)
+    if priced_cart is not None:
+        return priced_cart.summary
+    return get_cart_summary(request.user)
+
+
+def cart_summary(request):
+    # Lazy: pages that never show the badge don't touch the cache
+    return {'cart_summary': SimpleLazyObject(lambda: _summary(request))}
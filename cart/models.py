@@ -23,13 +23,18 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart of {self.user.get_full_name() or self.user.username}"
 
+    def priced(self):
+        """The cart with its prices and stock, see cart/pricing.py"""
+        from .pricing import price_cart
+        return price_cart(self)
+
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.priced().subtotal
 
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.priced().total_items
 
     @property
     def item_count(self):
@@ -0,0 +1,109 @@
+# cart/pricing.py
+"""
+Pricing a cart in a fixed number of queries.
+
+price_cart() loads the cart's items with their product, basket or
+merchandise in one query and the stock of every basket in the cart in one
+more (ProductBasket.get_stock_map), whatever the cart holds. The result is
+an immutable PricedCart: the lines with their unit and total prices and
+stock, the subtotal and whether everything can be supplied. The cart page,
+the checkout page and the order snapshot all work from it, and it doubles
+as the header summary on those pages.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from products.models import ProductBasket
+from .cache import CartSummary
+
+
+class PricedLine(namedtuple('PricedLine', [
+    'id', 'kind', 'product', 'basket', 'merchandise', 'name',
+    'quantity', 'unit_price', 'total_price', 'stock', 'is_active',
+])):
+    """One cart item, priced. Quacks like CartItem for the templates."""
+    __slots__ = ()
+
+    def __str__(self):
+        suffix = {'basket': ' (Basket)', 'merchandise': ' (Merch)'}.get(self.kind, '')
+        return f"{self.quantity} × {self.name}{suffix}"
+
+    @property
+    def item(self):
+        """The product, basket or merchandise this line is for"""
+        return self.product or self.basket or self.merchandise
+
+    @property
+    def available(self):
+        return self.is_active and self.stock >= self.quantity
+
+
+class PricedCart(namedtuple('PricedCart', ['cart_id', 'lines', 'subtotal'])):
+    __slots__ = ()
+
+    @property
+    def item_count(self):
+        return len(self.lines)
+
+    @property
+    def total_items(self):
+        return sum(line.quantity for line in self.lines)
+
+    @property
+    def is_empty(self):
+        return not self.lines
+
+    @property
+    def unavailable_lines(self):
+        return tuple(line for line in self.lines if not line.available)
+
+    @property
+    def is_available(self):
+        """True when every line is active and in stock"""
+        return not self.unavailable_lines
+
+    @property
+    def summary(self):
+        """The header badge numbers (cart.cache.CartSummary)"""
+        return CartSummary(self.item_count, self.total_items, self.subtotal)
+
+
+def _line(cart_item, basket_stock):
+    if cart_item.product_id:
+        kind, item, stock = 'product', cart_item.product, cart_item.product.stock
+    elif cart_item.basket_id:
+        kind, item = 'basket', cart_item.basket
+        stock = basket_stock.get(item.id, 0)
+        item._prefetched_stock = stock
+    else:
+        kind, item, stock = 'merchandise', cart_item.merchandise, cart_item.merchandise.stock
+    unit_price = item.price
+    return PricedLine(
+        id=cart_item.id,
+        kind=kind,
+        product=cart_item.product if kind == 'product' else None,
+        basket=cart_item.basket if kind == 'basket' else None,
+        merchandise=cart_item.merchandise if kind == 'merchandise' else None,
+        name=item.name,
+        quantity=cart_item.quantity,
+        unit_price=unit_price,
+        total_price=unit_price * cart_item.quantity,
+        stock=stock,
+        is_active=item.is_active,
+    )
+
+
+def price_cart(cart):
+    """Price `cart` (a Cart) in at most two queries; returns a PricedCart"""
+    cart_items = [
+        cart_item
+        for cart_item in cart.items.select_related('product', 'basket', 'merchandise').order_by('added_at', 'id')
+        # Items whose product/basket/merchandise was deleted (SET_NULL) cannot be priced
+        if cart_item.product_id or cart_item.basket_id or cart_item.merchandise_id
+    ]
+    basket_ids = {cart_item.basket_id for cart_item in cart_items if cart_item.basket_id}
+    basket_stock = ProductBasket.get_stock_map(basket_ids) if basket_ids else {}
+
+    lines = tuple(_line(cart_item, basket_stock) for cart_item in cart_items)
+    subtotal = sum((line.total_price for line in lines), Decimal('0.00'))
+    return PricedCart(cart.pk, lines, subtotal)
@@ -1,12 +1,20 @@
 # cart/signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import Cart
+from .cache import invalidate_cart_summary
+from .models import Cart, CartItem
 
 User = get_user_model()
 
 @receiver(post_save, sender=User)
 def create_user_cart(sender, instance, created, **kwargs):
     if created:
-        Cart.objects.create(user=instance)
\ No newline at end of file
+        Cart.objects.create(user=instance)
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def cart_item_changed(sender, instance, **kwargs):
+    """Drop the cached header summary of the item's cart"""
+    # The owner comes free when the item was reached through its cart
+    user_id = instance.cart.user_id if CartItem.cart.is_cached(instance) else None
+    invalidate_cart_summary(instance.cart_id, user_id)
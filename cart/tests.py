@@ -1,3 +1,45 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from products.models import Merchandise, Product
+
+from .cache import EMPTY_SUMMARY, CartSummary, _summary_key, get_cart_summary
+from .models import CartItem
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CartSummaryTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'secret')
+        self.product = Product.objects.create(name="Summary product", slug="summary-product",
+                                              price=Decimal('100'), stock=5, description="Product")
+        self.mug = Merchandise.objects.create(name="Summary mug", price=Decimal('40'), stock=5, description="Mug")
+        self.user.cart.items.create(product=self.product, quantity=2)
+        self.user.cart.items.create(merchandise=self.mug, quantity=1)
+
+    def test_summary(self):
+        self.assertEqual(get_cart_summary(self.user), CartSummary(2, 3, Decimal('240.00')))
+        self.user.cart.items.filter(merchandise=self.mug).update(quantity=4)
+        # Cached until an item signal drops it
+        self.assertEqual(get_cart_summary(self.user), CartSummary(2, 3, Decimal('240.00')))
+        self.user.cart.items.get(merchandise=self.mug).delete()
+        self.assertEqual(get_cart_summary(self.user), CartSummary(1, 2, Decimal('200.00')))
+
+    def test_clearing_a_cart_looks_the_owner_up_once(self):
+        get_cart_summary(self.user)
+        self.assertIsNotNone(cache.get(_summary_key(self.user.pk)))
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                CartItem.objects.filter(cart=self.user.cart).delete()
+                # Not before the commit
+                self.assertIsNotNone(cache.get(_summary_key(self.user.pk)))
+        lookups = [query['sql'] for query in queries if 'FROM "cart_cart"' in query['sql']]
+        self.assertEqual(len(lookups), 1)
+        self.assertIsNone(cache.get(_summary_key(self.user.pk)))
+        self.assertEqual(get_cart_summary(self.user), EMPTY_SUMMARY)
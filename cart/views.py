@@ -6,14 +6,20 @@ from django.views.decorators.http import require_POST
 
 from products.models import Product, ProductBasket, Merchandise
 from .models import Cart, CartItem
+from .pricing import price_cart
 
 
 @login_required
 def cart_detail(request):
     """Display the user's cart. Creates cart if missing."""
     cart, created = Cart.objects.get_or_create(user=request.user)
+    priced_cart = price_cart(cart)
+    # Also feeds the header badge (cart.context_processors)
+    request.priced_cart = priced_cart
     return render(request, 'cart/cart_detail.html', {
         'cart': cart,
+        'priced_cart': priced_cart,
+        'cart_items': priced_cart.lines,
     })
 
 
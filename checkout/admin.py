@@ -1,12 +1,19 @@
 from django.contrib import admin
-from django.utils.html import format_html
-from .models import DeliveryZone, Order, OrderItem
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+from .models import DeliveryZone, MpesaCallback, Order, OrderItem
 
 # --- UNFOLD IMPORTS ---
 from unfold.admin import ModelAdmin, TabularInline
 from unfold.decorators import display
 # ----------------------
 
+def pending_orders_badge(request):
+    """Sidebar badge on Orders (UNFOLD SIDEBAR in settings): orders awaiting payment"""
+    # Runs on every admin page: one COUNT on the (status, created_at) index, not every status
+    return Order.objects.filter(status='pending').count() or None
+
+
 @admin.register(DeliveryZone)
 class DeliveryZoneAdmin(ModelAdmin):
     list_display = ('name', 'fee_display', 'is_active', 'created_at')
@@ -39,11 +46,7 @@ class OrderItemInline(TabularInline):
         if not obj or not obj.pk:
             return "-"
             
-        if obj.product:
-            return obj.product.name
-        elif obj.basket:
-            return f"{obj.basket.name} (Combo)"
-        return "Unknown Item"
+        return obj.display_name
 
     @display(description="Unit Price")
     def unit_price_display(self, obj):
@@ -69,9 +72,10 @@ class OrderAdmin(ModelAdmin):
         'zone',
         'total_amount_display',
         'status_badge',
+        'stock_badge',
         'created_at',
     )
-    list_filter = ('status', 'zone', 'created_at')
+    list_filter = ('status', 'stock_short', 'zone', 'created_at')
     search_fields = ('id', 'user__username', 'user__email', 'phone_number', 'mpesa_receipt_number')
     inlines = [OrderItemInline]
     ordering = ('-created_at',)
@@ -89,12 +93,17 @@ class OrderAdmin(ModelAdmin):
             'fields': ('subtotal_amount', 'delivery_fee', 'total_amount', 'mpesa_receipt_number', 'checkout_request_id'),
             'classes': ('tab',),
         }),
+        ('Stock', {
+            'fields': ('stock_short', 'shortfall_display'),
+            'classes': ('tab',),
+            'description': 'Uncheck "stock short" once the missing stock has been sorted out.',
+        }),
     )
 
     readonly_fields = (
         'subtotal_amount', 'delivery_fee', 'total_amount', 
         'checkout_request_id', 'mpesa_receipt_number', 
-        'created_at', 'updated_at'
+        'created_at', 'updated_at', 'shortfall_display'
     )
 
     @display(description="Order #", ordering="id")
@@ -127,4 +136,52 @@ class OrderAdmin(ModelAdmin):
         }
     )
     def status_badge(self, obj):
-        return obj.get_status_display()
\ No newline at end of file
+        return obj.get_status_display()
+
+    @display(description="Stock", label={'Short': 'danger'})
+    def stock_badge(self, obj):
+        return "Short" if obj.stock_short else ""
+
+    @display(description="Shortfall")
+    def shortfall_display(self, obj):
+        if not obj.stock_shortfall:
+            return "-"
+        return format_html_join(
+            mark_safe('<br>'), "{} #{}: needed {}, had {} (order line {})",
+            ((f['kind'], f['object_id'], f['requested'], f['available'], f['line']) for f in obj.stock_shortfall),
+        )
+
+
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(ModelAdmin):
+    list_display = ('checkout_request_id', 'result_code', 'status_badge', 'deliveries', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'result_code')
+    search_fields = ('checkout_request_id',)
+    readonly_fields = (
+        'checkout_request_id', 'result_code', 'payload', 'status', 'deliveries',
+        'attempts', 'last_error', 'received_at', 'processed_at',
+    )
+    actions = ['reprocess']
+    ordering = ('-received_at',)
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    @display(
+        description="Status",
+        label={
+            'pending': 'warning',
+            'processed': 'success',
+            'orphaned': 'info',
+            'error': 'danger',
+        }
+    )
+    def status_badge(self, obj):
+        return obj.get_status_display()
+
+    @admin.action(description="Process selected callbacks again")
+    def reprocess(self, request, queryset):
+        # Processed ones are left alone - their order has already been updated
+        count = queryset.filter(status__in=['orphaned', 'error']).update(status='pending', attempts=0, last_error='')
+        self.message_user(request, f"{count} callback(s) queued for processing.")
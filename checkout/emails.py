@@ -0,0 +1,38 @@
+# checkout/emails.py
+"""Order emails, sent in the background through core.jobs"""
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from core.jobs import enqueue_email
+from .models import Order
+
+
+def queue_order_confirmation_email(order):
+    """Queue the confirmation email for a paid order (once per order, however often it is called)"""
+    return enqueue_email('order_confirmation', f'order-confirmation:{order.id}', {'order_id': order.id})
+
+
+def build_order_confirmation_email(payload):
+    """Order confirmation email with receipt details"""
+    order = Order.objects.select_related('user').filter(pk=payload['order_id']).first()
+    if order is None:
+        return None
+
+    context = {
+        'order': order,
+        'customer_name': order.user.get_full_name() or order.user.email,
+        'order_items': order.order_items.all(),
+        'site_url': settings.SITE_URL,
+    }
+    html_content = render_to_string('checkout/emails/order_confirmation.html', context)
+
+    email = EmailMultiAlternatives(
+        subject=f'Order Confirmation #{order.id} - Arifarm',
+        body=strip_tags(html_content),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[order.email],
+    )
+    email.attach_alternative(html_content, "text/html")
+    return email
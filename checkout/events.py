@@ -0,0 +1,86 @@
+# checkout/events.py
+"""
+Payment status pushed to the pending page as Server-Sent Events.
+
+Under ASGI (backend/asgi.py) each waiting customer holds one connection to
+payment_events_view instead of POSTing to stk_status_view every few
+seconds. The callback, the reconciler and the admin usually run in other
+processes, so they cannot wake the stream directly: whoever changes a
+payment status calls publish_status(), which writes a small cache key
+once the transaction commits. The stream watches that key (a cache read,
+no query) and only reads the order again when it changes, plus every
+RECHECK_INTERVAL as a safety net.
+"""
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Order
+
+POLL_INTERVAL = 0.5
+RECHECK_INTERVAL = 15
+HEARTBEAT_INTERVAL = 15
+# Matches the pending page's own give-up time; the browser then shows the timeout message
+STREAM_TIMEOUT = 120
+STATUS_TIMEOUT = 60 * 60
+
+
+def _status_key(order_id):
+    return f'payment:status:{order_id}'
+
+
+def publish_status(order_id, status):
+    """Tell streams watching this order that its status changed (after commit)"""
+    # The timestamp makes every publish a change, even to the same status
+    transaction.on_commit(lambda: cache.set(_status_key(order_id), f'{status}:{time.time()}', STATUS_TIMEOUT))
+
+
+# Not cache.aget(): that runs on the single thread-sensitive executor thread, where every
+# open stream would queue behind the others (a file read each with FileBasedCache)
+@sync_to_async(thread_sensitive=False)
+def _read_published(key):
+    return cache.get(key)
+
+
+def status_payload(order):
+    """What the pending page gets for an order: SUCCESS, FAILED or PENDING"""
+    if order.status in Order.PAID_STATUSES:
+        return {"status": "SUCCESS", "message": "Payment received", "order_id": order.id}
+    if order.status in ('failed', 'cancelled'):
+        return {"status": "FAILED", "message": order.payment_result_desc or "Payment failed."}
+    return {"status": "PENDING", "message": "Waiting for M-Pesa confirmation"}
+
+
+def _event(payload, event='status'):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def status_events(order):
+    """Async iterator of SSE messages for `order` until it is settled or the stream times out"""
+    payload = status_payload(order)
+    yield _event(payload)
+    if payload['status'] != 'PENDING':
+        return
+
+    started = last_check = last_sent = time.monotonic()
+    seen = await _read_published(_status_key(order.pk))
+    while time.monotonic() - started < STREAM_TIMEOUT:
+        await asyncio.sleep(POLL_INTERVAL)
+        now = time.monotonic()
+        published = await _read_published(_status_key(order.pk))
+        if published != seen or now - last_check >= RECHECK_INTERVAL:
+            seen, last_check = published, now
+            order = await Order.objects.only('id', 'status', 'payment_result_desc').aget(pk=order.pk)
+            payload = status_payload(order)
+            if payload['status'] != 'PENDING':
+                yield _event(payload)
+                return
+        if now - last_sent >= HEARTBEAT_INTERVAL:
+            # SSE comment line: keeps proxies from closing an idle connection
+            last_sent = now
+            yield ": keep-alive\n\n"
+    yield _event({'status': 'TIMEOUT'})
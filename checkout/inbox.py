@@ -0,0 +1,107 @@
+# checkout/inbox.py
+"""
+Inbox for M-Pesa STK callbacks.
+
+payment_callback only stores the raw callback and acknowledges it, so
+Safaricom gets its answer in one INSERT. `manage.py process_mpesa_callbacks`
+applies them to orders:
+
+- One inbox row per CheckoutRequestID (unique), so redeliveries are
+  counted, not stored or applied again.
+- Each row is claimed by flipping it to 'processed' in the same
+  transaction as the order update, cart clearing and email job. Either
+  all of it commits once or none of it does and the row is retried, up to
+  MAX_ATTEMPTS before it is parked as 'error'.
+- A callback for an order we cannot find yet (the checkout view saves the
+  CheckoutRequestID just after the STK push) is retried for ORPHAN_GRACE
+  before it is parked as 'orphaned'.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import MpesaCallback, Order
+from .payments import apply_payment_result
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+ORPHAN_GRACE = timedelta(minutes=5)
+
+
+class CallbackError(ValueError):
+    """The request is not an STK callback we can read"""
+
+
+def record_callback(payload):
+    """Store a callback (once per CheckoutRequestID); returns (entry, created)"""
+    try:
+        stk_callback = payload["Body"]["stkCallback"]
+        checkout_request_id = str(stk_callback["CheckoutRequestID"])
+        result_code = int(stk_callback["ResultCode"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise CallbackError(f"Malformed STK callback: {e}")
+
+    try:
+        with transaction.atomic():
+            return MpesaCallback.objects.create(
+                checkout_request_id=checkout_request_id, result_code=result_code, payload=payload
+            ), True
+    except IntegrityError:
+        # Redelivery - keep the first copy, just count it
+        MpesaCallback.objects.filter(checkout_request_id=checkout_request_id).update(deliveries=F('deliveries') + 1)
+        logger.info(f"Duplicate M-Pesa callback for {checkout_request_id} ignored")
+        return MpesaCallback.objects.get(checkout_request_id=checkout_request_id), False
+
+
+def _receipt(stk_callback):
+    items = stk_callback.get("CallbackMetadata", {}).get("Item", [])
+    return next((item.get("Value") for item in items if item.get("Name") == "MpesaReceiptNumber"), None)
+
+
+def process_callback(entry):
+    """Apply one inbox entry; returns the outcome ('paid', 'failed', 'orphaned', ...) or None if skipped"""
+    stk_callback = entry.payload["Body"]["stkCallback"]
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            claimed = MpesaCallback.objects.filter(pk=entry.pk, status='pending').update(
+                status='processed', processed_at=now, attempts=F('attempts') + 1
+            )
+            if not claimed:
+                # Another worker has it
+                return None
+            order = Order.objects.select_related('cart').filter(checkout_request_id=entry.checkout_request_id).first()
+            if order is None:
+                if now - entry.received_at < ORPHAN_GRACE:
+                    # Roll back the claim and look again on a later pass
+                    transaction.set_rollback(True)
+                    return None
+                MpesaCallback.objects.filter(pk=entry.pk).update(status='orphaned')
+                logger.warning(f"M-Pesa callback for unknown CheckoutRequestID {entry.checkout_request_id}")
+                return 'orphaned'
+            # The callback is final: any non-zero code fails the order (unless it was paid meanwhile)
+            return apply_payment_result(
+                order, entry.result_code, stk_callback.get("ResultDesc", "Payment failed"),
+                receipt=_receipt(stk_callback), final=True,
+            )
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        attempts = entry.attempts + 1
+        status = 'error' if attempts >= MAX_ATTEMPTS else 'pending'
+        MpesaCallback.objects.filter(pk=entry.pk).update(status=status, attempts=attempts, last_error=error)
+        logger.error(f"Processing M-Pesa callback {entry.checkout_request_id} failed (attempt {attempts}): {error}")
+        return 'error'
+
+
+def process_pending(limit=100):
+    """Apply waiting callbacks, oldest first; returns {outcome: count}"""
+    counts = {}
+    for entry in MpesaCallback.objects.filter(status='pending').order_by('received_at')[:limit]:
+        outcome = process_callback(entry)
+        if outcome:
+            counts[outcome] = counts.get(outcome, 0) + 1
+    return counts
@@ -0,0 +1,232 @@
+# checkout/management/commands/load_checkout.py
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from cart.models import CartItem
+from checkout.events import HEARTBEAT_INTERVAL
+from checkout.forms import TIME_SLOT_CHOICES
+from checkout.models import DeliveryZone
+from checkout.simulator import STATS_PATH
+from products.management.benchmark import percentile
+from products.models import Product
+
+User = get_user_model()
+
+# Safaricom's sandbox test number - any valid Kenyan number would do for the simulator
+TEST_PHONE = '254708374149'
+CHECKOUT_REQUEST_ID_RE = re.compile(r'const checkoutRequestID = "([^"]+)"')
+EVENTS_URL_RE = re.compile(r'new EventSource\("([^"]+)"\)')
+# Final statuses from the stream and stk_status_view -> outcome
+SETTLED = {'SUCCESS': 'paid', 'FAILED': 'failed', 'TIMEOUT': 'timed out'}
+
+
+def login_cookie(user):
+    """A session for `user` straight in the session store, so the driver needs no password"""
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Push concurrent checkouts through a running site whose MPESA_BASE_URL points at "
+        "`manage.py mpesa_simulator`, and report orders per second and time-to-paid. "
+        "Each checkout waits on the payment events stream (served under ASGI) like the pending "
+        "page, or polls stk_status with --wait poll. process_mpesa_callbacks has to be running "
+        "too. Uses the seed_perf customers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="The running site")
+        parser.add_argument('--simulator', default='http://127.0.0.1:8765', help="The simulator, for its counters")
+        parser.add_argument('--checkouts', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--wait', choices=['sse', 'poll'], default='sse',
+                            help="Wait for the payment on the events stream (falling back to polling when "
+                                 "the site has none, like the pending page) or by polling stk_status only")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds between status polls")
+        parser.add_argument('--timeout', type=float, default=120, help="Give up waiting for a payment after this")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/')
+        customers = self.prepare(options['checkouts'], random.Random(options['seed']))
+        zone = DeliveryZone.objects.filter(is_active=True).order_by('pk').first()
+        self.form = {
+            'email': '',
+            'phone_number': TEST_PHONE,
+            'zone': zone.pk,
+            'preferred_delivery_date': (date.today() + timedelta(days=2)).isoformat(),
+            'preferred_delivery_time': TIME_SLOT_CHOICES[0][0],
+        }
+        self.options = options
+        # How each checkout learned its outcome: 'stream' or 'poll'
+        self.waits = Counter()
+        self.waits_lock = threading.Lock()
+        before = self.simulator_stats()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(self.checkout, customers))
+        elapsed = time.perf_counter() - start
+
+        self.report(results, elapsed, before, self.simulator_stats())
+
+    def prepare(self, count, rng):
+        """One seeded customer per checkout, each with a fresh in-stock cart: [(email, session key)]"""
+        users = list(User.objects.filter(username__startswith='perf-user-').order_by('pk')[:count])
+        if len(users) < count:
+            raise CommandError(f"Need {count} seeded customers, found {len(users)} - run seed_perf --users {count}")
+        if not DeliveryZone.objects.filter(is_active=True).exists():
+            raise CommandError("No active delivery zone")
+        products = list(Product.objects.filter(
+            is_active=True, slug__startswith='perf-', stock__gte=count
+        ).values_list('pk', flat=True))
+        if not products:
+            raise CommandError("No seeded product has enough stock - run seed_perf")
+
+        CartItem.objects.filter(cart__user__in=users).delete()
+        items = []
+        for user in users:
+            for product_id in rng.sample(products, min(len(products), rng.randint(1, 3))):
+                items.append(CartItem(cart_id=user.cart.pk, product_id=product_id, quantity=1))
+        CartItem.objects.bulk_create(items)
+        return [(user.email, login_cookie(user)) for user in users]
+
+    def checkout(self, customer):
+        """One customer's checkout: (outcome, seconds to the STK push, seconds to the final status)"""
+        email, session_key = customer
+        session = requests.Session()
+        session.cookies.set(settings.SESSION_COOKIE_NAME, session_key)
+        start = time.perf_counter()
+        try:
+            page = session.get(f"{self.base_url}{reverse('checkout:checkout')}", timeout=30)
+            if page.status_code != 200:
+                return f'checkout page {page.status_code}', None, None
+            csrf_token = session.cookies.get(settings.CSRF_COOKIE_NAME, '')
+            response = session.post(
+                f"{self.base_url}{reverse('checkout:checkout')}",
+                data={**self.form, 'email': email, 'csrfmiddlewaretoken': csrf_token},
+                headers={'Referer': self.base_url}, timeout=60,
+            )
+            pushed = time.perf_counter() - start
+            match = CHECKOUT_REQUEST_ID_RE.search(response.text)
+            if not match:
+                return 'push failed', pushed, None
+
+            deadline = time.perf_counter() + self.options['timeout']
+            events = EVENTS_URL_RE.search(response.text)
+            outcome = None
+            if self.options['wait'] == 'sse' and events:
+                outcome = self.listen(session, events.group(1), deadline)
+            if outcome is None:
+                outcome = self.poll(session, match.group(1), csrf_token, deadline)
+            else:
+                self.count_wait('stream')
+            if outcome in ('paid', 'failed'):
+                return outcome, pushed, time.perf_counter() - start
+            return outcome, pushed, None
+        except (requests.RequestException, ValueError) as e:
+            return f'error: {type(e).__name__}', None, None
+
+    def count_wait(self, how):
+        with self.waits_lock:
+            self.waits[how] += 1
+
+    def listen(self, session, events_path, deadline):
+        """
+        Wait on the payment events stream, as the pending page does first.
+        Returns the outcome, or None when there is no stream (204 under WSGI)
+        or it dropped - the page then falls back to polling, and so do we.
+        """
+        try:
+            # Heartbeats come every HEARTBEAT_INTERVAL, so a longer silence means the stream is gone
+            with session.get(f"{self.base_url}{events_path}", stream=True,
+                             timeout=(30, HEARTBEAT_INTERVAL + 15)) as response:
+                if response.status_code != 200:
+                    return None
+                event, data = None, []
+                for line in response.iter_lines():
+                    line = line.decode('utf-8')
+                    if line:
+                        field, _, value = line.partition(':')
+                        if field == 'event':
+                            event = value.strip()
+                        elif field == 'data':
+                            data.append(value.strip())
+                        continue
+                    # A blank line ends the message
+                    if event == 'status' and data:
+                        status = json.loads('\n'.join(data)).get('status')
+                        if status in SETTLED:
+                            return SETTLED[status]
+                    event, data = None, []
+                    if time.perf_counter() >= deadline:
+                        return 'timed out'
+        except (requests.RequestException, ValueError):
+            pass
+        return None
+
+    def poll(self, session, checkout_request_id, csrf_token, deadline):
+        """Poll stk_status_view like the pending page does without a stream; returns the outcome"""
+        self.count_wait('poll')
+        while time.perf_counter() < deadline:
+            time.sleep(self.options['poll'])
+            status = session.post(
+                f"{self.base_url}{reverse('checkout:stk_status')}",
+                json={'checkout_request_id': checkout_request_id},
+                headers={'X-CSRFToken': csrf_token}, timeout=30,
+            ).json().get('status')
+            if status in ('SUCCESS', 'FAILED'):
+                return SETTLED[status]
+        return 'timed out'
+
+    def simulator_stats(self):
+        try:
+            return requests.get(f"{self.options['simulator'].rstrip('/')}{STATS_PATH}", timeout=5).json()
+        except (requests.RequestException, ValueError):
+            return None
+
+    def report(self, results, elapsed, before, after):
+        outcomes = Counter(outcome for outcome, pushed, settled in results)
+        pushes = [pushed for outcome, pushed, settled in results if pushed is not None]
+        to_paid = [settled for outcome, pushed, settled in results if outcome == 'paid']
+
+        self.stdout.write(f"{len(results)} checkouts in {elapsed:.1f}s: " + ', '.join(
+            f"{count} {outcome}" for outcome, count in outcomes.most_common()
+        ))
+        self.stdout.write(
+            f"Orders paid per second: {len(to_paid) / elapsed:.2f} "
+            f"(checkouts per second: {len(results) / elapsed:.2f})"
+        )
+        if self.waits:
+            self.stdout.write("Waited on: " + ', '.join(
+                f"{count} {how}" for how, count in self.waits.most_common()
+            ))
+        for label, samples in (('Checkout POST', pushes), ('Time to paid', to_paid)):
+            if samples:
+                self.stdout.write(
+                    f"{label}: p50 {percentile(samples, 0.5):.2f}s, p95 {percentile(samples, 0.95):.2f}s, "
+                    f"p99 {percentile(samples, 0.99):.2f}s, max {max(samples):.2f}s"
+                )
+        if before is not None and after is not None:
+            changed = {name: count - before.get(name, 0) for name, count in after.items()}
+            self.stdout.write("Simulator: " + ', '.join(
+                f"{name} {count}" for name, count in sorted(changed.items()) if count
+            ))
@@ -0,0 +1,57 @@
+# checkout/management/commands/mpesa_simulator.py
+from django.core.management.base import BaseCommand, CommandError
+
+from checkout.simulator import STATS_PATH, Simulator, make_server, parse_outcomes, parse_range
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the Daraja OAuth, STK push and STK query endpoints. "
+        "Start the web server with MPESA_BASE_URL pointing here."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', default='50-300', help="Per-call latency range, e.g. 50-300")
+        parser.add_argument('--outcomes', default='0=85,1032=8,1=4,2001=2,4999=1',
+                            help="Weighted result codes: 0, 1, 1032, 2001 and 4999 (never settles)")
+        parser.add_argument('--callback-delay', default='2-10',
+                            help="Seconds between the push and its callback, e.g. 2-10")
+        parser.add_argument('--callback-url', help="Send callbacks here instead of the push's CallBackURL")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Share of API calls answered with a transient 503")
+        parser.add_argument('--drop-rate', type=float, default=0.0,
+                            help="Share of callbacks never sent (the reconciler has to settle those)")
+        parser.add_argument('--duplicate-rate', type=float, default=0.0,
+                            help="Share of callbacks sent twice")
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            simulator = Simulator(
+                latency=parse_range(options['latency_ms']),
+                outcomes=parse_outcomes(options['outcomes']),
+                callback_delay=parse_range(options['callback_delay']),
+                callback_url=options['callback_url'],
+                error_rate=options['error_rate'],
+                drop_rate=options['drop_rate'],
+                duplicate_rate=options['duplicate_rate'],
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        server = make_server(simulator, options['host'], options['port'])
+        base_url = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(f"Daraja simulator on {base_url} - set MPESA_BASE_URL={base_url}")
+        self.stdout.write(f"Counters: {base_url}{STATS_PATH}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            simulator.close()
+            _, stats = simulator.snapshot()
+            self.stdout.write(', '.join(f"{name} {count}" for name, count in sorted(stats.items())))
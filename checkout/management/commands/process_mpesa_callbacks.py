@@ -0,0 +1,29 @@
+# checkout/management/commands/process_mpesa_callbacks.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout.inbox import process_pending
+
+
+class Command(BaseCommand):
+    help = "Apply stored M-Pesa callbacks to their orders. Run one alongside the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process what is waiting and exit (for cron)")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to sleep when the inbox is empty")
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                counts = process_pending(options['batch_size'])
+                if counts:
+                    self.stdout.write(', '.join(f"{count} {outcome}" for outcome, count in sorted(counts.items())))
+                if options['once']:
+                    break
+                if not counts:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
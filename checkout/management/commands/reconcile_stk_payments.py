@@ -0,0 +1,34 @@
+# checkout/management/commands/reconcile_stk_payments.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout.mpesa import get_client
+from checkout.reconciler import reconcile_once
+
+
+class Command(BaseCommand):
+    help = "Query Safaricom for pending STK payments whose callback has not arrived. Run one alongside the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Do a single pass and exit (for cron)")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between passes")
+        parser.add_argument('--max-queries', type=int, default=50,
+                            help="Most STK queries per pass, to stay under Safaricom's rate limit")
+
+    def handle(self, *args, **options):
+        client = get_client()
+        try:
+            while True:
+                started = time.monotonic()
+                counts = reconcile_once(client, options['max_queries'])
+                if counts['queried']:
+                    self.stdout.write(
+                        f"{counts['queried']} queried: {counts['paid']} paid, {counts['failed']} failed, "
+                        f"{counts['pending']} still pending, {counts['errors']} errors"
+                    )
+                if options['once']:
+                    break
+                time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
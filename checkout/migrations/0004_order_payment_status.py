@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0003_deliveryzone_delivery_fee_order_delivery_fee_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_checked_at',
+            field=models.DateTimeField(blank=True, help_text='Last STK status query by the reconciler', null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_result_desc',
+            field=models.CharField(blank=True, help_text="M-Pesa's reason when the payment failed", max_length=255),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+# Receipt written by the old STK status view before the real one arrived
+PLACEHOLDER_RECEIPT = 'Confirmed via Query'
+
+
+def clear_non_unique_values(apps, schema_editor):
+    """Blank ids and the placeholder receipt would break the new unique indexes - store NULL instead"""
+    Order = apps.get_model('checkout', 'Order')
+    Order.objects.filter(checkout_request_id='').update(checkout_request_id=None)
+    Order.objects.filter(mpesa_receipt_number__in=['', PLACEHOLDER_RECEIPT]).update(mpesa_receipt_number=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0004_order_payment_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_non_unique_values, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='mpesa_receipt_number',
+            field=models.CharField(blank=True, max_length=50, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='MpesaCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('result_code', models.IntegerField()),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('orphaned', 'No Matching Order'), ('error', 'Error')], default='pending', max_length=10)),
+                ('deliveries', models.PositiveIntegerField(default=1)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'M-Pesa Callback',
+                'verbose_name_plural': 'M-Pesa Callbacks',
+                'ordering': ['-received_at'],
+                'indexes': [models.Index(fields=['status', 'received_at'], name='checkout_callback_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def snapshot_item_names(apps, schema_editor):
+    """Copy the product or basket name onto existing order items"""
+    OrderItem = apps.get_model('checkout', 'OrderItem')
+    items = list(OrderItem.objects.filter(item_name='').select_related('product', 'basket'))
+    for item in items:
+        source = item.product or item.basket
+        item.item_name = source.name[:200] if source else ''
+    OrderItem.objects.bulk_update(items, ['item_name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0006_order_status_indexes'),
+        ('products', '0008_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='item_name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='merchandise',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='products.merchandise'),
+        ),
+        migrations.RunPython(snapshot_item_names, migrations.RunPython.noop),
+    ]
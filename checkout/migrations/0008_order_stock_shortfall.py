@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0007_orderitem_merchandise_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_short',
+            field=models.BooleanField(default=False, help_text='Paid, but the stock could not be taken - see the shortfall'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stock_shortfall',
+            field=models.JSONField(blank=True, default=list, help_text='Items that were short when the payment came in'),
+        ),
+    ]
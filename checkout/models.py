@@ -1,11 +1,18 @@
 # checkout/models.py
-from django.db import models
+import logging
+
+from django.db import models, transaction
+from django.db.models import Count, Q
 from django.conf import settings
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from cart.models import Cart
-from products.models import Product, ProductBasket
+from products.models import Merchandise, Product, ProductBasket
+from products.stock import StockLine, decrement_stock
 from datetime import time
 
+logger = logging.getLogger(__name__)
+
 
 class DeliveryZone(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -48,8 +55,13 @@ class Order(models.Model):
     delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
 
-    checkout_request_id = models.CharField(max_length=100, blank=True, null=True)
-    mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True)
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
+    mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True, unique=True)
+    payment_result_desc = models.CharField(max_length=255, blank=True, help_text="M-Pesa's reason when the payment failed")
+    payment_checked_at = models.DateTimeField(null=True, blank=True, help_text="Last STK status query by the reconciler")
+    # Set by mark_paid when the stock could not be taken; staff clear it once resolved
+    stock_short = models.BooleanField(default=False, help_text="Paid, but the stock could not be taken - see the shortfall")
+    stock_shortfall = models.JSONField(default=list, blank=True, help_text="Items that were short when the payment came in")
 
     preferred_delivery_date = models.DateField(null=True, blank=True)
     preferred_delivery_time_start = models.TimeField(null=True, blank=True)
@@ -66,27 +78,165 @@ class Order(models.Model):
         ('failed', 'Payment Failed'),
     ]
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Statuses that mean "payment received"
+    PAID_STATUSES = ('paid', 'confirmed', 'processing', 'out_for_delivery', 'delivered')
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # A customer's orders by status, newest first (profile, pending deliveries)
+            models.Index(fields=['user', 'status', 'created_at'], name='checkout_order_user_status_idx'),
+            # Staff views and the payment workers: all orders in a status by age
+            models.Index(fields=['status', 'created_at'], name='checkout_order_status_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.user.get_full_name() or self.user.username} - {self.status}"
 
+    @classmethod
+    def status_counts(cls, queryset=None):
+        """Number of orders in each status, plus 'total', in a single query"""
+        queryset = cls.objects.all() if queryset is None else queryset
+        return queryset.aggregate(
+            total=Count('id'),
+            **{status: Count('id', filter=Q(status=status)) for status, label in cls.STATUS_CHOICES},
+        )
+
     @property
     def items(self):
         return self.order_items.all()
 
+    def stock_lines(self):
+        """The order's items as StockLines for products.stock.decrement_stock"""
+        lines = []
+        items = self.order_items.values_list('product_id', 'basket_id', 'merchandise_id', 'quantity')
+        for product_id, basket_id, merchandise_id, quantity in items:
+            if product_id:
+                lines.append(StockLine('product', product_id, quantity))
+            elif basket_id:
+                lines.append(StockLine('basket', basket_id, quantity))
+            elif merchandise_id:
+                lines.append(StockLine('merchandise', merchandise_id, quantity))
+        return lines
+
+    def mark_paid(self, receipt=None):
+        """
+        Move the order to 'paid' and take its stock, exactly once.
+        If some item is short, no stock is taken and the order is flagged
+        (stock_short / stock_shortfall) for staff to resolve.
+
+        The status change is a conditional UPDATE, so when the STK query and
+        the M-Pesa callback race only one of them wins. Returns True for the
+        caller that did the transition (and should clear the cart / send the
+        email), False if the order was already paid.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            updated = Order.objects.filter(
+                pk=self.pk, status__in=['pending', 'failed']
+            ).update(status='paid', mpesa_receipt_number=receipt, updated_at=now)
+            if not updated:
+                return False
+            self.status = 'paid'
+            self.mpesa_receipt_number = receipt
+            self.updated_at = now
+
+            failures = decrement_stock(self.stock_lines())
+            if failures:
+                # The customer has paid - keep the order, nothing was taken, and flag it for staff
+                self.stock_short = True
+                self.stock_shortfall = [
+                    {
+                        'kind': failure.kind,
+                        'object_id': failure.object_id,
+                        'requested': failure.requested,
+                        'available': failure.available,
+                        'line': f"{failure.line.kind} #{failure.line.object_id} x {failure.line.quantity}",
+                    }
+                    for failure in failures
+                ]
+                Order.objects.filter(pk=self.pk).update(
+                    stock_short=True, stock_shortfall=self.stock_shortfall
+                )
+        for failure in failures:
+            logger.error(
+                f"Order #{self.id} paid but out of stock: {failure.kind} #{failure.object_id} "
+                f"needs {failure.requested}, has {failure.available}"
+            )
+        return True
+
+
+class MpesaCallback(models.Model):
+    """
+    Inbox of M-Pesa STK callbacks: stored as received, applied to the order
+    by `manage.py process_mpesa_callbacks` (see checkout/inbox.py).
+    One row per CheckoutRequestID, redeliveries only bump `deliveries`.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('orphaned', 'No Matching Order'),
+        ('error', 'Error'),
+    ]
+
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    result_code = models.IntegerField()
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    deliveries = models.PositiveIntegerField(default=1)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "M-Pesa Callback"
+        verbose_name_plural = "M-Pesa Callbacks"
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='checkout_callback_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.checkout_request_id} ({self.result_code}) - {self.status}"
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='order_items')
     product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.SET_NULL)
     basket = models.ForeignKey(ProductBasket, null=True, blank=True, on_delete=models.SET_NULL)
+    merchandise = models.ForeignKey(Merchandise, null=True, blank=True, on_delete=models.SET_NULL)
+    # Snapshot at the time of ordering, so the order still reads right after the item is renamed or deleted
+    item_name = models.CharField(max_length=200, blank=True)
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
-        if self.product:
-            return f"{self.quantity} × {self.product.name}"
-        return f"{self.quantity} × {self.basket.name} (Combo)"
\ No newline at end of file
+        return f"{self.quantity} × {self.display_name}"
+
+    @property
+    def display_name(self):
+        """Name as ordered, marked for combos and merchandise"""
+        name = self.item_name or getattr(self.product or self.basket or self.merchandise, 'name', 'Unknown Item')
+        if self.basket_id:
+            return f"{name} (Combo)"
+        if self.merchandise_id:
+            return f"{name} (Merch)"
+        return name
+
+    @classmethod
+    def from_priced_line(cls, order, line):
+        """Unsaved OrderItem snapshotting a cart.pricing.PricedLine"""
+        return cls(
+            order=order,
+            product=line.product,
+            basket=line.basket,
+            merchandise=line.merchandise,
+            item_name=line.name,
+            quantity=line.quantity,
+            unit_price=line.unit_price,
+            total_price=line.total_price,
+        )
\ No newline at end of file
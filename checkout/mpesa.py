@@ -1,14 +1,42 @@
-import os
+"""
+M-Pesa Daraja API client.
+
+One MpesaClient per process (get_client()) keeps a pooled keep-alive
+requests.Session, so polling the STK status does not pay for a new TCP+TLS
+handshake on every call.
+
+- Retries: timeouts, connection errors and 5xx responses are retried a
+  few times with exponential backoff and jitter. The STK push itself is not
+  idempotent (a retry after a read timeout could prompt the customer
+  twice), so it is only retried when the request cannot have been
+  processed: connection failures and 429/503.
+- OAuth token: shared by all processes through the Django cache. When it
+  runs out, one process fetches a new one under a cache lock while the
+  others wait for it instead of all hitting the OAuth endpoint at once.
+- Metrics: every call's latency is logged and kept per endpoint for
+  client.metrics() (count, errors, retries, p50/p95/max of the recent calls).
+"""
 import base64
-import requests
+import hashlib
+import logging
+import os
+import random
 import re
-import time 
+import threading
+import time
+from collections import deque
 from datetime import datetime
+
+import requests
+from django.core.cache import cache
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # M-Pesa Configuration from .env
 MPESA_CONSUMER_KEY = os.getenv('MPESA_CONSUMER_KEY')
 MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET')
@@ -21,9 +49,23 @@ MPESA_BASE_URL = os.getenv('MPESA_BASE_URL', 'https://sandbox.safaricom.co.ke').
 if not all([MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET, MPESA_PASSKEY, MPESA_SHORTCODE, MPESA_CALLBACK_URL]):
     raise ValueError("Missing required M-Pesa environment variables in .env")
 
-# --- TOKEN CACHING VARIABLES ---
-_cached_token = None
-_token_expiry = 0
+TOKEN_PATH = '/oauth/v1/generate?grant_type=client_credentials'
+STK_PUSH_PATH = '/mpesa/stkpush/v1/processrequest'
+STK_QUERY_PATH = '/mpesa/stkpushquery/v1/query'
+
+# Refresh the token this long before Safaricom says it expires
+TOKEN_EXPIRY_MARGIN = 60
+# How long one process may hold the refresh lock / others wait for its token
+TOKEN_LOCK_TIMEOUT = 20
+
+RETRY_STATUSES = {500, 502, 503, 504}
+# Statuses that mean the request was not processed, safe to retry even for the STK push
+REJECTED_STATUSES = {429, 503}
+
+
+class MpesaError(Exception):
+    """A Daraja call failed (after any retries)"""
+
 
 def format_phone_number(phone: str) -> str:
     """Convert to 254XXXXXXXXX format"""
@@ -37,127 +79,275 @@ def format_phone_number(phone: str) -> str:
     else:
         raise ValueError("Invalid phone number. Use 07xx, 7xx, or 2547xx format.")
 
-def get_access_token() -> str:
-    """Get OAuth access token with caching to prevent 403 Bans"""
-    global _cached_token, _token_expiry
-    
-    current_time = time.time()
-    
-    # Check if we have a valid cached token (buffer of 60 seconds)
-    if _cached_token and current_time < (_token_expiry - 60):
-        return _cached_token
-
-    if not MPESA_CONSUMER_KEY or not MPESA_CONSUMER_SECRET:
-        raise ValueError("MPESA_CONSUMER_KEY or MPESA_CONSUMER_SECRET missing")
-
-    auth_str = f"{MPESA_CONSUMER_KEY}:{MPESA_CONSUMER_SECRET}"
-    encoded_auth = base64.b64encode(auth_str.encode()).decode()
-
-    headers = {
-        "Authorization": f"Basic {encoded_auth}",
-        "Content-Type": "application/json"
-    }
-    url = f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-
-    print(f"[MPESA] Generating NEW Access Token...") # Log only when generating new
+
+def _is_api_error(response):
+    """True for Daraja's own JSON error answers, as opposed to gateway/server failures"""
     try:
-        response = requests.get(url, headers=headers, timeout=15)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if "access_token" in data:
-                # Update Cache
-                _cached_token = data["access_token"]
-                expires_in = int(data.get("expires_in", 3599))
-                _token_expiry = current_time + expires_in
-                return _cached_token
+        return 'errorCode' in response.json()
+    except ValueError:
+        return False
+
+
+class EndpointStats:
+    """Latency numbers for one endpoint in this process"""
+
+    def __init__(self, window=500):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.durations = deque(maxlen=window)
+
+    def snapshot(self):
+        durations = sorted(self.durations)
+
+        def percentile(p):
+            return round(durations[min(len(durations) - 1, int(p * len(durations)))] * 1000, 1) if durations else None
+
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+            'max_ms': round(durations[-1] * 1000, 1) if durations else None,
+        }
+
+
+class MpesaClient:
+    def __init__(self, base_url, consumer_key, consumer_secret, shortcode, passkey, callback_url,
+                 timeout=(5, 20), max_retries=3, backoff=0.5, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.shortcode = shortcode
+        self.passkey = passkey
+        self.callback_url = callback_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Content-Type'] = 'application/json'
+
+        # Per consumer key and environment, so sandbox and production never share a token
+        fingerprint = hashlib.sha256(f"{self.base_url}|{consumer_key}".encode()).hexdigest()[:16]
+        self.token_key = f'mpesa:token:{fingerprint}'
+        self.token_lock_key = f'mpesa:token-lock:{fingerprint}'
+        # This process's copy of the shared token, so most calls skip the cache too
+        self._token = None
+        self._token_expiry = 0
+        self._token_guard = threading.Lock()
+
+        self.stats = {}
+
+    # --- metrics ---
+
+    def _stats(self, endpoint):
+        if endpoint not in self.stats:
+            self.stats[endpoint] = EndpointStats()
+        return self.stats[endpoint]
+
+    def metrics(self):
+        return {endpoint: stats.snapshot() for endpoint, stats in self.stats.items()}
+
+    # --- HTTP ---
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: anywhere up to the exponential delay
+        time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def request(self, method, path, endpoint, idempotent=True, **kwargs):
+        """Send one API call with retries; returns the requests.Response"""
+        stats = self._stats(endpoint)
+        kwargs.setdefault('timeout', self.timeout)
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                duration = time.monotonic() - started
+                # A read timeout means the server may have acted on the request
+                retryable = idempotent or not isinstance(e, requests.ReadTimeout)
+                error = f"{type(e).__name__}: {e}"
+                status = None
             else:
-                raise Exception(f"Access token missing in response: {data}")
-        else:
-            print(f"[MPESA ERROR] Token Response: {response.text}") # Debugging
-            raise Exception(f"HTTP {response.status_code}: {response.text}")
-
-    except requests.exceptions.Timeout:
-        raise Exception("Timeout while getting access token")
-    except requests.exceptions.ConnectionError:
-        raise Exception("Connection error - check internet or M-Pesa sandbox status")
-    except Exception as e:
-        raise Exception(f"Failed to get access token: {str(e)}")
+                duration = time.monotonic() - started
+                status = response.status_code
+                retryable = status in (RETRY_STATUSES if idempotent else REJECTED_STATUSES)
+                error = f"HTTP {status}" if status >= 500 or status == 429 else None
+                if error and status not in REJECTED_STATUSES and _is_api_error(response):
+                    # Daraja answered (e.g. "transaction is being processed") - asking again won't help
+                    error = None
 
-def initiate_stk_push(phone_number: str, amount: int):
-    """Initiate STK Push with full debugging"""
-    try:
-        phone = format_phone_number(phone_number)
-        token = get_access_token() # Uses cache now
+            stats.count += 1
+            stats.durations.append(duration)
+            logger.info(f"[MPESA] {endpoint} {status or '-'} {duration * 1000:.0f}ms (attempt {attempt + 1})")
+
+            if error is None:
+                return response
+            if not retryable or attempt >= self.max_retries:
+                stats.errors += 1
+                if status is not None:
+                    return response
+                raise MpesaError(f"{endpoint} failed: {error}")
+            stats.retries += 1
+            self._sleep_before_retry(attempt)
+            attempt += 1
+
+    # --- OAuth token ---
+
+    def _fetch_token(self):
+        encoded_auth = base64.b64encode(f"{self.consumer_key}:{self.consumer_secret}".encode()).decode()
+        logger.info("[MPESA] Generating NEW Access Token...")
+        response = self.request(
+            'GET', TOKEN_PATH, 'oauth', headers={'Authorization': f"Basic {encoded_auth}"}
+        )
+        if response.status_code != 200:
+            logger.error(f"[MPESA ERROR] Token Response: {response.text}")
+            raise MpesaError(f"Failed to get access token: HTTP {response.status_code}: {response.text}")
+        data = response.json()
+        if "access_token" not in data:
+            raise MpesaError(f"Access token missing in response: {data}")
+        return data["access_token"], int(data.get("expires_in", 3599))
+
+    def get_access_token(self):
+        """A valid OAuth token, fetched by at most one process at a time"""
+        if self._token and time.time() < self._token_expiry:
+            return self._token
+        with self._token_guard:
+            if self._token and time.time() < self._token_expiry:
+                return self._token
+
+            deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+            while True:
+                cached = cache.get(self.token_key)
+                if cached:
+                    self._token, self._token_expiry = cached
+                    return self._token
+                locked = cache.add(self.token_lock_key, os.getpid(), TOKEN_LOCK_TIMEOUT)
+                if locked:
+                    break
+                if time.monotonic() >= deadline:
+                    # The refreshing process seems stuck, do it ourselves
+                    break
+                time.sleep(0.1)
+
+            try:
+                token, expires_in = self._fetch_token()
+                lifetime = max(1, expires_in - TOKEN_EXPIRY_MARGIN)
+                cache.set(self.token_key, (token, time.time() + lifetime), lifetime)
+                self._token, self._token_expiry = token, time.time() + lifetime
+                return token
+            finally:
+                # After a timed-out wait the lock is still another process's
+                if locked:
+                    cache.delete(self.token_lock_key)
+
+    def _forget_token(self, token):
+        with self._token_guard:
+            if self._token == token:
+                self._token, self._token_expiry = None, 0
+            cached = cache.get(self.token_key)
+            if cached and cached[0] == token:
+                cache.delete(self.token_key)
+
+    def _post(self, path, endpoint, payload, idempotent):
+        """POST with the bearer token; fetches a new token once if it was rejected"""
+        for retry_auth in (True, False):
+            token = self.get_access_token()
+            response = self.request(
+                'POST', path, endpoint, idempotent=idempotent,
+                json=payload, headers={'Authorization': f"Bearer {token}"},
+            )
+            if response.status_code == 401 and retry_auth:
+                # Revoked or expired early - the request was not processed, safe to repeat
+                self._forget_token(token)
+                continue
+            return response
 
+    def _password(self):
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode()
+        password = base64.b64encode(f"{self.shortcode}{self.passkey}{timestamp}".encode()).decode()
+        return password, timestamp
 
+    # --- API ---
+
+    def initiate_stk_push(self, phone_number, amount):
+        phone = format_phone_number(phone_number)
+        password, timestamp = self._password()
         payload = {
-            "BusinessShortCode": MPESA_SHORTCODE,
+            "BusinessShortCode": self.shortcode,
             "Password": password,
             "Timestamp": timestamp,
             "TransactionType": "CustomerPayBillOnline",
             "Amount": amount,
             "PartyA": phone,
-            "PartyB": MPESA_SHORTCODE,
+            "PartyB": self.shortcode,
             "PhoneNumber": phone,
-            "CallBackURL": MPESA_CALLBACK_URL,
+            "CallBackURL": self.callback_url,
             "AccountReference": "ARIFARM",
             "TransactionDesc": "Payment for order on Arifarm",
         }
+        logger.info(f"[MPESA] Sending STK Push to {phone} for KSh {amount}")
+        response = self._post(STK_PUSH_PATH, 'stk_push', payload, idempotent=False)
+        logger.info(f"[MPESA] STK Push response: {response.status_code} - {response.text}")
+        return response.json()
 
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
+    def query_stk_push(self, checkout_request_id):
+        password, timestamp = self._password()
+        payload = {
+            "BusinessShortCode": self.shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
         }
+        response = self._post(STK_QUERY_PATH, 'stk_query', payload, idempotent=True)
+        resp_json = response.json()
+        # Only log if it's NOT a processing (4999) response to keep logs clean
+        if resp_json.get("ResultCode") != "4999":
+            logger.info(f"[MPESA] Query Result: {resp_json}")
+        return resp_json
 
-        url = f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest"
-        print(f"[MPESA] Sending STK Push to {phone} for KSh {amount}")
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=20)
-        print(f"[MPESA] STK Push response: {response.status_code} - {response.text}")
 
-        return response.json()
+_client = None
+_client_guard = threading.Lock()
 
-    except Exception as e:
-        print(f"[MPESA ERROR] STK Push failed: {str(e)}")
-        raise
 
-def query_stk_push(checkout_request_id: str):
-    """Query STK Push status with debugging"""
-    try:
-        token = get_access_token() # Uses cache now
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode()
+def get_client():
+    """This process's shared MpesaClient"""
+    global _client
+    if _client is None:
+        with _client_guard:
+            if _client is None:
+                _client = MpesaClient(
+                    MPESA_BASE_URL, MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET,
+                    MPESA_SHORTCODE, MPESA_PASSKEY, MPESA_CALLBACK_URL,
+                )
+    return _client
 
-        payload = {
-            "BusinessShortCode": MPESA_SHORTCODE,
-            "Password": password,
-            "Timestamp": timestamp,
-            "CheckoutRequestID": checkout_request_id
-        }
 
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
+def get_access_token() -> str:
+    return get_client().get_access_token()
 
-        url = f"{MPESA_BASE_URL}/mpesa/stkpushquery/v1/query"
-        # Removed print statement here to reduce console noise during polling
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=20)
-        
-        # Only print if it's NOT a processing (4999) response to keep logs clean
-        try:
-            resp_json = response.json()
-            if resp_json.get("ResultCode") != "4999": 
-                 print(f"[MPESA] Query Result: {resp_json}")
-            return resp_json
-        except:
-             print(f"[MPESA] Query Raw Response: {response.text}")
-             return response.json()
 
+def initiate_stk_push(phone_number: str, amount: int):
+    """Initiate STK Push"""
+    try:
+        return get_client().initiate_stk_push(phone_number, amount)
     except Exception as e:
-        print(f"[MPESA ERROR] Query failed: {str(e)}")
-        raise
\ No newline at end of file
+        logger.error(f"[MPESA ERROR] STK Push failed: {str(e)}")
+        raise
+
+
+def query_stk_push(checkout_request_id: str):
+    """Query STK Push status"""
+    try:
+        return get_client().query_stk_push(checkout_request_id)
+    except Exception as e:
+        logger.error(f"[MPESA ERROR] Query failed: {str(e)}")
+        raise
@@ -0,0 +1,56 @@
+# checkout/payments.py
+"""
+Applying M-Pesa payment results to orders.
+
+The callback and the STK status reconciler (checkout/reconciler.py) both
+learn about payments; whichever gets there first moves the order, the
+other one finds it done. Side effects (clearing the cart, the
+confirmation email) only happen for the caller that made the transition.
+"""
+import logging
+
+from .emails import queue_order_confirmation_email
+from .events import publish_status
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+SUCCESS_CODE = '0'
+# STK query result codes that mean the payment will not happen:
+# 1 insufficient balance, 1019 expired, 1032 cancelled by the customer,
+# 1037 phone unreachable, 2001 wrong PIN
+FAILURE_CODES = {'1', '1019', '1032', '1037', '2001'}
+
+
+def apply_payment_result(order, result_code, result_desc='', receipt=None, final=False):
+    """
+    Record one M-Pesa result on `order`. Any non-zero code counts as a
+    failure when `final` (the callback is Safaricom's last word), otherwise
+    only FAILURE_CODES do and anything else leaves the order pending.
+    Returns the outcome: 'paid', 'failed' or 'pending'.
+    """
+    result_code = str(result_code)
+    if result_code == SUCCESS_CODE:
+        if order.mark_paid(receipt=receipt):
+            publish_status(order.pk, 'paid')
+            if order.cart_id:
+                order.cart.items.all().delete()
+            queue_order_confirmation_email(order)
+            logger.info(f"Payment SUCCESS → Order #{order.id} | Receipt: {receipt}")
+        elif receipt:
+            # Already paid (the other path got there first) - just fill in the receipt
+            Order.objects.filter(pk=order.pk, status__in=Order.PAID_STATUSES).update(mpesa_receipt_number=receipt)
+        return 'paid'
+
+    if final or result_code in FAILURE_CODES:
+        # Never downgrade an order that has been paid meanwhile
+        updated = Order.objects.filter(pk=order.pk, status='pending').update(
+            status='failed', payment_result_desc=(result_desc or '')[:255]
+        )
+        if updated:
+            order.status = 'failed'
+            order.payment_result_desc = (result_desc or '')[:255]
+            publish_status(order.pk, 'failed')
+            logger.warning(f"Payment FAILED → Order #{order.id} | {result_desc}")
+        return 'failed'
+    return 'pending'
@@ -0,0 +1,94 @@
+# checkout/reconciler.py
+"""
+Server-side STK status checks for pending orders.
+
+The M-Pesa callback normally settles a payment. When it is late or lost,
+`manage.py reconcile_stk_payments` asks Safaricom instead. The pending
+page only reads the order from the database, so this is the only place
+that sends STK queries, however many customers are waiting.
+
+Each pass queries the pending orders that are due:
+- Young orders are checked often, older ones less and less (QUERY_SCHEDULE);
+  after the last step they are no longer queried.
+- Orders sharing a CheckoutRequestID are answered by one query.
+- At most `max_queries` calls per pass, oldest check first, to stay under
+  Safaricom's rate limits.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order
+from .payments import apply_payment_result
+
+logger = logging.getLogger(__name__)
+
+# (order age up to, time between queries); the customer normally needs the
+# first half minute to enter the PIN and the callback usually arrives then
+QUERY_SCHEDULE = [
+    (timedelta(seconds=30), None),
+    (timedelta(minutes=3), timedelta(seconds=10)),
+    (timedelta(minutes=15), timedelta(seconds=30)),
+    (timedelta(hours=1), timedelta(minutes=5)),
+    (timedelta(hours=24), timedelta(minutes=30)),
+]
+
+
+def query_interval(age):
+    """Time between STK queries for an order this old, None while it should not be queried"""
+    for max_age, interval in QUERY_SCHEDULE:
+        if age <= max_age:
+            return interval
+    return None
+
+
+def due_orders(now=None):
+    """Pending orders whose next STK query is due, least recently checked first"""
+    now = now or timezone.now()
+    oldest = now - QUERY_SCHEDULE[-1][0]
+    youngest = now - QUERY_SCHEDULE[0][0]
+    candidates = (
+        Order.objects.filter(
+            status='pending', checkout_request_id__isnull=False,
+            created_at__gte=oldest, created_at__lte=youngest,
+        )
+        .exclude(checkout_request_id='')
+        .select_related('cart')
+        .order_by(F('payment_checked_at').asc(nulls_first=True), 'created_at')
+    )
+    due = []
+    for order in candidates:
+        interval = query_interval(now - order.created_at)
+        if interval is None:
+            continue
+        if order.payment_checked_at is None or now - order.payment_checked_at >= interval:
+            due.append(order)
+    return due
+
+
+def reconcile_once(client, max_queries=50, now=None):
+    """One pass over the due orders; returns counts of queries and outcomes"""
+    now = now or timezone.now()
+    by_request = defaultdict(list)
+    for order in due_orders(now):
+        by_request[order.checkout_request_id].append(order)
+
+    counts = {'queried': 0, 'paid': 0, 'failed': 0, 'pending': 0, 'errors': 0}
+    for checkout_request_id, orders in list(by_request.items())[:max_queries]:
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(payment_checked_at=now)
+        counts['queried'] += 1
+        try:
+            response = client.query_stk_push(checkout_request_id)
+        except Exception as e:
+            logger.warning(f"STK query for {checkout_request_id} failed: {e}")
+            counts['errors'] += 1
+            continue
+        result_code = str(response.get('ResultCode', ''))
+        # Still processing comes back as an errorCode/errorMessage instead of a ResultCode
+        result_desc = response.get('ResultDesc') or response.get('errorMessage', '')
+        for order in orders:
+            counts[apply_payment_result(order, result_code, result_desc)] += 1
+    return counts
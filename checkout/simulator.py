@@ -0,0 +1,296 @@
+# checkout/simulator.py
+"""
+A local stand-in for the Daraja endpoints the shop uses, for load tests.
+
+`manage.py mpesa_simulator` serves the OAuth, STK push and STK query
+endpoints on a local port; point MPESA_BASE_URL at it and the checkout runs
+end to end without the Safaricom sandbox. Each accepted push is given an
+outcome up front (weighted, e.g. 0=85,1032=8,1=4,2001=2,4999=1) and its
+callback is POSTed to the push's CallBackURL after a random delay, like the
+customer answering the prompt on their phone:
+
+- 0 pays, 1 (insufficient balance), 1032 (cancelled) and 2001 (wrong PIN)
+  fail, with the ResultDesc Safaricom sends for them.
+- 4999 never settles: no callback, and the query keeps saying the
+  transaction is still under processing.
+
+Until the callback is due the STK query answers like Daraja does for an
+unanswered prompt (HTTP 500, errorCode 500.001.1001). Latency, transient
+503s, dropped callbacks (only the reconciler can then settle the order) and
+duplicate callbacks (for the inbox) are all configurable.
+"""
+import heapq
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+from .mpesa import STK_PUSH_PATH, STK_QUERY_PATH, TOKEN_PATH
+
+logger = logging.getLogger(__name__)
+
+STATS_PATH = '/simulator/stats'
+
+RESULT_DESCRIPTIONS = {
+    '0': "The service request is processed successfully.",
+    '1': "The balance is insufficient for the transaction.",
+    '1032': "Request cancelled by user",
+    '2001': "The initiator information is invalid.",
+    '4999': "The transaction is still under processing",
+}
+NEVER_SETTLES = '4999'
+STILL_PROCESSING = {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+PUSH_FIELDS = ['BusinessShortCode', 'Password', 'Timestamp', 'Amount', 'PhoneNumber', 'CallBackURL']
+
+
+def parse_range(text):
+    """'50-200' -> (50.0, 200.0); '100' -> (100.0, 100.0)"""
+    low, _, high = text.partition('-')
+    low = float(low)
+    return low, float(high) if high else low
+
+
+def parse_outcomes(text):
+    """'0=85,1032=10,1=5' -> {'0': 85.0, '1032': 10.0, '1': 5.0}"""
+    outcomes = {}
+    for part in text.split(','):
+        code, _, weight = part.strip().partition('=')
+        if code not in RESULT_DESCRIPTIONS:
+            raise ValueError(f"Unsupported result code {code!r} (use {', '.join(RESULT_DESCRIPTIONS)})")
+        outcomes[code] = float(weight or 1)
+    return outcomes
+
+
+class Simulator:
+    """The simulated Daraja state: issued tokens, transactions and the callback schedule"""
+
+    def __init__(self, latency=(0, 0), outcomes=None, callback_delay=(1, 5), callback_url=None,
+                 error_rate=0.0, drop_rate=0.0, duplicate_rate=0.0, seed=None, callback_workers=16):
+        self.latency = latency
+        self.outcomes = outcomes or {'0': 1.0}
+        self.callback_delay = callback_delay
+        self.callback_url = callback_url
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.duplicate_rate = duplicate_rate
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+        self.tokens = set()
+        self.transactions = {}
+        self._numbers = itertools.count(1)
+        # Receipts are unique in the orders table: a second run against the same database needs new ones
+        self._run = uuid.uuid4().hex[:4].upper()
+        self._lock = threading.Lock()
+        self._due = []
+        self._wakeup = threading.Condition(self._lock)
+        self._pool = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix='callback')
+        self._session = requests.Session()
+        self._running = True
+        threading.Thread(target=self._schedule_loop, name='callback-scheduler', daemon=True).start()
+
+    def _random(self, low_high):
+        with self._lock:
+            return self.rng.uniform(*low_high)
+
+    def delay(self):
+        """Simulated network + processing time of one API call"""
+        seconds = self._random(self.latency) / 1000
+        if seconds:
+            time.sleep(seconds)
+
+    def transient_failure(self):
+        with self._lock:
+            return self.rng.random() < self.error_rate
+
+    # --- API ---
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens.add(token)
+            self.stats['tokens'] += 1
+        return 200, {'access_token': token, 'expires_in': '3599'}
+
+    def authorized(self, header):
+        scheme, _, token = (header or '').partition(' ')
+        with self._lock:
+            return scheme == 'Bearer' and token in self.tokens
+
+    def stk_push(self, payload):
+        missing = [field for field in PUSH_FIELDS if not payload.get(field)]
+        if missing:
+            return 400, {'errorCode': '400.002.02', 'errorMessage': f"Bad Request - Invalid {missing[0]}"}
+
+        now = time.time()
+        with self._lock:
+            number = next(self._numbers)
+            codes, weights = zip(*self.outcomes.items())
+            code = self.rng.choices(codes, weights)[0]
+            settles_at = now + self.rng.uniform(*self.callback_delay)
+            dropped = self.rng.random() < self.drop_rate
+            copies = 2 if self.rng.random() < self.duplicate_rate else 1
+            transaction = {
+                'merchant_request_id': f"SIM-{number}",
+                'checkout_request_id': f"ws_CO_{datetime.now():%d%m%Y%H%M%S}{number:09d}",
+                'code': code,
+                'amount': payload['Amount'],
+                'phone': payload['PhoneNumber'],
+                'receipt': f"SIM{self._run}{number:07d}",
+                'callback_url': self.callback_url or payload['CallBackURL'],
+                'settles_at': settles_at,
+            }
+            self.transactions[transaction['checkout_request_id']] = transaction
+            self.stats['pushes'] += 1
+            self.stats[f'outcome_{code}'] += 1
+            if code != NEVER_SETTLES:
+                if dropped:
+                    self.stats['callbacks_dropped'] += 1
+                else:
+                    heapq.heappush(self._due, (settles_at, number, transaction['checkout_request_id'], copies))
+                    self._wakeup.notify()
+
+        return 200, {
+            'MerchantRequestID': transaction['merchant_request_id'],
+            'CheckoutRequestID': transaction['checkout_request_id'],
+            'ResponseCode': '0',
+            'ResponseDescription': "Success. Request accepted for processing",
+            'CustomerMessage': "Success. Request accepted for processing",
+        }
+
+    def stk_query(self, payload):
+        with self._lock:
+            self.stats['queries'] += 1
+            transaction = self.transactions.get(payload.get('CheckoutRequestID'))
+        if transaction is None:
+            return 500, {'errorCode': '500.001.1001', 'errorMessage': "The transaction could not be found"}
+        code = transaction['code']
+        if code != NEVER_SETTLES and time.time() < transaction['settles_at']:
+            return 500, dict(STILL_PROCESSING)
+        return 200, {
+            'ResponseCode': '0',
+            'ResponseDescription': "The service request has been accepted successsfully",
+            'MerchantRequestID': transaction['merchant_request_id'],
+            'CheckoutRequestID': transaction['checkout_request_id'],
+            'ResultCode': code,
+            'ResultDesc': RESULT_DESCRIPTIONS[code],
+        }
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['callbacks_waiting'] = len(self._due)
+        return 200, stats
+
+    # --- Callbacks ---
+
+    def callback_body(self, transaction):
+        code = transaction['code']
+        callback = {
+            'MerchantRequestID': transaction['merchant_request_id'],
+            'CheckoutRequestID': transaction['checkout_request_id'],
+            'ResultCode': int(code),
+            'ResultDesc': RESULT_DESCRIPTIONS[code],
+        }
+        if code == '0':
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': transaction['amount']},
+                {'Name': 'MpesaReceiptNumber', 'Value': transaction['receipt']},
+                {'Name': 'TransactionDate', 'Value': int(f"{datetime.now():%Y%m%d%H%M%S}")},
+                {'Name': 'PhoneNumber', 'Value': int(transaction['phone'])},
+            ]}
+        return {'Body': {'stkCallback': callback}}
+
+    def _deliver(self, transaction, copies):
+        body = self.callback_body(transaction)
+        for _ in range(copies):
+            try:
+                response = self._session.post(transaction['callback_url'], json=body, timeout=10)
+                outcome = 'callbacks_sent' if response.status_code == 200 else 'callbacks_rejected'
+            except requests.RequestException as e:
+                logger.warning(f"Callback for {transaction['checkout_request_id']} failed: {e}")
+                outcome = 'callbacks_failed'
+            with self._lock:
+                self.stats[outcome] += 1
+
+    def _schedule_loop(self):
+        with self._lock:
+            while self._running:
+                if not self._due:
+                    self._wakeup.wait()
+                    continue
+                settles_at, _, checkout_request_id, copies = self._due[0]
+                wait = settles_at - time.time()
+                if wait > 0:
+                    self._wakeup.wait(wait)
+                    continue
+                heapq.heappop(self._due)
+                self._pool.submit(self._deliver, self.transactions[checkout_request_id], copies)
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def make_handler(simulator):
+    class DarajaHandler(BaseHTTPRequestHandler):
+        # Keep-alive, so the client's pooled session is exercised like against Safaricom
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def respond(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == STATS_PATH:
+                return self.respond(*simulator.snapshot())
+            simulator.delay()
+            if path != urlparse(TOKEN_PATH).path:
+                return self.respond(404, {'errorCode': '404.001.01', 'errorMessage': "Resource not found"})
+            if not self.headers.get('Authorization', '').startswith('Basic '):
+                return self.respond(400, {'errorCode': '400.008.02', 'errorMessage': "Invalid grant type passed"})
+            self.respond(*simulator.issue_token())
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except json.JSONDecodeError:
+                return self.respond(400, {'errorCode': '400.002.02', 'errorMessage': "Bad Request - Invalid JSON"})
+            simulator.delay()
+            handlers = {STK_PUSH_PATH: simulator.stk_push, STK_QUERY_PATH: simulator.stk_query}
+            handler = handlers.get(urlparse(self.path).path)
+            if handler is None:
+                return self.respond(404, {'errorCode': '404.001.01', 'errorMessage': "Resource not found"})
+            if not simulator.authorized(self.headers.get('Authorization')):
+                return self.respond(401, {'errorCode': '404.001.03', 'errorMessage': "Invalid Access Token"})
+            if simulator.transient_failure():
+                return self.respond(503, {'errorCode': '503.001.01', 'errorMessage': "Service is currently unavailable"})
+            self.respond(*handler(payload))
+
+    return DarajaHandler
+
+
+def make_server(simulator, host='127.0.0.1', port=8765):
+    server = ThreadingHTTPServer((host, port), make_handler(simulator))
+    server.daemon_threads = True
+    return server
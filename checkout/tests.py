@@ -1,3 +1,113 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
+
+from cart.models import CartItem
+from core.models import EmailJob
+from products.models import Product
+
+from .inbox import ORPHAN_GRACE, CallbackError, process_callback, process_pending, record_callback
+from .models import DeliveryZone, MpesaCallback, Order
+
+
+def stk_callback(checkout_request_id, result_code=0, receipt='RCP123', desc='Done'):
+    callback = {'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code, 'ResultDesc': desc}
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': receipt}]}
+    return {'Body': {'stkCallback': callback}}
+
+
+class CallbackInboxTests(TestCase):
+    """Callbacks are stored once per CheckoutRequestID and applied to their order once"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'secret')
+        zone = DeliveryZone.objects.create(name="Town", delivery_fee=Decimal('100'))
+        product = Product.objects.create(name="Inbox product", slug="inbox-product", price=Decimal('200'),
+                                         stock=5, description="Product")
+        CartItem.objects.create(cart=user.cart, product=product, quantity=1)
+        self.order = Order.objects.create(
+            user=user, cart=user.cart, phone_number='254700000000', email=user.email, zone=zone,
+            subtotal_amount=Decimal('200'), delivery_fee=Decimal('100'), total_amount=Decimal('300'),
+            checkout_request_id='ws_CO_1',
+        )
+
+    def test_redelivery_only_counts(self):
+        first, created = record_callback(stk_callback('ws_CO_1'))
+        self.assertTrue(created)
+        again, created = record_callback(stk_callback('ws_CO_1', receipt='OTHER'))
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(again.deliveries, 2)
+        self.assertEqual(MpesaCallback.objects.count(), 1)
+        # The first copy is the one kept
+        self.assertEqual(again.payload, stk_callback('ws_CO_1'))
+
+    def test_malformed_payloads(self):
+        for payload in [
+            None, [], {}, {'Body': {}}, {'Body': {'stkCallback': None}},
+            {'Body': {'stkCallback': {'ResultCode': 0}}},
+            {'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_1'}}},
+            {'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 'zero'}}},
+        ]:
+            with self.subTest(payload=payload):
+                with self.assertRaises(CallbackError):
+                    record_callback(payload)
+        self.assertFalse(MpesaCallback.objects.exists())
+
+    def test_success_marks_paid_once(self):
+        record_callback(stk_callback('ws_CO_1'))
+        self.assertEqual(process_pending(), {'paid': 1})
+        record_callback(stk_callback('ws_CO_1'))
+        self.assertEqual(process_pending(), {})
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(self.order.mpesa_receipt_number, 'RCP123')
+        self.assertEqual(self.order.cart.items.count(), 0)
+        self.assertEqual(EmailJob.objects.filter(idempotency_key=f'order-confirmation:{self.order.id}').count(), 1)
+        entry = MpesaCallback.objects.get()
+        self.assertEqual((entry.status, entry.attempts, entry.deliveries), ('processed', 1, 2))
+        # A worker still holding the old row finds it claimed
+        self.assertIsNone(process_callback(entry))
+
+    def test_failure_marks_failed_once(self):
+        record_callback(stk_callback('ws_CO_1', result_code=1032, desc='Request cancelled by user'))
+        self.assertEqual(process_pending(), {'failed': 1})
+        self.assertEqual(process_pending(), {})
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'failed')
+        self.assertEqual(self.order.payment_result_desc, 'Request cancelled by user')
+        self.assertEqual(self.order.cart.items.count(), 1)
+        self.assertFalse(EmailJob.objects.exists())
+
+    def test_unknown_order_is_retried_then_orphaned(self):
+        entry, created = record_callback(stk_callback('ws_CO_unknown'))
+        # The checkout view may not have saved the CheckoutRequestID yet
+        self.assertEqual(process_pending(), {})
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), ('pending', 0))
+
+        MpesaCallback.objects.filter(pk=entry.pk).update(received_at=timezone.now() - ORPHAN_GRACE - timedelta(seconds=1))
+        self.assertEqual(process_pending(), {'orphaned': 1})
+        self.assertEqual(process_pending(), {})
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'orphaned')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+
+    def test_error_rolls_back_and_retries(self):
+        record_callback(stk_callback('ws_CO_1'))
+        with mock.patch('checkout.inbox.apply_payment_result', side_effect=RuntimeError("boom")):
+            self.assertEqual(process_pending(), {'error': 1})
+        entry = MpesaCallback.objects.get()
+        self.assertEqual((entry.status, entry.attempts, entry.last_error), ('pending', 1, 'RuntimeError: boom'))
 
-# Create your tests here.
+        self.assertEqual(process_pending(), {'paid': 1})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
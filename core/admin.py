@@ -1,6 +1,10 @@
 # core/admin.py
 from django.contrib import admin
-from django.utils.html import format_html
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 
 # --- UNFOLD IMPORTS ---
@@ -8,7 +12,10 @@ from unfold.admin import ModelAdmin
 from unfold.decorators import display
 # ----------------------
 
-from .models import GalleryCategory, GalleryItem, PromotionalPopup
+from . import profiler
+from .jobs import retry_jobs
+from .models import EmailJob, GalleryCategory, GalleryItem, PromotionalPopup, RequestProfile, RequestStat
+from .views import AdminReportView
 
 @admin.register(GalleryCategory)
 class GalleryCategoryAdmin(ModelAdmin):
@@ -109,4 +116,152 @@ class PromotionalPopupAdmin(ModelAdmin):
 
     @display(description="Link", boolean=True)
     def link_status(self, obj):
-        return bool(obj.link_url)
\ No newline at end of file
+        return bool(obj.link_url)
+
+
+@admin.register(EmailJob)
+class EmailJobAdmin(ModelAdmin):
+    list_display = ('idempotency_key', 'kind', 'status_badge', 'attempts', 'run_after', 'sent_at', 'created_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('idempotency_key', 'last_error')
+    readonly_fields = (
+        'kind', 'idempotency_key', 'payload', 'status', 'attempts', 'run_after',
+        'locked_by', 'locked_at', 'last_error', 'sent_at', 'created_at', 'updated_at',
+    )
+    actions = ['retry_failed']
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    @display(
+        description="Status",
+        label={
+            'pending': 'info',
+            'running': 'warning',
+            'sent': 'success',
+            'failed': 'danger',
+        }
+    )
+    def status_badge(self, obj):
+        return obj.status
+
+    @admin.action(description="Retry selected failed emails")
+    def retry_failed(self, request, queryset):
+        count = retry_jobs(queryset)
+        self.message_user(request, f"{count} email(s) queued again.")
+
+
+@admin.register(RequestStat)
+class RequestStatAdmin(ModelAdmin):
+    """Hourly request metrics written by core.metrics; the report page sits on top of them"""
+    list_display = (
+        'endpoint', 'method', 'bucket', 'requests', 'avg_ms_display', 'max_ms',
+        'avg_queries_display', 'max_repeated_queries', 'errors',
+    )
+    list_filter = ('method', 'bucket')
+    search_fields = ('endpoint', 'repeated_sql')
+    ordering = ('-bucket', '-total_ms')
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                'report/',
+                self.admin_site.admin_view(AdminReportView.as_view(model_admin=self)),
+                name='core_requeststat_report',
+            ),
+        ] + super().get_urls()
+
+    @display(description="Avg ms", ordering='total_ms')
+    def avg_ms_display(self, obj):
+        return f"{obj.avg_ms:.1f}"
+
+    @display(description="Avg queries")
+    def avg_queries_display(self, obj):
+        return f"{obj.avg_queries:.1f}"
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(ModelAdmin):
+    """Profiles written by core.profiler; download them for flamegraph.pl or speedscope"""
+    list_display = (
+        'created_at', 'kind_badge', 'method', 'endpoint', 'path', 'user',
+        'requests', 'samples', 'avg_duration', 'download_link',
+    )
+    list_filter = ('kind', 'method', 'endpoint')
+    search_fields = ('endpoint', 'path')
+    readonly_fields = (
+        'kind', 'endpoint', 'method', 'path', 'user', 'bucket', 'file', 'requests', 'samples',
+        'duration_ms', 'interval_ms', 'created_at', 'updated_at', 'download_link', 'hottest_frames',
+    )
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:pk>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='core_requestprofile_download',
+            ),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not self.has_view_permission(request, profile):
+            raise PermissionDenied
+        try:
+            stacks = profiler.read(profile.file)
+        except OSError:
+            raise Http404("The profile's file is gone")
+        response = HttpResponse(profiler.collapsed(stacks), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{profile.file.rpartition("/")[2]}"'
+        return response
+
+    @display(
+        description="Kind",
+        label={
+            'on_demand': 'info',
+            'continuous': 'success',
+        }
+    )
+    def kind_badge(self, obj):
+        return obj.kind
+
+    @display(description="Avg ms", ordering='duration_ms')
+    def avg_duration(self, obj):
+        return f"{obj.duration_ms / obj.requests:.1f}" if obj.requests else "-"
+
+    @display(description="Collapsed stacks")
+    def download_link(self, obj):
+        return format_html(
+            '<a href="{}" class="text-primary-600">Download</a>',
+            reverse('admin:core_requestprofile_download', args=[obj.pk]),
+        )
+
+    @display(description="Hottest frames (self samples)")
+    def hottest_frames(self, obj):
+        try:
+            frames = profiler.hottest(profiler.read(obj.file))
+        except OSError:
+            return "The profile's file is gone"
+        if not frames:
+            return "No samples"
+        return format_html(
+            '<table>{}</table>',
+            format_html_join('', '<tr><td style="padding-right: 12px;">{}</td><td>{}</td></tr>', (
+                (count, frame) for frame, count in frames
+            )),
+        )
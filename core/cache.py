@@ -0,0 +1,47 @@
+# core/cache.py
+"""
+Cached lookup of the active PromotionalPopup, asked for on every page render.
+
+Two layers: a per-process copy that is reused for LOCAL_TIMEOUT seconds, and
+the shared cache behind it. Saving or deleting a popup clears the shared
+entry and this process's copy (core/signals.py); other processes pick the
+change up within LOCAL_TIMEOUT seconds.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import PromotionalPopup
+
+POPUP_KEY = 'core:active_popup'
+POPUP_TIMEOUT = 60 * 60
+LOCAL_TIMEOUT = 30
+
+# Stored instead of None so "no active popup" is cached too
+NO_POPUP = 'none'
+
+_local_popup = {'expires': 0, 'value': None}
+
+
+def get_active_popup():
+    """The active popup or None, without a query in the common case"""
+    now = time.monotonic()
+    if _local_popup['expires'] > now:
+        return _local_popup['value']
+
+    value = cache.get(POPUP_KEY)
+    if value is None:
+        value = PromotionalPopup.get_active_popup() or NO_POPUP
+        cache.set(POPUP_KEY, value, POPUP_TIMEOUT)
+    popup = None if value == NO_POPUP else value
+
+    _local_popup.update(expires=now + LOCAL_TIMEOUT, value=popup)
+    return popup
+
+
+def invalidate_active_popup():
+    def clear():
+        cache.delete(POPUP_KEY)
+        _local_popup.update(expires=0, value=None)
+    transaction.on_commit(clear)
@@ -1,6 +1,8 @@
 # core/context_processors.py
-from .models import PromotionalPopup
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_active_popup
 
 def promotional_popup(request):
-    popup = PromotionalPopup.get_active_popup()
-    return {'promotional_popup': popup}
\ No newline at end of file
+    # Lazy and cached: templates that never show the popup cost nothing
+    return {'promotional_popup': SimpleLazyObject(get_active_popup)}
@@ -0,0 +1,153 @@
+# core/jobs.py
+"""
+Database-backed queue for outgoing email.
+
+Views never talk to SMTP: they call enqueue_email(), which inserts an
+EmailJob row (in the caller's transaction, so a rolled back payment sends
+nothing) and returns straight away. `manage.py run_email_worker` processes
+pick due jobs up, build the message and send it; several workers can run
+side by side.
+
+- The idempotency key is unique: enqueuing the same email twice (the STK
+  query and the M-Pesa callback both confirming an order, a double submit)
+  gives back the existing job instead of sending again.
+- A job is claimed with a conditional UPDATE, so two workers never send the
+  same job. A worker that dies mid-send leaves the job 'running'; it is
+  claimed again after LOCK_TIMEOUT, so delivery is at least once.
+- Failed sends are retried with exponential backoff and jitter until
+  max_attempts, then left 'failed' for staff to retry from the admin.
+
+Messages are built from the payload when they are sent, so jobs only store
+ids and the email shows the data as it is at sending time.
+"""
+import logging
+import os
+import random
+import socket
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import EmailJob
+
+logger = logging.getLogger(__name__)
+
+# kind -> function(payload) returning the EmailMessage to send, or None if
+# there is nothing to send any more (e.g. the order was deleted)
+EMAIL_BUILDERS = {
+    'order_confirmation': 'checkout.emails.build_order_confirmation_email',
+    'email_verification': 'accounts.emails.build_verification_email',
+}
+
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 60 * 60
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue_email(kind, idempotency_key, payload, delay=None):
+    """Queue an email once per idempotency key; returns (job, created)"""
+    if kind not in EMAIL_BUILDERS:
+        raise ValueError(f"Unknown email kind '{kind}'")
+    run_after = timezone.now() + (delay or timedelta(0))
+    job, created = EmailJob.objects.get_or_create(
+        idempotency_key=idempotency_key,
+        defaults={'kind': kind, 'payload': payload, 'run_after': run_after},
+    )
+    if not created:
+        logger.info(f"Email job '{idempotency_key}' already queued ({job.status}) - not sending again")
+    return job, created
+
+
+def retry_delay(attempt):
+    """Backoff before retry number `attempt` (1, 2, ...): doubling, capped, with jitter"""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    # Jitter so a burst of failures (SMTP down) does not retry in lockstep
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_jobs(worker, limit):
+    """Mark up to `limit` due jobs as running for `worker` and return them"""
+    now = timezone.now()
+    claimable = Q(status='pending', run_after__lte=now) | Q(status='running', locked_at__lt=now - LOCK_TIMEOUT)
+    due = list(EmailJob.objects.filter(claimable).order_by('run_after').values_list('id', flat=True)[:limit])
+    if not due:
+        return []
+    # Re-checking the condition in the UPDATE makes the claim safe against other workers
+    EmailJob.objects.filter(claimable, pk__in=due).update(
+        status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1, updated_at=now
+    )
+    return list(EmailJob.objects.filter(pk__in=due, status='running', locked_by=worker, locked_at=now))
+
+
+def _finish(job, **fields):
+    fields['updated_at'] = timezone.now()
+    # Only if we still hold the job, a worker that timed out must not overwrite the new owner
+    EmailJob.objects.filter(pk=job.pk, locked_by=job.locked_by, locked_at=job.locked_at).update(**fields)
+    for name, value in fields.items():
+        setattr(job, name, value)
+
+
+def run_job(job, connection=None):
+    """Build and send one claimed job; returns True if it was sent"""
+    try:
+        message = import_string(EMAIL_BUILDERS[job.kind])(job.payload)
+        if message is None:
+            _finish(job, status='failed', last_error="Nothing to send")
+            return False
+        if connection is not None:
+            message.connection = connection
+        message.send()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if job.attempts >= job.max_attempts:
+            logger.error(f"Email job '{job.idempotency_key}' failed for good after {job.attempts} attempts: {error}")
+            _finish(job, status='failed', last_error=error)
+        else:
+            delay = retry_delay(job.attempts)
+            logger.warning(
+                f"Email job '{job.idempotency_key}' attempt {job.attempts} failed, "
+                f"retrying in {delay.total_seconds():.0f}s: {error}"
+            )
+            _finish(job, status='pending', last_error=error, run_after=timezone.now() + delay)
+        return False
+    _finish(job, status='sent', sent_at=timezone.now(), last_error='')
+    logger.info(f"Email job '{job.idempotency_key}' sent")
+    return True
+
+
+def process_batch(worker, limit=20):
+    """Claim and send one batch over a single mail connection; returns (sent, failed)"""
+    jobs = claim_jobs(worker, limit)
+    if not jobs:
+        return 0, 0
+    sent = 0
+    connection = get_connection()
+    try:
+        # One SMTP handshake per batch rather than per email
+        connection.open()
+    except Exception as e:
+        # Each send() will try again and the failure is recorded on the job
+        logger.warning(f"Could not open mail connection: {e}")
+    try:
+        for job in jobs:
+            sent += run_job(job, connection)
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return sent, len(jobs) - sent
+
+
+def retry_jobs(queryset):
+    """Put failed jobs back in the queue with a fresh set of attempts (admin action)"""
+    return queryset.filter(status='failed').update(
+        status='pending', attempts=0, run_after=timezone.now(), last_error='', updated_at=timezone.now()
+    )
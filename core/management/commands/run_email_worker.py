@@ -0,0 +1,33 @@
+# core/management/commands/run_email_worker.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import process_batch, worker_name
+
+
+class Command(BaseCommand):
+    help = "Send queued emails (order confirmations, verification links). Run one or more alongside the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Send what is due now and exit (for cron) instead of polling forever")
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help="Seconds to sleep when the queue is empty")
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stdout.write(f"Email worker {worker} started")
+        try:
+            while True:
+                sent, failed = process_batch(worker, options['batch_size'])
+                if sent or failed:
+                    self.stdout.write(f"{sent} sent, {failed} failed")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Email worker {worker} stopped"))
@@ -0,0 +1,392 @@
+# core/management/commands/seed_perf.py
+import random
+import time
+from datetime import datetime, time as dt_time, timedelta
+from itertools import accumulate
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from checkout.models import DeliveryZone, Order, OrderItem
+from products import search
+from products.cache import bump_catalog_version
+from products.models import (
+    BasketItem, Category, Merchandise, Product, ProductBasket, ProductRatingSummary, ProductReview,
+    Recipe, RecipeIngredient,
+)
+from products.sequences import assign_codes
+
+User = get_user_model()
+
+# Every seeded row carries this in its slug, username, code or name, so --flush can find it again
+PREFIX = 'perf'
+PASSWORD = 'perf-password'
+MERCH_CODE_PREFIX = f'{PREFIX.upper()}-MRCH-'
+
+PRODUCE = [
+    'tomato', 'sukuma', 'kale', 'spinach', 'onion', 'garlic', 'avocado', 'mango',
+    'banana', 'pepper', 'carrot', 'cabbage', 'potato', 'maize', 'beans', 'honey',
+    'managu', 'terere', 'dhania', 'lemon', 'ginger', 'pumpkin', 'millet', 'sorghum',
+]
+QUALIFIERS = ['organic', 'fresh', 'green', 'ripe', 'local', 'kienyeji', 'farm', 'red', 'sweet', 'baby']
+UNITS = ['bunch', 'crate', 'kg', 'pack', 'tray', 'bag']
+MERCH = ['t-shirt', 'cap', 'apron', 'tote bag', 'mug', 'water bottle', 'hoodie', 'notebook']
+CUSTOM_INGREDIENTS = ['Salt', 'Cooking oil', 'Water', 'Black pepper', 'Royco', 'Sugar']
+
+# Roughly what the live shop sees: most orders end up paid and delivered
+ORDER_STATUSES = [
+    ('delivered', 50), ('paid', 10), ('confirmed', 5), ('processing', 5), ('out_for_delivery', 3),
+    ('pending', 12), ('failed', 10), ('cancelled', 5),
+]
+TIME_SLOTS = [(9, 12), (12, 15), (15, 18), (18, 21)]
+
+
+def zipf_cum_weights(count):
+    """
+    Cumulative Zipf weights for rng.choices(cum_weights=...): a few items are
+    very popular and most are rarely picked, as in real order data. Passing
+    plain weights would re-add them all on every pick.
+    """
+    return list(accumulate(1 / (rank + 1) for rank in range(count)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a large synthetic catalog, customers, carts, reviews and order history "
+        "for performance work. The same --seed always produces the same data; the "
+        "PRD-/BSK-/RCP-/MRCH- codes come from the normal sequences and can differ."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--baskets', type=int, default=200)
+        parser.add_argument('--basket-items', type=int, default=5, help="Products per basket (at most)")
+        parser.add_argument('--recipes', type=int, default=300)
+        parser.add_argument('--ingredients', type=int, default=8, help="Ingredients per recipe (at most)")
+        parser.add_argument('--merchandise', type=int, default=50)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--reviews', type=int, default=10000)
+        parser.add_argument('--cart-items', type=int, default=4, help="Items per user cart (at most)")
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--order-items', type=int, default=5, help="Lines per order (at most)")
+        parser.add_argument('--days', type=int, default=365, help="Spread order history over this many days")
+        parser.add_argument('--until', help="Last day of the order history (YYYY-MM-DD); defaults to today")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows per bulk_create INSERT")
+        parser.add_argument('--flush', action='store_true', help="Delete previously seeded data first")
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        if options['flush']:
+            self.flush()
+        elif Product.objects.filter(slug__startswith=f'{PREFIX}-').exists():
+            raise CommandError("Seeded data already exists - rerun with --flush to replace it.")
+
+        until = options['until']
+        until = datetime.strptime(until, '%Y-%m-%d').date() if until else timezone.localdate()
+        self.history_end = timezone.make_aware(datetime.combine(until, dt_time(23, 59)))
+        rng = random.Random(options['seed'])
+
+        start = time.perf_counter()
+        try:
+            with transaction.atomic():
+                self.seed(rng, options)
+        except IntegrityError as e:
+            raise CommandError(f"Seeding failed, nothing was written: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded in {time.perf_counter() - start:.1f}s. Customers log in as "
+            f"{PREFIX}-user-<n>@example.com / {PASSWORD}."
+        ))
+
+    def step(self, label, build):
+        """Run one generation step and report how long it took"""
+        start = time.perf_counter()
+        count = build()
+        self.stdout.write(f"  {label:<18}{count:>8}  {time.perf_counter() - start:6.2f}s")
+        return count
+
+    def bulk(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.chunk_size)
+
+    def seed(self, rng, options):
+        self.step('categories', lambda: self.seed_categories(rng, options['categories']))
+        self.step('products', lambda: self.seed_products(rng, options['products']))
+        self.step('baskets', lambda: self.seed_baskets(rng, options['baskets'], options['basket_items']))
+        self.step('recipes', lambda: self.seed_recipes(rng, options['recipes'], options['ingredients']))
+        self.step('merchandise', lambda: self.seed_merchandise(rng, options['merchandise']))
+        self.step('users', lambda: self.seed_users(options['users']))
+        self.step('reviews', lambda: self.seed_reviews(rng, options['reviews']))
+        self.step('cart items', lambda: self.seed_carts(rng, options['cart_items']))
+        self.step('orders', lambda: self.seed_orders(rng, options['orders'], options['order_items'], options['days']))
+        self.step('derived data', self.rebuild_derived)
+
+    def seed_categories(self, rng, count):
+        self.categories = self.bulk(Category, [
+            Category(
+                name=f"Perf {rng.choice(QUALIFIERS)} {rng.choice(PRODUCE)} {i}",
+                slug=f"{PREFIX}-category-{i}",
+                description="Synthetic category",
+            )
+            for i in range(count)
+        ])
+        return len(self.categories)
+
+    def seed_products(self, rng, count):
+        products = [
+            Product(
+                name=f"{rng.choice(QUALIFIERS).title()} {rng.choice(PRODUCE)} {rng.choice(UNITS)} {i}",
+                slug=f"{PREFIX}-product-{i}",
+                price=Decimal(rng.randint(20, 1500)),
+                # About one product in ten is sold out
+                stock=0 if rng.random() < 0.1 else rng.randint(1, 500),
+                description=' '.join(rng.choices(PRODUCE + QUALIFIERS, k=rng.randint(10, 40))),
+                image="products/perf.jpg",
+                is_new=rng.random() < 0.05,
+                is_active=rng.random() < 0.95,
+                category=rng.choice(self.categories) if self.categories else None,
+            )
+            for i in range(count)
+        ]
+        self.products = self.bulk(Product, assign_codes(products))
+        self.product_weights = zipf_cum_weights(len(self.products))
+        return len(self.products)
+
+    def seed_baskets(self, rng, count, items_per_basket):
+        baskets = [
+            ProductBasket(
+                name=f"Perf {rng.choice(QUALIFIERS)} basket {i}",
+                slug=f"{PREFIX}-basket-{i}",
+                description="Synthetic basket",
+                price=Decimal(rng.randint(300, 4000)),
+                image="baskets/perf.jpg",
+            )
+            for i in range(count)
+        ]
+        self.baskets = self.bulk(ProductBasket, assign_codes(baskets))
+        items = []
+        for basket in self.baskets:
+            size = min(rng.randint(2, max(2, items_per_basket)), len(self.products))
+            for product in rng.sample(self.products, size):
+                items.append(BasketItem(basket=basket, product=product, quantity=rng.randint(1, 3)))
+        self.bulk(BasketItem, items)
+        return len(self.baskets)
+
+    def seed_recipes(self, rng, count, ingredients_per_recipe):
+        recipes = [
+            Recipe(
+                title=f"Perf {rng.choice(PRODUCE)} and {rng.choice(PRODUCE)} stew {i}",
+                slug=f"{PREFIX}-recipe-{i}",
+                image="recipes/perf.jpg",
+                description="Synthetic recipe",
+                instructions='\n'.join(f"Step {step}: {' '.join(rng.choices(PRODUCE, k=8))}" for step in range(1, 6)),
+                prep_time=rng.randint(5, 60),
+                cook_time=rng.randint(10, 120),
+                servings=rng.randint(1, 8),
+                difficulty=rng.choice(['easy', 'medium', 'hard']),
+                is_featured=rng.random() < 0.1,
+            )
+            for i in range(count)
+        ]
+        recipes = self.bulk(Recipe, assign_codes(recipes))
+        ingredients = []
+        for recipe in recipes:
+            for order in range(rng.randint(1, max(1, ingredients_per_recipe))):
+                # Mostly shop products, some free-text ones
+                linked = self.products and rng.random() < 0.7
+                ingredients.append(RecipeIngredient(
+                    recipe=recipe,
+                    product=rng.choice(self.products) if linked else None,
+                    custom_name='' if linked else rng.choice(CUSTOM_INGREDIENTS),
+                    quantity=f"{rng.randint(1, 5)} {rng.choice(['cups', 'pieces', 'g', 'bunches'])}",
+                    order=order,
+                ))
+        self.bulk(RecipeIngredient, ingredients)
+        return len(recipes)
+
+    def seed_merchandise(self, rng, count):
+        merchandise = [
+            Merchandise(
+                # Merchandise has no slug: the code is what flush() finds it by
+                product_id=f"{MERCH_CODE_PREFIX}{i:04d}",
+                name=f"Perf {rng.choice(MERCH)} {i}",
+                price=Decimal(rng.randint(300, 3000)),
+                image="merchandise/perf.jpg",
+                description="Synthetic merchandise",
+                stock=rng.randint(0, 200),
+            )
+            for i in range(count)
+        ]
+        self.merchandise = self.bulk(Merchandise, merchandise)
+        return len(self.merchandise)
+
+    def seed_users(self, count):
+        # Hashing is deliberately slow, so every seeded user shares one hash
+        password = make_password(PASSWORD)
+        self.users = self.bulk(User, [
+            User(
+                username=f"{PREFIX}-user-{i}",
+                email=f"{PREFIX}-user-{i}@example.com",
+                first_name=f"Perf{i}",
+                password=password,
+                phone_number=f"2547{i % 100000000:08d}",
+                is_verified=True,
+            )
+            for i in range(count)
+        ])
+        # bulk_create skips the post_save signal that normally creates the cart
+        self.carts = self.bulk(Cart, [Cart(user=user) for user in self.users])
+        return len(self.users)
+
+    def seed_reviews(self, rng, count):
+        count = min(count, len(self.users) * len(self.products))
+        pairs = set()
+        while len(pairs) < count:
+            # Popular products collect most of the reviews
+            product = rng.choices(self.products, cum_weights=self.product_weights)[0]
+            pairs.add((rng.randrange(len(self.users)), product.pk))
+        reviews = [
+            ProductReview(
+                user=self.users[user_index],
+                product_id=product_id,
+                rating=rng.choices([1, 2, 3, 4, 5], [5, 5, 15, 35, 40])[0],
+                review_text=' '.join(rng.choices(QUALIFIERS + PRODUCE, k=rng.randint(0, 25))),
+                is_approved=rng.random() < 0.9,
+            )
+            for user_index, product_id in sorted(pairs)
+        ]
+        self.bulk(ProductReview, reviews)
+        return len(reviews)
+
+    def pick_item(self, rng):
+        """(kind, object) for one cart or order line"""
+        roll = rng.random()
+        if roll < 0.15 and self.baskets:
+            return 'basket', rng.choice(self.baskets)
+        if roll < 0.2 and self.merchandise:
+            return 'merchandise', rng.choice(self.merchandise)
+        return 'product', rng.choices(self.products, cum_weights=self.product_weights)[0]
+
+    def pick_lines(self, rng, most):
+        """Up to `most` distinct items with quantities"""
+        lines = {}
+        for _ in range(rng.randint(1, max(1, most))):
+            kind, item = self.pick_item(rng)
+            lines[(kind, item.pk)] = (kind, item, rng.randint(1, 4))
+        return list(lines.values())
+
+    def seed_carts(self, rng, items_per_cart):
+        items = []
+        for cart in self.carts:
+            # Most carts are empty
+            if rng.random() < 0.7:
+                continue
+            for kind, item, quantity in self.pick_lines(rng, items_per_cart):
+                items.append(CartItem(cart=cart, quantity=quantity, **{kind: item}))
+        self.bulk(CartItem, items)
+        return len(items)
+
+    def delivery_zones(self):
+        zones = list(DeliveryZone.objects.filter(is_active=True).order_by('pk'))
+        if not zones:
+            zones = self.bulk(DeliveryZone, [
+                DeliveryZone(name=f"Perf zone {i}", delivery_fee=Decimal(fee))
+                for i, fee in enumerate([0, 150, 300])
+            ])
+        return zones
+
+    def seed_orders(self, rng, count, items_per_order, days):
+        zones = self.delivery_zones()
+        statuses, status_weights = zip(*ORDER_STATUSES)
+        orders, order_lines, created = [], [], []
+        for i in range(count):
+            user = rng.choice(self.users)
+            zone = rng.choice(zones)
+            status = rng.choices(statuses, status_weights)[0]
+            created_at = self.history_end - timedelta(seconds=rng.randrange(max(1, days) * 86400))
+            lines = self.pick_lines(rng, items_per_order)
+            subtotal = sum((item.price * quantity for kind, item, quantity in lines), Decimal('0.00'))
+            slot_start, slot_end = rng.choice(TIME_SLOTS)
+            paid = status in Order.PAID_STATUSES
+            orders.append(Order(
+                user=user,
+                phone_number=user.phone_number,
+                email=user.email,
+                zone=zone,
+                subtotal_amount=subtotal,
+                delivery_fee=zone.delivery_fee,
+                total_amount=subtotal + zone.delivery_fee,
+                # Pending ones never got an STK push, or the reconciler would query Daraja for them
+                checkout_request_id=f"ws_CO_{PREFIX}_{i}" if status not in ('pending', 'cancelled') else None,
+                mpesa_receipt_number=f"{PREFIX.upper()}{i:08d}" if paid else None,
+                payment_result_desc="Request cancelled by user" if status == 'failed' else '',
+                preferred_delivery_date=(created_at + timedelta(days=rng.randint(1, 3))).date(),
+                preferred_delivery_time_start=dt_time(slot_start),
+                preferred_delivery_time_end=dt_time(slot_end),
+                status=status,
+            ))
+            order_lines.append(lines)
+            created.append(created_at)
+
+        orders = self.bulk(Order, orders)
+        # auto_now_add stamps every row with the insert time, so the history dates are written
+        # afterwards. bulk_update would build one huge CASE per batch; a single prepared UPDATE
+        # run for every row is much faster
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {Order._meta.db_table} SET created_at = %s WHERE id = %s",
+                [(connection.ops.adapt_datetimefield_value(when), order.pk) for order, when in zip(orders, created)],
+            )
+
+        items = []
+        for order, lines in zip(orders, order_lines):
+            for kind, item, quantity in lines:
+                items.append(OrderItem(
+                    order=order,
+                    item_name=item.name,
+                    quantity=quantity,
+                    unit_price=item.price,
+                    total_price=item.price * quantity,
+                    **{kind: item},
+                ))
+        self.bulk(OrderItem, items)
+        return len(orders)
+
+    def rebuild_derived(self):
+        """Recompute what the post_save signals would have maintained row by row"""
+        Product.objects.filter(basket_items__basket__in=self.baskets).update(is_in_basket=True)
+        ProductBasket.refresh_pricing([basket.pk for basket in self.baskets])
+        count = ProductRatingSummary.rebuild()
+        if search.fts_available():
+            count += search.rebuild_index()
+        bump_catalog_version()
+        return count
+
+    def flush(self):
+        start = time.perf_counter()
+        users = User.objects.filter(username__startswith=f'{PREFIX}-user-')
+        products = Product.objects.filter(slug__startswith=f'{PREFIX}-product-')
+        baskets = ProductBasket.objects.filter(slug__startswith=f'{PREFIX}-basket-')
+        merchandise = Merchandise.objects.filter(product_id__startswith=MERCH_CODE_PREFIX)
+        with transaction.atomic():
+            # Cart items first: SET_NULL would leave them pointing at nothing, which the
+            # one-item-type constraint rejects
+            CartItem.objects.filter(
+                Q(cart__user__in=users) | Q(product__in=products) | Q(basket__in=baskets) | Q(merchandise__in=merchandise)
+            ).delete()
+            # Products before users, so their reviews go with them without a summary refresh each
+            products.delete()
+            baskets.delete()
+            merchandise.delete()
+            Recipe.objects.filter(slug__startswith=f'{PREFIX}-recipe-').delete()
+            Category.objects.filter(slug__startswith=f'{PREFIX}-category-').delete()
+            # Orders and carts go with their users
+            users.delete()
+            DeliveryZone.objects.filter(name__startswith='Perf zone ').delete()
+        self.stdout.write(f"Deleted previously seeded data in {time.perf_counter() - start:.1f}s.")
@@ -0,0 +1,280 @@
+# core/metrics.py
+"""
+Per-request measurements: SQL, templates, cache and outbound calls.
+
+RequestMetricsMiddleware (core/middleware.py) measures a sample of the
+requests (REQUEST_METRICS_SAMPLE_RATE). While a request is measured, the
+hooks installed once by install() add to its RequestMetrics:
+
+- SQL: query count and DB time (a connection.execute_wrapper), plus how
+  often the most repeated statement ran - an N+1 loop shows up as one
+  statement run dozens of times.
+- Templates: time spent rendering (the outermost Template.render; includes
+  are part of it).
+- Cache: hits and misses of get/get_many on the configured cache backends.
+- Outbound: time in requests (M-Pesa) and SMTP sends.
+
+Outside a measured request a hook costs one ContextVar lookup.
+
+Measurements are summed in memory per (endpoint, method, hour) and written
+to RequestStat every REQUEST_METRICS_FLUSH_INTERVAL seconds, from a
+background thread rather than the request that happens to be due, with F()
+increments, so any number of processes can share the rollup. Writing is best
+effort: a failed flush is logged and its numbers dropped. The admin report
+(core.views.AdminReportView) reads the table.
+"""
+import atexit
+import functools
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 0.1)
+FLUSH_INTERVAL = getattr(settings, 'REQUEST_METRICS_FLUSH_INTERVAL', 60)
+RETENTION = timedelta(days=getattr(settings, 'REQUEST_METRICS_RETENTION_DAYS', 14))
+# Statements run this often in one request are reported as N+1 suspects
+REPEATED_QUERY_THRESHOLD = 10
+
+SUMMED_FIELDS = (
+    'requests', 'errors', 'total_ms', 'queries', 'db_ms', 'template_ms',
+    'cache_hits', 'cache_misses', 'external_calls', 'external_ms',
+)
+MAX_FIELDS = ('max_ms', 'max_queries')
+
+_current = ContextVar('request_metrics', default=None)
+_MISSING = object()
+# "IN (%s, %s, %s)" -> "IN (...)" so the same loop with different batch sizes counts as one statement
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class RequestMetrics:
+    """What one measured request spent its time on"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.external_calls = 0
+        self.external_seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """connection.execute_wrapper() hook"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - start
+            self.queries += 1
+            self.statements[IN_LIST_RE.sub('IN (...)', sql)] += 1
+
+    def most_repeated(self):
+        """(statement, times) of the statement run most often, or ('', 0)"""
+        if not self.statements:
+            return '', 0
+        return self.statements.most_common(1)[0]
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+
+# --- Hooks ---
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapped(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None or metrics.template_depth:
+            return render(self, *args, **kwargs)
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.template_seconds += time.perf_counter() - start
+            metrics.template_depth -= 1
+    return wrapped
+
+
+def _counted_get(get):
+    @functools.wraps(get)
+    def wrapped(self, key, default=None, version=None):
+        metrics = _current.get()
+        if metrics is None:
+            return get(self, key, default, version)
+        value = get(self, key, _MISSING, version)
+        if value is _MISSING:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+    return wrapped
+
+
+def _counted_get_many(get_many):
+    @functools.wraps(get_many)
+    def wrapped(self, keys, version=None):
+        found = get_many(self, keys, version)
+        metrics = _current.get()
+        if metrics is not None:
+            keys = list(keys)
+            metrics.cache_hits += len(found)
+            metrics.cache_misses += len(keys) - len(found)
+        return found
+    return wrapped
+
+
+def _timed_external(call):
+    @functools.wraps(call)
+    def wrapped(*args, **kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return call(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            metrics.external_calls += 1
+            metrics.external_seconds += time.perf_counter() - start
+    return wrapped
+
+
+def _patch(owner, name, wrapper):
+    original = getattr(owner, name)
+    if not getattr(original, '_request_metrics', False):
+        patched = wrapper(original)
+        patched._request_metrics = True
+        setattr(owner, name, patched)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install():
+    """Put the hooks in place (once per process)"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        import requests
+        from django.core.cache import caches
+        from django.core.cache.backends.base import BaseCache
+        from django.core.mail.backends.smtp import EmailBackend
+        from django.template.base import Template
+
+        _patch(Template, 'render', _timed_render)
+        for alias in settings.CACHES:
+            backend = type(caches[alias])
+            _patch(backend, 'get', _counted_get)
+            # BaseCache.get_many calls get(), which is counted already
+            if backend.get_many is not BaseCache.get_many:
+                _patch(backend, 'get_many', _counted_get_many)
+        _patch(requests.Session, 'send', _timed_external)
+        _patch(EmailBackend, 'send_messages', _timed_external)
+        atexit.register(flush)
+        _installed = True
+
+
+# --- Rollup ---
+
+_buffer = {}
+_buffer_lock = threading.Lock()
+_last_flush = time.monotonic()
+_last_prune = 0.0
+
+
+def record(endpoint, method, status, seconds, metrics):
+    """Add one measured request to the in-memory rollup; flushes it when due"""
+    global _last_flush
+    bucket = timezone.now().replace(minute=0, second=0, microsecond=0)
+    elapsed_ms = seconds * 1000
+    statement, repeats = metrics.most_repeated()
+    with _buffer_lock:
+        entry = _buffer.get((endpoint, method, bucket))
+        if entry is None:
+            entry = _buffer[(endpoint, method, bucket)] = dict.fromkeys(SUMMED_FIELDS + MAX_FIELDS, 0)
+            entry['max_repeated_queries'], entry['repeated_sql'] = 0, ''
+        entry['requests'] += 1
+        entry['errors'] += status >= 500
+        entry['total_ms'] += elapsed_ms
+        entry['queries'] += metrics.queries
+        entry['db_ms'] += metrics.db_seconds * 1000
+        entry['template_ms'] += metrics.template_seconds * 1000
+        entry['cache_hits'] += metrics.cache_hits
+        entry['cache_misses'] += metrics.cache_misses
+        entry['external_calls'] += metrics.external_calls
+        entry['external_ms'] += metrics.external_seconds * 1000
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        entry['max_queries'] = max(entry['max_queries'], metrics.queries)
+        if repeats > entry['max_repeated_queries']:
+            entry['max_repeated_queries'], entry['repeated_sql'] = repeats, statement
+        due = time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        # Not in the request: it would pay for the rollup's queries (and count them, in benchmarks)
+        threading.Thread(target=_flush_in_background, name='request-metrics-flush', daemon=True).start()
+
+
+def _flush_in_background():
+    try:
+        flush()
+    finally:
+        # The thread's own connection
+        connections.close_all()
+
+
+def flush():
+    """Write the buffered rollup to RequestStat"""
+    global _last_prune
+    with _buffer_lock:
+        entries = list(_buffer.items())
+        _buffer.clear()
+    try:
+        for (endpoint, method, bucket), entry in entries:
+            _write({'endpoint': endpoint, 'method': method, 'bucket': bucket}, entry)
+        if time.monotonic() - _last_prune > 3600:
+            _last_prune = time.monotonic()
+            from .models import RequestStat
+            RequestStat.objects.filter(bucket__lt=timezone.now() - RETENTION).delete()
+    except DatabaseError as e:
+        logger.warning(f"Could not write request metrics: {e}")
+
+
+def _write(key, entry):
+    from .models import RequestStat
+    increments = {field: F(field) + entry[field] for field in SUMMED_FIELDS}
+    increments.update({field: Greatest(F(field), Value(entry[field])) for field in MAX_FIELDS})
+    stats = RequestStat.objects.filter(**key)
+    if not stats.update(**increments):
+        try:
+            with transaction.atomic():
+                RequestStat.objects.create(**key, **entry)
+            return
+        except IntegrityError:
+            # Another process created the row first
+            stats.update(**increments)
+    if entry['max_repeated_queries']:
+        stats.filter(max_repeated_queries__lt=entry['max_repeated_queries']).update(
+            max_repeated_queries=entry['max_repeated_queries'], repeated_sql=entry['repeated_sql'],
+        )
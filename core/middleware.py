@@ -0,0 +1,75 @@
+# core/middleware.py
+import atexit
+import random
+import sys
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+from django.urls import reverse
+
+from . import metrics, profiler
+
+
+def endpoint_name(request):
+    """The URL name the request resolved to (or the view's dotted path), never the raw path"""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else '<unresolved>'
+
+
+class RequestMetricsMiddleware:
+    """Measure a sample of requests into the RequestStat rollup (core/metrics.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        metrics.install()
+
+    def __call__(self, request):
+        if random.random() >= metrics.SAMPLE_RATE:
+            return self.get_response(request)
+
+        collected = metrics.RequestMetrics()
+        token = collected.activate()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(collected))
+                response = self.get_response(request)
+        finally:
+            collected.deactivate(token)
+        elapsed = time.perf_counter() - start
+
+        metrics.record(endpoint_name(request), request.method, response.status_code, elapsed, collected)
+        return response
+
+
+class RequestProfilerMiddleware:
+    """
+    Sampling profiles of requests (core/profiler.py): on demand for staff,
+    continuously for the checkout and payment views. Needs request.user, so
+    it goes after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        atexit.register(profiler.flush)
+
+    def __call__(self, request):
+        kind = profiler.wanted(request)
+        if kind is None:
+            return self.get_response(request)
+
+        profile = profiler.start(kind, sys._getframe())
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop(profile)
+
+        if kind == 'continuous':
+            profiler.record(profile, endpoint_name(request), request.method)
+            return response
+        saved = profiler.save(profile, request, endpoint_name(request))
+        if saved is not None:
+            response[profiler.TRIGGER_HEADER] = reverse('admin:core_requestprofile_download', args=[saved.pk])
+        return response
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_emailjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(help_text='URL name (or view) the request resolved to', max_length=200)),
+                ('method', models.CharField(max_length=10)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour')),
+                ('requests', models.PositiveIntegerField(default=0, help_text='Sampled requests')),
+                ('errors', models.PositiveIntegerField(default=0, help_text='Responses with a 5xx status')),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('queries', models.PositiveBigIntegerField(default=0)),
+                ('max_queries', models.PositiveIntegerField(default=0)),
+                ('db_ms', models.FloatField(default=0)),
+                ('template_ms', models.FloatField(default=0)),
+                ('cache_hits', models.PositiveBigIntegerField(default=0)),
+                ('cache_misses', models.PositiveBigIntegerField(default=0)),
+                ('external_calls', models.PositiveIntegerField(default=0, help_text='Outbound HTTP (M-Pesa) and SMTP calls')),
+                ('external_ms', models.FloatField(default=0)),
+                ('max_repeated_queries', models.PositiveIntegerField(default=0, help_text='Most runs of one statement in a request')),
+                ('repeated_sql', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Request Stat',
+                'verbose_name_plural': 'Request Stats',
+                'ordering': ['-bucket', 'endpoint'],
+                'indexes': [models.Index(fields=['bucket'], name='core_requeststat_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('endpoint', 'method', 'bucket'), name='core_requeststat_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_requeststat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('on_demand', 'On demand'), ('continuous', 'Continuous')], max_length=10)),
+                ('endpoint', models.CharField(help_text='URL name (or view) the request resolved to', max_length=200)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(blank=True, help_text='Full path of an on-demand request', max_length=500)),
+                ('bucket', models.DateTimeField(blank=True, help_text='Start of the hour a continuous profile covers', null=True)),
+                ('file', models.CharField(help_text='Relative to REQUEST_PROFILER_DIR', max_length=255)),
+                ('requests', models.PositiveIntegerField(default=0, help_text='Requests merged into the profile')),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('duration_ms', models.FloatField(default=0, help_text='Wall time of the profiled requests')),
+                ('interval_ms', models.FloatField(help_text='Time between samples')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Request Profile',
+                'verbose_name_plural': 'Request Profiles',
+                'ordering': ['-created_at'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('kind', 'continuous')), fields=('endpoint', 'method', 'bucket'), name='core_requestprofile_continuous_unique')],
+            },
+        ),
+    ]
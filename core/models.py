@@ -1,5 +1,9 @@
 # core/models.py
+from django.conf import settings
 from django.db import models
+from django.db.models import Max, Sum
+
+from products.images import usable, variant_url
 
 class GalleryCategory(models.Model):
     name = models.CharField(max_length=100)
@@ -30,6 +34,8 @@ class GalleryItem(models.Model):
 
     # Content Fields
     image = models.ImageField(upload_to='gallery/', blank=True, null=True, help_text="Upload image for Farm Image type")
+    # Resized WebP/fallback copies - maintained by products/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     social_url = models.URLField(blank=True, null=True, help_text="Paste full YouTube, Instagram, or TikTok URL")
 
     # Meta
@@ -48,6 +54,8 @@ class GalleryItem(models.Model):
     def get_thumbnail_url(self):
         """Returns a preview image URL for all media types"""
         if self.media_type == 'image' and self.image:
+            if usable(self.image_variants):
+                return variant_url(self.image_variants, 640)
             return self.image.url
 
         elif self.media_type == 'youtube':
@@ -133,4 +141,171 @@ class PromotionalPopup(models.Model):
     @staticmethod
     def get_active_popup():
         """Return the first active popup (supports only one active at a time)"""
-        return PromotionalPopup.objects.filter(is_active=True).first()
\ No newline at end of file
+        return PromotionalPopup.objects.filter(is_active=True).first()
+
+class EmailJob(models.Model):
+    """An email waiting to be sent by `manage.py run_email_worker` (see core/jobs.py)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50, help_text="Which email to build - a key of core.jobs.EMAIL_BUILDERS")
+    idempotency_key = models.CharField(max_length=200, unique=True, help_text="Enqueuing the same key twice sends once")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=6)
+    run_after = models.DateTimeField(help_text="Not picked up before this time (retry backoff)")
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Email Job"
+        verbose_name_plural = "Email Jobs"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='core_emailjob_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} ({self.idempotency_key}) - {self.status}"
+
+
+class RequestStat(models.Model):
+    """Sampled request measurements summed per endpoint and hour - written by core/metrics.py"""
+    endpoint = models.CharField(max_length=200, help_text="URL name (or view) the request resolved to")
+    method = models.CharField(max_length=10)
+    bucket = models.DateTimeField(help_text="Start of the hour")
+
+    requests = models.PositiveIntegerField(default=0, help_text="Sampled requests")
+    errors = models.PositiveIntegerField(default=0, help_text="Responses with a 5xx status")
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    queries = models.PositiveBigIntegerField(default=0)
+    max_queries = models.PositiveIntegerField(default=0)
+    db_ms = models.FloatField(default=0)
+    template_ms = models.FloatField(default=0)
+    cache_hits = models.PositiveBigIntegerField(default=0)
+    cache_misses = models.PositiveBigIntegerField(default=0)
+    external_calls = models.PositiveIntegerField(default=0, help_text="Outbound HTTP (M-Pesa) and SMTP calls")
+    external_ms = models.FloatField(default=0)
+    # An N+1 loop shows up as one statement run many times in a single request
+    max_repeated_queries = models.PositiveIntegerField(default=0, help_text="Most runs of one statement in a request")
+    repeated_sql = models.TextField(blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Request Stat"
+        verbose_name_plural = "Request Stats"
+        ordering = ['-bucket', 'endpoint']
+        constraints = [
+            models.UniqueConstraint(fields=['endpoint', 'method', 'bucket'], name='core_requeststat_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket'], name='core_requeststat_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.endpoint} @ {self.bucket:%Y-%m-%d %H:00}"
+
+    @property
+    def avg_ms(self):
+        return self.total_ms / self.requests if self.requests else 0
+
+    @property
+    def avg_queries(self):
+        return self.queries / self.requests if self.requests else 0
+
+    @classmethod
+    def endpoint_summary(cls, since):
+        """
+        One dict per (endpoint, method) with its totals since `since`, plus
+        the worst repeated statement seen: two queries whatever the window.
+        """
+        rows = cls.objects.filter(bucket__gte=since).values('endpoint', 'method').annotate(
+            sampled=Sum('requests'),
+            failed=Sum('errors'),
+            time_ms=Sum('total_ms'),
+            slowest_ms=Max('max_ms'),
+            query_count=Sum('queries'),
+            most_queries=Max('max_queries'),
+            sql_ms=Sum('db_ms'),
+            render_ms=Sum('template_ms'),
+            hits=Sum('cache_hits'),
+            misses=Sum('cache_misses'),
+            outbound_calls=Sum('external_calls'),
+            outbound_ms=Sum('external_ms'),
+        ).order_by()
+        summary = {}
+        for row in rows:
+            sampled = row['sampled'] or 1
+            lookups = row['hits'] + row['misses']
+            summary[row['endpoint'], row['method']] = {
+                **row,
+                'avg_ms': row['time_ms'] / sampled,
+                'avg_queries': row['query_count'] / sampled,
+                'avg_db_ms': row['sql_ms'] / sampled,
+                'avg_template_ms': row['render_ms'] / sampled,
+                'avg_outbound_ms': row['outbound_ms'] / sampled,
+                'hit_rate': row['hits'] / lookups if lookups else None,
+                'repeated': 0,
+                'repeated_sql': '',
+            }
+
+        worst = cls.objects.filter(bucket__gte=since, max_repeated_queries__gt=0).order_by(
+            'endpoint', 'method', '-max_repeated_queries'
+        ).values_list('endpoint', 'method', 'max_repeated_queries', 'repeated_sql')
+        for endpoint, method, repeated, sql in worst:
+            row = summary.get((endpoint, method))
+            if row is not None and repeated > row['repeated']:
+                row['repeated'], row['repeated_sql'] = repeated, sql
+        return list(summary.values())
+
+
+class RequestProfile(models.Model):
+    """A collapsed-stack profile on disk - written by core/profiler.py"""
+    KIND_CHOICES = [
+        ('on_demand', 'On demand'),
+        ('continuous', 'Continuous'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    endpoint = models.CharField(max_length=200, help_text="URL name (or view) the request resolved to")
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500, blank=True, help_text="Full path of an on-demand request")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    bucket = models.DateTimeField(null=True, blank=True, help_text="Start of the hour a continuous profile covers")
+    file = models.CharField(max_length=255, help_text="Relative to REQUEST_PROFILER_DIR")
+
+    requests = models.PositiveIntegerField(default=0, help_text="Requests merged into the profile")
+    samples = models.PositiveIntegerField(default=0)
+    duration_ms = models.FloatField(default=0, help_text="Wall time of the profiled requests")
+    interval_ms = models.FloatField(help_text="Time between samples")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Request Profile"
+        verbose_name_plural = "Request Profiles"
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['endpoint', 'method', 'bucket'], condition=models.Q(kind='continuous'),
+                name='core_requestprofile_continuous_unique',
+            ),
+        ]
+
+    def __str__(self):
+        if self.kind == 'continuous':
+            return f"{self.method} {self.endpoint} @ {self.bucket:%Y-%m-%d %H:00}"
+        return f"{self.method} {self.path}"
@@ -0,0 +1,323 @@
+# core/profiler.py
+"""
+Sampling profiles of requests, written as collapsed stacks.
+
+RequestProfilerMiddleware (core/middleware.py) profiles two kinds of request:
+
+- On demand: a staff user adds ?_profile=1 or an `X-Profile: 1` header to
+  any request. The request is sampled every REQUEST_PROFILER_INTERVAL_MS and
+  gets a file and a RequestProfile row of its own. The response's X-Profile
+  header holds the admin download link.
+- Continuous: a fraction (REQUEST_PROFILER_CONTINUOUS_RATE, 5% by default)
+  of the requests to REQUEST_PROFILER_CONTINUOUS_VIEWS (the checkout, the
+  STK status poll and the M-Pesa callback) are sampled at the lower
+  REQUEST_PROFILER_CONTINUOUS_INTERVAL_MS. Their stacks are summed per
+  (endpoint, method, hour) in memory and appended to one file per hour
+  every REQUEST_PROFILER_FLUSH_INTERVAL seconds, from a background thread.
+
+A single daemon thread per interval samples every thread with a profile
+running, via sys._current_frames(). It is a wall-clock profile: time waiting
+on SQLite, M-Pesa or SMTP shows up as well as time on the CPU. A CPU-bound
+request only lets the sampler in every sys.getswitchinterval() (5ms), so
+short intervals are a ceiling, not a promise - `samples` on the row is what
+was actually taken.
+
+Each line of a file is "outer;...;inner count", the format flamegraph.pl and
+speedscope read. Frames are "qualname (path:first line)", so a function's
+samples merge whatever line they were on.
+"""
+import functools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django.utils.text import slugify
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = Path(getattr(settings, 'REQUEST_PROFILER_DIR', Path(settings.BASE_DIR) / 'profiles'))
+INTERVAL = getattr(settings, 'REQUEST_PROFILER_INTERVAL_MS', 1) / 1000
+CONTINUOUS_VIEWS = frozenset(getattr(settings, 'REQUEST_PROFILER_CONTINUOUS_VIEWS', ()))
+CONTINUOUS_RATE = getattr(settings, 'REQUEST_PROFILER_CONTINUOUS_RATE', 0.05)
+CONTINUOUS_INTERVAL = getattr(settings, 'REQUEST_PROFILER_CONTINUOUS_INTERVAL_MS', 10) / 1000
+FLUSH_INTERVAL = getattr(settings, 'REQUEST_PROFILER_FLUSH_INTERVAL', 60)
+RETENTION = timedelta(days=getattr(settings, 'REQUEST_PROFILER_RETENTION_DAYS', 7))
+
+TRIGGER_PARAM = '_profile'
+TRIGGER_HEADER = 'X-Profile'
+
+
+# --- Sampling ---
+
+@functools.lru_cache(maxsize=None)
+def _short_path(filename):
+    """The file relative to the sys.path entry it was imported from"""
+    best = ''
+    for entry in sys.path:
+        if entry and len(entry) > len(best) and filename.startswith(entry.rstrip(os.sep) + os.sep):
+            best = entry
+    return filename[len(best):].lstrip(os.sep) if best else filename
+
+
+@functools.lru_cache(maxsize=None)
+def _label(code):
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+class Profile:
+    """Stacks sampled from one thread, below `root` (the profiling middleware's frame)"""
+
+    def __init__(self, kind, root, interval):
+        self.kind = kind
+        self.root = root
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def sample(self, frame):
+        labels = []
+        while frame is not None and frame is not self.root:
+            labels.append(_label(frame.f_code))
+            frame = frame.f_back
+        if labels:
+            self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+
+class Sampler:
+    """A daemon thread sampling, every `interval` seconds, each thread that has a profile running"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._profiles = {}
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def start(self, profile):
+        with self._lock:
+            self._profiles[profile.thread_id] = profile
+            # Not alive after a fork: each worker process starts its own
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+            if len(self._profiles) == 1:
+                self._lock.notify()
+
+    def stop(self, profile):
+        with self._lock:
+            self._profiles.pop(profile.thread_id, None)
+        profile.seconds = time.perf_counter() - profile.started
+
+    def _run(self):
+        with self._lock:
+            while True:
+                if not self._profiles:
+                    self._lock.wait()
+                    continue
+                self._lock.wait(self.interval)
+                frames = sys._current_frames()
+                frame = None
+                for thread_id, profile in self._profiles.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.sample(frame)
+                # Don't keep finished requests' frames (and their locals) alive until the next sample
+                frames = frame = None
+
+
+_samplers = {'on_demand': Sampler(INTERVAL), 'continuous': Sampler(CONTINUOUS_INTERVAL)}
+
+
+def wanted(request):
+    """'on_demand', 'continuous' or None: whether and how to profile this request"""
+    if request.GET.get(TRIGGER_PARAM) or request.headers.get(TRIGGER_HEADER):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return 'on_demand'
+    if CONTINUOUS_VIEWS and random.random() < CONTINUOUS_RATE:
+        try:
+            view_name = resolve(request.path_info).view_name
+        except Resolver404:
+            return None
+        if view_name in CONTINUOUS_VIEWS:
+            return 'continuous'
+    return None
+
+
+def start(kind, root):
+    """Start sampling the current thread below the frame `root`"""
+    sampler = _samplers[kind]
+    profile = Profile(kind, root, sampler.interval)
+    sampler.start(profile)
+    return profile
+
+
+def stop(profile):
+    _samplers[profile.kind].stop(profile)
+
+
+# --- Files ---
+
+def collapsed(stacks):
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def read(name):
+    """The profile file as a Counter of stacks (continuous files repeat a stack once per flush)"""
+    stacks = Counter()
+    with open(PROFILE_DIR / name, encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+
+def hottest(stacks, limit=15):
+    """[(frame, samples)] of the frames the samples ended in most often (self time)"""
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rpartition(';')[2]] += count
+    return leaves.most_common(limit)
+
+
+def remove(name):
+    try:
+        (PROFILE_DIR / name).unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Could not remove profile {name}: {e}")
+
+
+def _append(name, text):
+    path = PROFILE_DIR / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+def _slug(endpoint):
+    return slugify(endpoint.replace(':', '-')) or 'unresolved'
+
+
+def save(profile, request, endpoint):
+    """Write an on-demand profile; returns its RequestProfile, or None if it could not be written"""
+    from .models import RequestProfile
+    name = f"on_demand/{timezone.now():%Y%m%d-%H%M%S}-{_slug(endpoint)}-{uuid.uuid4().hex[:8]}.folded"
+    try:
+        _append(name, collapsed(profile.stacks))
+        saved = RequestProfile.objects.create(
+            kind='on_demand',
+            endpoint=endpoint,
+            method=request.method,
+            path=request.get_full_path()[:500],
+            user=request.user,
+            file=name,
+            requests=1,
+            samples=profile.samples,
+            duration_ms=profile.seconds * 1000,
+            interval_ms=profile.interval * 1000,
+        )
+    except (OSError, DatabaseError) as e:
+        logger.warning(f"Could not save profile of {request.path}: {e}")
+        return None
+    _prune_if_due()
+    return saved
+
+
+# --- Continuous rollup ---
+
+_buffer = {}
+_buffer_lock = threading.Lock()
+_last_flush = time.monotonic()
+_last_prune = 0.0
+
+
+def record(profile, endpoint, method):
+    """Add a continuous profile to the in-memory rollup; flushes it when due"""
+    global _last_flush
+    bucket = timezone.now().replace(minute=0, second=0, microsecond=0)
+    with _buffer_lock:
+        entry = _buffer.get((endpoint, method, bucket))
+        if entry is None:
+            entry = _buffer[(endpoint, method, bucket)] = {
+                'stacks': Counter(), 'requests': 0, 'samples': 0, 'duration_ms': 0.0,
+            }
+        entry['stacks'].update(profile.stacks)
+        entry['requests'] += 1
+        entry['samples'] += profile.samples
+        entry['duration_ms'] += profile.seconds * 1000
+        due = time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        # Not in the request, like core.metrics
+        threading.Thread(target=_flush_in_background, name='request-profiler-flush', daemon=True).start()
+
+
+def _flush_in_background():
+    try:
+        flush()
+    finally:
+        connections.close_all()
+
+
+def flush():
+    """Append the buffered continuous stacks to their hourly files"""
+    with _buffer_lock:
+        entries = list(_buffer.items())
+        _buffer.clear()
+    try:
+        for key, entry in entries:
+            _write(*key, entry)
+    except (OSError, DatabaseError) as e:
+        logger.warning(f"Could not write continuous profiles: {e}")
+    _prune_if_due()
+
+
+def _write(endpoint, method, bucket, entry):
+    from .models import RequestProfile
+    name = f"continuous/{bucket:%Y%m%d-%H}-{_slug(endpoint)}-{method.lower()}.folded"
+    _append(name, collapsed(entry['stacks']))
+    increments = {field: F(field) + entry[field] for field in ('requests', 'samples', 'duration_ms')}
+    profiles = RequestProfile.objects.filter(kind='continuous', endpoint=endpoint, method=method, bucket=bucket)
+    if profiles.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            RequestProfile.objects.create(
+                kind='continuous', endpoint=endpoint, method=method, bucket=bucket, file=name,
+                requests=entry['requests'], samples=entry['samples'], duration_ms=entry['duration_ms'],
+                interval_ms=CONTINUOUS_INTERVAL * 1000,
+            )
+    except IntegrityError:
+        # Another process created the row first
+        profiles.update(**increments)
+
+
+def _prune_if_due():
+    """Drop profiles past REQUEST_PROFILER_RETENTION_DAYS, at most once an hour (files go with the rows)"""
+    global _last_prune
+    if time.monotonic() - _last_prune < 3600:
+        return
+    _last_prune = time.monotonic()
+    from .models import RequestProfile
+    try:
+        RequestProfile.objects.filter(updated_at__lt=timezone.now() - RETENTION).delete()
+    except DatabaseError as e:
+        logger.warning(f"Could not prune profiles: {e}")
@@ -0,0 +1,25 @@
+# core/signals.py
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from products.images import refresh_variants
+from . import profiler
+from .cache import invalidate_active_popup
+from .models import GalleryItem, PromotionalPopup, RequestProfile
+
+@receiver(post_save, sender=PromotionalPopup)
+@receiver(post_delete, sender=PromotionalPopup)
+def popup_changed(sender, instance, **kwargs):
+    """Forget the cached active popup"""
+    invalidate_active_popup()
+
+@receiver(post_save, sender=GalleryItem)
+def gallery_image_changed(sender, instance, raw=False, **kwargs):
+    """Resize a newly uploaded gallery image"""
+    if not raw:
+        refresh_variants(instance)
+
+@receiver(post_delete, sender=RequestProfile)
+def profile_deleted(sender, instance, **kwargs):
+    """Remove the profile's file with its row"""
+    profiler.remove(instance.file)
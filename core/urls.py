@@ -1,4 +1,5 @@
 from django.urls import path
+from django.views.generic import RedirectView
 from .views import (
     # Main
     HomeView, AboutView, ContactView,
@@ -10,7 +11,7 @@ from .views import (
     # Admin Orders
     AdminOrderListView, AdminOrderDetailView, AdminOrderTrackingView, 
     # Admin Users & Misc
-    AdminUserListView, AdminLoginView, AdminGalleryView, AdminReportView, GalleryView
+    AdminUserListView, AdminLoginView, AdminGalleryView, GalleryView
     
 )
 
@@ -41,7 +42,8 @@ urlpatterns = [
     path('admin-dashboard/users/', AdminUserListView.as_view(), name='admin_user_list'),
     path('admin-dashboard/login/', AdminLoginView.as_view(), name='admin_login'),
     path('admin-dashboard/gallery/', AdminGalleryView.as_view(), name='admin_gallery'),
-    path('admin-dashboard/report/', AdminReportView.as_view(), name='admin_report'),
+    # The report lives in the admin now (core.admin.RequestStatAdmin)
+    path('admin-dashboard/report/', RedirectView.as_view(pattern_name='admin:core_requeststat_report'), name='admin_report'),
     path('gallery/', GalleryView.as_view(), name='gallery'),
     path('about/', AboutView.as_view(), name='about'),
     path('contact/', ContactView.as_view(), name='contact'),
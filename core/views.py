@@ -1,20 +1,34 @@
+from datetime import timedelta
+
 from django.views.generic import TemplateView
 from django.shortcuts import render
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.text import Truncator
+from unfold.views import UnfoldModelAdminViewMixin
 # IMPORT MODELS to fix the missing products issue
 from products.models import Product, ProductBasket, Recipe, Category, Merchandise
+from products.cache import get_home_context
+from products.pagination import KeysetPaginationMixin
 
 from django.views.generic import ListView
-from .models import GalleryItem, GalleryCategory
+from .metrics import REPEATED_QUERY_THRESHOLD, SAMPLE_RATE
+from .models import GalleryItem, GalleryCategory, RequestStat
 
 # core/views.py (only GalleryView part shown)
 from django.views.generic import ListView
 from .models import GalleryItem, GalleryCategory
 
-class GalleryView(ListView):
+class GalleryView(KeysetPaginationMixin, ListView):
     model = GalleryItem
     template_name = 'core/gallery.html'
     context_object_name = 'gallery_items'
     paginate_by = 12  # Increased for better display
+    # Same order as get_queryset, made unique with the id
+    cursor_orderings = {'order': ['order', '-created_at', '-id']}
+    default_ordering = 'order'
+    ordering_param = None
+    exact_count = True  # Small table, counting it is cheap
 
     def get_queryset(self):
         return GalleryItem.objects.filter(is_active=True).select_related('category').order_by('order', '-created_at')
@@ -33,31 +47,38 @@ class HomeView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        # 1. Fetch Latest Products (Ordered by creation date so new ones show up)
-        context['featured_products'] = Product.objects.filter(
-            is_active=True
-        ).order_by('-created_at')[:8]
-
-        # 2. Fetch Combo Offers (Baskets)
-        context['product_baskets'] = ProductBasket.objects.filter(
-            is_active=True
-        ).prefetch_related('included_products__product')[:4]
-
-        # 3. Fetch Featured Recipes
-        context['featured_recipes'] = Recipe.objects.filter(
-            is_active=True, 
-            is_featured=True
-        ).prefetch_related('ingredients__product')[:4]
-
-        # 4. Fetch Categories
-        context['categories'] = Category.objects.filter(is_active=True)[:8]
-        
-        # 5. Fetch Merchandise
-        context['merchandise'] = Merchandise.objects.filter(is_active=True)[:4]
-        
+        # Catalog lists are cached as one unit, invalidated by catalog signals
+        context.update(get_home_context('core', self.build_home_context))
         return context
 
+    @staticmethod
+    def build_home_context():
+        return {
+            # 1. Fetch Latest Products (Ordered by creation date so new ones show up)
+            'featured_products': list(Product.objects.filter(
+                is_active=True
+            ).order_by('-created_at')[:8]),
+
+            # 2. Fetch Combo Offers (Baskets)
+            'product_baskets': list(ProductBasket.objects.filter(
+                is_active=True
+            ).prefetch_related('included_products__product')[:4]),
+
+            # 3. Fetch Featured Recipes
+            'featured_recipes': list(Recipe.objects.filter(
+                is_active=True, 
+                is_featured=True
+            ).prefetch_related('ingredients__product')[:4]),
+
+            # 4. Fetch Categories
+            'categories': list(Category.objects.filter(is_active=True).annotate(
+                active_products_count=Count('products', filter=Q(products__is_active=True))
+            )[:8]),
+            
+            # 5. Fetch Merchandise
+            'merchandise': list(Merchandise.objects.filter(is_active=True)[:4]),
+        }
+
 class AboutView(TemplateView):
     template_name = 'core/about.html'
 
@@ -104,8 +125,55 @@ class AdminLoginView(TemplateView):
 class AdminGalleryView(TemplateView):
     template_name = 'admin/gallery.html'
 
-class AdminReportView(TemplateView):
+class AdminReportView(UnfoldModelAdminViewMixin, TemplateView):
+    """
+    Slowest endpoints and N+1 suspects from the sampled request metrics
+    (core/metrics.py). Served inside the admin by RequestStatAdmin.
+    """
+    title = "Performance report"
+    permission_required = ('core.view_requeststat',)
     template_name = 'admin/report.html'
+    # ?hours= choices
+    WINDOWS = [(1, "Last hour"), (24, "Last 24 hours"), (24 * 7, "Last 7 days")]
+    TOP = 20
+
+    def get_context_data(self, **kwargs):
+        hours = self.request.GET.get('hours', '24')
+        hours = int(hours) if hours.isdigit() and int(hours) in dict(self.WINDOWS) else 24
+        rows = RequestStat.endpoint_summary(timezone.now() - timedelta(hours=hours))
+
+        slowest = sorted(rows, key=lambda row: row['avg_ms'], reverse=True)[:self.TOP]
+        suspects = sorted(
+            (row for row in rows if row['repeated'] >= REPEATED_QUERY_THRESHOLD),
+            key=lambda row: row['repeated'], reverse=True,
+        )[:self.TOP]
+
+        context = super().get_context_data(**kwargs)
+        context.update({
+            'hours': hours,
+            'windows': self.WINDOWS,
+            'sampled': sum(row['sampled'] for row in rows),
+            'sample_rate': SAMPLE_RATE,
+            'threshold': REPEATED_QUERY_THRESHOLD,
+            'slowest': {
+                'headers': ["Endpoint", "Method", "Sampled", "Avg ms", "Max ms", "Avg queries",
+                            "Avg DB ms", "Avg template ms", "Avg outbound ms", "Cache hit rate", "5xx"],
+                'rows': [[
+                    row['endpoint'], row['method'], row['sampled'],
+                    f"{row['avg_ms']:.1f}", f"{row['slowest_ms']:.1f}", f"{row['avg_queries']:.1f}",
+                    f"{row['avg_db_ms']:.1f}", f"{row['avg_template_ms']:.1f}", f"{row['avg_outbound_ms']:.1f}",
+                    "-" if row['hit_rate'] is None else f"{row['hit_rate']:.0%}", row['failed'],
+                ] for row in slowest],
+            },
+            'suspects': {
+                'headers': ["Endpoint", "Method", "Runs in one request", "Most queries", "Statement"],
+                'rows': [[
+                    row['endpoint'], row['method'], row['repeated'], row['most_queries'],
+                    Truncator(row['repeated_sql']).chars(160),
+                ] for row in suspects],
+            },
+        })
+        return context
 
 
 
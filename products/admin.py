@@ -6,6 +6,7 @@ from django.db.models import Count
 from unfold.admin import ModelAdmin, TabularInline
 from unfold.decorators import display
 
+from .images import usable, variant_url
 from .models import (
     Category, Product, ProductBasket, BasketItem,
     Recipe, RecipeIngredient, Merchandise, ProductReview
@@ -14,9 +15,11 @@ from .models import (
 
 def display_image(image_field):
     if image_field:
+        # A 40px thumbnail doesn't need the full upload
+        variants = usable(getattr(image_field.instance, 'image_variants', None))
         return format_html(
-            '<img src="{}" style="width:40px;height:40px;object-fit:cover;border-radius:6px;" />',
-            image_field.url
+            '<img src="{}" style="width:40px;height:40px;object-fit:cover;border-radius:6px;" loading="lazy" />',
+            variant_url(variants, 160) if variants else image_field.url
         )
     return "-"
 
@@ -58,11 +61,22 @@ class BasketItemInline(TabularInline):
 
 @admin.register(ProductBasket)
 class ProductBasketAdmin(ModelAdmin):
-    list_display = ['image_preview', 'basket_id', 'name', 'price', 'stock', 'is_active']
+    list_display = ['image_preview', 'basket_id', 'name', 'price', 'discount_percentage', 'stock', 'is_active']
     search_fields = ['name', 'basket_id']
     prepopulated_fields = {'slug': ('name',)}
     inlines = [BasketItemInline]
-    readonly_fields = ['basket_id', 'stock', 'created_at', 'updated_at']
+    readonly_fields = [
+        'basket_id', 'stock', 'total_original_price', 'discount_amount',
+        'discount_percentage', 'created_at', 'updated_at'
+    ]
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        # Compute the stock column for the whole page in one query
+        cl = getattr(response, 'context_data', {}).get('cl')
+        if cl is not None:
+            ProductBasket.prefetch_stock(cl.result_list)
+        return response
 
     @display(description="Image")
     def image_preview(self, obj):
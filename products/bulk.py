@@ -0,0 +1,243 @@
+# products/bulk.py
+"""
+Bulk price / stock updates from a spreadsheet, and a streamed catalog export.
+
+Uploads (CSV or XLSX) need a `product_id` column with the item code
+(PRD-0042 or MRCH-0007) and a `price` or `stock` column; other columns are
+ignored, so an export can be edited and uploaded back. Rows are read
+lazily and handled in chunks: one lookup query per model and one
+bulk_update per chunk. Bad rows are reported and skipped, the rest is
+applied in a single transaction. With dry_run nothing is written, the
+result only shows what would change.
+"""
+import csv
+import io
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Product, ProductBasket, BasketItem, Merchandise
+
+# POST action -> field it updates
+UPDATE_FIELDS = {
+    'update_prices': 'price',
+    'update_stock': 'stock',
+}
+
+CODE_COLUMN = 'product_id'
+EXPORT_COLUMNS = ['product_id', 'type', 'name', 'category', 'price', 'stock', 'is_active']
+
+Change = namedtuple('Change', ['row', 'code', 'name', 'old', 'new'])
+RowError = namedtuple('RowError', ['row', 'code', 'message'])
+
+
+class BulkUploadError(Exception):
+    """The upload as a whole cannot be processed (wrong format, missing columns)"""
+
+
+class BulkResult:
+    def __init__(self, field, dry_run):
+        self.field = field
+        self.dry_run = dry_run
+        self.changes = []
+        self.errors = []
+        self.unchanged = 0
+
+    @property
+    def rows(self):
+        return len(self.changes) + len(self.errors) + self.unchanged
+
+
+def _csv_rows(upload):
+    text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    try:
+        while True:
+            # Only reading is guarded: decode errors and NUL bytes surface as the file is read
+            try:
+                values = next(reader)
+            except StopIteration:
+                return
+            except (UnicodeDecodeError, csv.Error) as e:
+                raise BulkUploadError(f"Could not read the CSV file - save it as UTF-8 CSV ({e}).")
+            yield values
+    finally:
+        text.detach()
+
+
+def _xlsx_rows(upload):
+    try:
+        import openpyxl
+    except ImportError:
+        raise BulkUploadError("XLSX uploads need the openpyxl package - upload a CSV instead.")
+    try:
+        workbook = openpyxl.load_workbook(upload.file, read_only=True, data_only=True)
+    except Exception:
+        raise BulkUploadError("Could not read the XLSX file.")
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        while True:
+            try:
+                values = next(rows)
+            except StopIteration:
+                return
+            except Exception:
+                raise BulkUploadError("Could not read the XLSX file.")
+            yield ['' if value is None else str(value) for value in values]
+    finally:
+        workbook.close()
+
+
+def read_rows(upload):
+    """Yield (row number, {column: value}) from a CSV or XLSX upload, one row at a time"""
+    name = upload.name.lower()
+    if name.endswith('.xlsx'):
+        rows = _xlsx_rows(upload)
+    elif name.endswith('.csv'):
+        rows = _csv_rows(upload)
+    else:
+        raise BulkUploadError("Upload a .csv or .xlsx file.")
+
+    header = [column.strip().lower() for column in next(rows, [])]
+    for number, values in enumerate(rows, start=2):
+        if any(value.strip() for value in values):
+            yield number, dict(zip(header, values))
+
+
+def _parse(field, raw):
+    raw = (raw or '').strip()
+    try:
+        value = Decimal(raw)
+    except InvalidOperation:
+        value = None
+    if field == 'price':
+        if value is None or not value.is_finite():
+            raise ValueError(f"'{raw}' is not a price")
+        if value < 0:
+            raise ValueError("Price cannot be negative")
+        # Checked before quantizing, which fails outright on huge values
+        price_field = Product._meta.get_field('price')
+        whole_digits = price_field.max_digits - price_field.decimal_places
+        if value >= 10 ** whole_digits:
+            raise ValueError(f"Price can have at most {whole_digits} digits before the decimal point")
+        if value != value.quantize(Decimal('0.01')):
+            raise ValueError("Price can have at most 2 decimal places")
+        return value.quantize(Decimal('0.01'))
+    if value is None or not value.is_finite():
+        raise ValueError(f"'{raw}' is not a stock quantity")
+    if value < 0 or value != value.to_integral_value():
+        raise ValueError("Stock must be a whole number of 0 or more")
+    if value > connection.ops.integer_field_range('PositiveIntegerField')[1]:
+        raise ValueError("Stock is too large")
+    return int(value)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def apply_upload(upload, field, dry_run=False, chunk_size=500):
+    """Update `field` ('price' or 'stock') from an uploaded file; returns a BulkResult"""
+    result = BulkResult(field, dry_run)
+    seen = set()
+    repriced_products = []
+    rows = read_rows(upload)
+
+    with transaction.atomic():
+        for chunk in _chunks(rows, chunk_size):
+            parsed = []
+            for number, row in chunk:
+                if CODE_COLUMN not in row or field not in row:
+                    raise BulkUploadError(f"The file needs '{CODE_COLUMN}' and '{field}' columns.")
+                code = row[CODE_COLUMN].strip()
+                if not code:
+                    result.errors.append(RowError(number, '', f"Missing {CODE_COLUMN}"))
+                    continue
+                if code in seen:
+                    result.errors.append(RowError(number, code, "Appears more than once in the file"))
+                    continue
+                seen.add(code)
+                try:
+                    parsed.append((number, code, _parse(field, row[field])))
+                except (ValueError, ArithmeticError) as e:
+                    result.errors.append(RowError(number, code, str(e)))
+
+            codes = [code for number, code, value in parsed]
+            found = {}
+            for model in (Product, Merchandise):
+                found.update(model.objects.only('id', 'product_id', 'name', field).in_bulk(codes, field_name='product_id'))
+
+            changed = {Product: [], Merchandise: []}
+            for number, code, value in parsed:
+                instance = found.get(code)
+                if instance is None:
+                    result.errors.append(RowError(number, code, "No product or merchandise with this code"))
+                    continue
+                old = getattr(instance, field)
+                if old == value:
+                    result.unchanged += 1
+                    continue
+                result.changes.append(Change(number, code, instance.name, old, value))
+                setattr(instance, field, value)
+                changed[type(instance)].append(instance)
+
+            if dry_run:
+                continue
+            for model, instances in changed.items():
+                if instances:
+                    model.objects.bulk_update(instances, [field], batch_size=chunk_size)
+            if field == 'price':
+                repriced_products.extend(instance.id for instance in changed[Product])
+
+        # bulk_update skips the price signal, so refresh the affected baskets here
+        if repriced_products:
+            basket_ids = set(
+                BasketItem.objects.filter(product_id__in=repriced_products).values_list('basket_id', flat=True)
+            )
+            ProductBasket.refresh_pricing(basket_ids)
+        if result.changes and not dry_run:
+            bump_catalog_version()
+    result.errors.sort()
+    return result
+
+
+class Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(chunk_size=2000):
+    """Yield the catalog as CSV lines, reading the database in chunks"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    products = Product.objects.order_by('id').values_list(
+        'product_id', 'name', 'category__name', 'price', 'stock', 'is_active'
+    )
+    for code, name, category, price, stock, is_active in products.iterator(chunk_size=chunk_size):
+        yield writer.writerow([code, 'product', name, category or '', price, stock, is_active])
+    merchandise = Merchandise.objects.order_by('id').values_list(
+        'product_id', 'name', 'price', 'stock', 'is_active'
+    )
+    for code, name, price, stock, is_active in merchandise.iterator(chunk_size=chunk_size):
+        yield writer.writerow([code, 'merchandise', name, '', price, stock, is_active])
+
+
+def export_response():
+    """StreamingHttpResponse with the whole catalog as CSV"""
+    response = StreamingHttpResponse(export_rows(), content_type='text/csv')
+    filename = f"catalog-{timezone.localdate():%Y-%m-%d}.csv"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
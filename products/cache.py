@@ -0,0 +1,47 @@
+# products/cache.py
+"""
+Catalog-versioned caching.
+
+Any change to the catalog (products/signals.py, bulk updates, stock
+decrements) replaces the "catalog version". Cache keys that include it are
+never read again afterwards, so the next request rebuilds instead of serving
+stale data and the old entries simply expire.
+
+The home pages (core and products) show the same few catalog lists; they are
+built once and cached as a unit under the current version.
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_VERSION_KEY = 'catalog:version'
+HOME_TIMEOUT = 60 * 60
+
+
+def catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate everything keyed on the catalog version once the current transaction commits"""
+    # A fresh random version (rather than incr) means concurrent bumps can never collide
+    transaction.on_commit(lambda: cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None))
+
+
+def get_home_context(variant, build):
+    """
+    The cached context for one home page variant, built with build() on a miss.
+    build() must return fully evaluated data (lists, with anything the template
+    touches prefetched) so a cache hit runs no catalog queries.
+    """
+    key = f'home:{variant}:{catalog_version()}'
+    context = cache.get(key)
+    if context is None:
+        context = build()
+        cache.set(key, context, HOME_TIMEOUT)
+    return context
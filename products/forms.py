@@ -266,4 +266,14 @@ class ProductReviewForm(forms.ModelForm):
         review.product = self.product
         if commit:
             review.save()
-        return review
\ No newline at end of file
+        return review
+
+class BulkUpdateForm(forms.Form):
+    file = forms.FileField(help_text="CSV or XLSX with a product_id column and a price or stock column")
+    dry_run = forms.BooleanField(required=False, initial=True, label="Dry run (only show what would change)")
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.xlsx')):
+            raise ValidationError("Upload a .csv or .xlsx file.")
+        return upload
@@ -0,0 +1,132 @@
+# products/images.py
+"""
+Resized WebP + JPEG/PNG copies of uploaded catalog images.
+
+For every image we write one file per width in WIDTHS (never upscaled) in
+WebP and in a fallback format (JPEG, or PNG when the image has
+transparency) under derivatives/<content hash>/. The names come from a
+hash of the original bytes, so they can be cached forever and re-uploading
+the same picture reuses them.
+
+What was generated is recorded in the model's `image_variants` JSON field,
+so templates build srcset without touching storage. An image that could not
+be resized is recorded as failed (and served as is) until it is replaced or
+`backfill_image_variants --force` retries it. Variants are refreshed
+from post_save signals whenever the image file name changes;
+`manage.py backfill_image_variants` covers existing media.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (160, 320, 640, 1024)
+DERIVATIVES_DIR = 'derivatives'
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'webp':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    elif fmt == 'png':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def variant_name(digest, width, fmt):
+    return posixpath.join(DERIVATIVES_DIR, digest, f'{width}.{fmt}')
+
+
+def build_variants(image_field):
+    """Write the derivatives of one image; returns the dict stored in image_variants"""
+    image_field.open('rb')
+    try:
+        data = image_field.read()
+    finally:
+        image_field.close()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        fallback = 'png' if _has_alpha(image) else 'jpg'
+        if _has_alpha(image):
+            image = image.convert('RGBA')
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        # Every width smaller than the original, plus the original itself if it is not too large
+        widths = [width for width in WIDTHS if width < image.width]
+        if image.width <= WIDTHS[-1]:
+            widths.append(image.width)
+
+        for width in widths:
+            names = [variant_name(digest, width, fmt) for fmt in ('webp', fallback)]
+            if all(default_storage.exists(name) for name in names):
+                continue
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+            for name, fmt in zip(names, ('webp', fallback)):
+                if not default_storage.exists(name):
+                    default_storage.save(name, ContentFile(_encode(resized, fmt)))
+
+    return {'source': image_field.name, 'hash': digest, 'widths': widths, 'fallback': fallback}
+
+
+def refresh_variants(instance, field='image'):
+    """
+    (Re)build the instance's derivatives if its image changed since the last
+    build. Returns whether image_variants changed.
+    """
+    image_field = getattr(instance, field)
+    variants = instance.image_variants or {}
+    if not image_field:
+        new_variants = {}
+    elif variants.get('source') == image_field.name:
+        return False
+    else:
+        try:
+            new_variants = build_variants(image_field)
+        except (OSError, UnidentifiedImageError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning(f"Could not build image variants for {instance!r}: {e}")
+            # Serve the new original rather than the previous image's variants, and remember
+            # the failure so later saves don't decode the same file again
+            new_variants = {'source': image_field.name, 'failed': True}
+    if new_variants == variants:
+        return False
+    # update() so the post_save signal that called us does not fire again
+    type(instance).objects.filter(pk=instance.pk).update(image_variants=new_variants)
+    instance.image_variants = new_variants
+    return True
+
+
+def usable(variants):
+    """The variants if there are any to serve (not missing, nor a recorded failure), else None"""
+    return variants if variants and variants.get('widths') else None
+
+
+def srcset(variants, fmt):
+    return ', '.join(
+        f"{default_storage.url(variant_name(variants['hash'], width, fmt))} {width}w"
+        for width in variants['widths']
+    )
+
+
+def variant_url(variants, width, fmt=None):
+    """URL of the smallest derivative at least `width` wide (or the largest there is)"""
+    widths = variants['widths']
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return default_storage.url(variant_name(variants['hash'], chosen, fmt or variants['fallback']))
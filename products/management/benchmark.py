@@ -0,0 +1,64 @@
+# products/management/benchmark.py
+"""Shared helpers for the benchmark_* management commands"""
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+
+class Rollback(Exception):
+    """Raised to throw away the synthetic benchmark data"""
+
+
+class QueryCounter:
+    """connection.execute_wrapper() hook that only counts queries"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryTimer(QueryCounter):
+    """connection.execute_wrapper() hook that counts queries and adds up their time"""
+
+    def __init__(self):
+        super().__init__()
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return super().__call__(execute, sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def time_calls(func, repeat):
+    """Call func() `repeat` times; return (per-call seconds, total queries)"""
+    counter = QueryCounter()
+    timings = []
+    with connection.execute_wrapper(counter):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return timings, counter.count
@@ -0,0 +1,33 @@
+# products/management/commands/backfill_image_variants.py
+from django.core.management.base import BaseCommand
+
+from core.models import GalleryItem
+from products.cache import bump_catalog_version
+from products.images import refresh_variants
+from products.models import Product, ProductBasket, Recipe
+
+
+class Command(BaseCommand):
+    help = "Generate resized WebP/fallback images for existing product, basket, recipe and gallery uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Rebuild even where variants are already recorded")
+
+    def handle(self, *args, **options):
+        total = 0
+        for model in (Product, ProductBasket, Recipe, GalleryItem):
+            built = skipped = 0
+            for instance in model.objects.exclude(image='').exclude(image__isnull=True).iterator():
+                if options['force']:
+                    instance.image_variants = {}
+                if refresh_variants(instance):
+                    built += 1
+                else:
+                    skipped += 1
+            total += built
+            self.stdout.write(f"{model._meta.verbose_name_plural}: {built} built, {skipped} unchanged or unreadable")
+        if total:
+            # The variants were written with update(), so cached pages still hold the old rows
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS("Image variants are up to date."))
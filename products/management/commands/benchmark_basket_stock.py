@@ -0,0 +1,112 @@
+# products/management/commands/benchmark_basket_stock.py
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from products.management.benchmark import QueryCounter, rolled_back
+from products.models import Product, ProductBasket, BasketItem
+
+
+class Command(BaseCommand):
+    help = "Compare per-basket stock calculation against ProductBasket.get_stock_map()"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baskets', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--items-per-basket', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-legacy', action='store_true',
+                            help="Only time the batch engine (the legacy loop is slow at 10k baskets)")
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            self.run(options)
+        self.stdout.write("Synthetic data rolled back.")
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        n_products = options['products']
+        n_baskets = options['baskets']
+        per_basket = min(options['items_per_basket'], n_products)
+
+        products = Product.objects.bulk_create([
+            Product(
+                product_id=f"BENCH-PRD-{i}",
+                name=f"Bench product {i}",
+                slug=f"bench-product-{i}",
+                price=Decimal(rng.randint(50, 500)),
+                stock=rng.randint(0, 200),
+                description="Benchmark product",
+                image="products/bench.jpg",
+                is_active=rng.random() > 0.02,
+            )
+            for i in range(n_products)
+        ], batch_size=500)
+        baskets = ProductBasket.objects.bulk_create([
+            ProductBasket(
+                basket_id=f"BENCH-BSK-{i}",
+                name=f"Bench basket {i}",
+                slug=f"bench-basket-{i}",
+                price=Decimal(rng.randint(200, 2000)),
+                description="Benchmark basket",
+                image="baskets/bench.jpg",
+            )
+            for i in range(n_baskets)
+        ], batch_size=500)
+        BasketItem.objects.bulk_create([
+            BasketItem(basket=basket, product=product, quantity=rng.randint(1, 5))
+            for basket in baskets
+            for product in rng.sample(products, per_basket)
+        ], batch_size=1000)
+
+        basket_ids = [basket.id for basket in baskets]
+        self.stdout.write(
+            f"{n_baskets} baskets, {n_products} products, {n_baskets * per_basket} basket items"
+        )
+
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            start = time.perf_counter()
+            stock_map = ProductBasket.get_stock_map(basket_ids)
+            batch_time = time.perf_counter() - start
+        self.stdout.write(f"get_stock_map: {batch_time * 1000:.1f} ms, {queries.count} queries")
+
+        if options['skip_legacy']:
+            return
+
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            start = time.perf_counter()
+            legacy_map = {
+                basket.id: self.legacy_stock(basket)
+                for basket in ProductBasket.objects.filter(id__in=basket_ids)
+            }
+            legacy_time = time.perf_counter() - start
+        self.stdout.write(f"per-basket loop: {legacy_time * 1000:.1f} ms, {queries.count} queries")
+
+        mismatches = [basket_id for basket_id in basket_ids if stock_map[basket_id] != legacy_map[basket_id]]
+        if mismatches:
+            self.stderr.write(self.style.ERROR(f"{len(mismatches)} baskets disagree, e.g. {mismatches[:5]}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Results match. Speed-up: {legacy_time / batch_time:.1f}x"
+            ))
+
+    @staticmethod
+    def legacy_stock(basket):
+        """The original per-basket implementation, kept here for comparison"""
+        if not basket.included_products.exists():
+            return 0
+
+        min_stock = None
+        for basket_item in basket.included_products.select_related('product').all():
+            product = basket_item.product
+            if not product.is_active:
+                return 0
+            baskets_possible = product.stock // basket_item.quantity
+            if min_stock is None or baskets_possible < min_stock:
+                min_stock = baskets_possible
+        return min_stock or 0
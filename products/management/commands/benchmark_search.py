@@ -0,0 +1,110 @@
+# products/management/commands/benchmark_search.py
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from products import search
+from products.management.benchmark import percentile, rolled_back, time_calls
+from products.models import Product, Category
+
+WORDS = [
+    'tomato', 'sukuma', 'kale', 'spinach', 'onion', 'garlic', 'avocado', 'mango',
+    'banana', 'pepper', 'carrot', 'cabbage', 'potato', 'maize', 'beans', 'honey',
+    'organic', 'fresh', 'green', 'ripe', 'local', 'farm', 'bunch', 'crate',
+    'kienyeji', 'managu', 'terere', 'dhania', 'lemon', 'ginger', 'pumpkin', 'millet',
+]
+QUERIES = ['tomato', 'sukuma wiki', 'fresh kale', 'avo', 'organic honey', 'gin', 'ripe mango crate']
+SYLLABLES = ['ka', 'ma', 'ni', 'to', 'ri', 'sa', 'ku', 'le', 'mo', 'wa', 'ji', 'na', 'po', 'zu', 'shi', 'ba']
+
+
+def build_vocabulary(rng, size):
+    """Real produce words first, then made-up ones; callers pick with Zipf weights"""
+    vocabulary = list(WORDS)
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        word = ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    rng.shuffle(vocabulary)
+    weights = [1 / (position + 1) for position in range(size)]
+    return vocabulary, weights
+
+
+class Command(BaseCommand):
+    help = "Compare icontains scans against the FTS5 search index on synthetic products"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--vocabulary', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            self.stderr.write("The search index needs SQLite with FTS5.")
+            return
+        with rolled_back():
+            self.run(options)
+        self.stdout.write("Synthetic data rolled back.")
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        vocabulary, weights = build_vocabulary(rng, options['vocabulary'])
+        categories = Category.objects.bulk_create([
+            Category(name=f"Bench category {word}", slug=f"bench-category-{word}")
+            for word in WORDS[:8]
+        ])
+        Product.objects.bulk_create([
+            Product(
+                product_id=f"BENCH-PRD-{i}",
+                name=' '.join(rng.choices(vocabulary, weights, k=2)).title(),
+                slug=f"bench-product-{i}",
+                price=Decimal(rng.randint(50, 500)),
+                stock=rng.randint(0, 200),
+                description=' '.join(rng.choices(vocabulary, weights, k=30)),
+                image="products/bench.jpg",
+                category=rng.choice(categories),
+            )
+            for i in range(options['products'])
+        ], batch_size=1000)
+
+        timings, _ = time_calls(search.rebuild_index, 1)
+        self.stdout.write(f"Indexed {options['products']} products in {timings[0]:.2f} s")
+
+        repeat = options['repeat']
+        header = f"{'query':<20}{'icontains p50':>16}{'fts p50':>12}{'fts p95':>12}{'hits':>8}"
+        self.stdout.write(header)
+        for query in QUERIES:
+            def scan():
+                condition = Q()
+                for word in query.split():
+                    condition &= (
+                        Q(name__icontains=word) | Q(description__icontains=word) |
+                        Q(category__name__icontains=word)
+                    )
+                return list(Product.objects.filter(condition, is_active=True).values_list('id', flat=True)[:50])
+
+            def fts():
+                return search.search(query, kinds=['product'], limit=50)
+
+            scan_timings, _ = time_calls(scan, repeat)
+            fts_timings, _ = time_calls(fts, repeat)
+            hits = len(fts())
+            self.stdout.write(
+                f"{query:<20}{percentile(scan_timings, 0.5) * 1000:>14.1f}ms"
+                f"{percentile(fts_timings, 0.5) * 1000:>10.1f}ms"
+                f"{percentile(fts_timings, 0.95) * 1000:>10.1f}ms{hits:>8}"
+            )
+
+        # The ListView path: filter by the index, then count and page the queryset
+        list_query = Product.objects.filter(is_active=True)
+        for query in QUERIES[:3]:
+            timings, queries = time_calls(
+                lambda: search.filter_queryset(list_query, query, 'product').count(), repeat
+            )
+            self.stdout.write(
+                f"filter_queryset({query!r}).count(): p50 {percentile(timings, 0.5) * 1000:.1f}ms"
+            )
@@ -0,0 +1,253 @@
+# products/management/commands/benchmark_views.py
+import json
+import subprocess
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from cart.models import Cart
+from core import metrics, profiler
+from checkout.models import Order
+from products.cache import bump_catalog_version
+from products.management.benchmark import QueryTimer, percentile
+from products.models import Category, Product, ProductBasket, ProductReview, Recipe
+
+User = get_user_model()
+
+# url(targets) builds the path from the objects picked by pick_targets();
+# budget is the most queries one request may run
+ViewCase = namedtuple('ViewCase', ['name', 'url', 'budget', 'login'])
+
+
+def with_query(path, **params):
+    return f"{path}?{urlencode(params)}"
+
+
+CASES = [
+    ViewCase('home', lambda t: reverse('home'), 12, False),
+    ViewCase('product_list', lambda t: reverse('products:product_list'), 6, False),
+    ViewCase('product_list_price_filter', lambda t: with_query(
+        reverse('products:product_list'), min_price=100, max_price=800, ordering='-price'), 6, False),
+    ViewCase('product_list_top_rated', lambda t: with_query(
+        reverse('products:product_list'), ordering='-average_rating'), 6, False),
+    ViewCase('product_list_new', lambda t: with_query(
+        reverse('products:product_list'), is_new=1, ordering='name'), 6, False),
+    ViewCase('product_list_search', lambda t: with_query(
+        reverse('products:product_list'), q='fresh tomato', ordering='price'), 6, False),
+    ViewCase('product_list_category', lambda t: reverse(
+        'products:category_products', args=[t['category']]), 7, False),
+    ViewCase('product_detail', lambda t: reverse('products:product_detail', args=[t['product']]), 10, False),
+    ViewCase('basket_list', lambda t: reverse('products:basket_list'), 6, False),
+    ViewCase('basket_detail', lambda t: reverse('products:basket_detail', args=[t['basket']]), 8, False),
+    ViewCase('recipe_detail', lambda t: reverse('products:recipe_detail', args=[t['recipe']]), 8, False),
+    ViewCase('search', lambda t: with_query(reverse('products:search'), q='tomato'), 10, False),
+    ViewCase('cart_detail', lambda t: reverse('cart:cart_detail'), 8, True),
+    ViewCase('checkout', lambda t: reverse('checkout:checkout'), 10, True),
+]
+
+
+def pick_targets():
+    """The heaviest object of each kind, so the detail pages are measured at their worst"""
+    def slug_of(queryset):
+        return queryset.values_list('slug', flat=True).first()
+
+    return {
+        'category': slug_of(Category.objects.filter(is_active=True).annotate(n=Count('products')).order_by('-n', 'id')),
+        'product': slug_of(Product.objects.filter(is_active=True).annotate(n=Count('reviews')).order_by('-n', 'id')),
+        'basket': slug_of(ProductBasket.objects.filter(is_active=True).annotate(
+            n=Count('included_products')).order_by('-n', 'id')),
+        'recipe': slug_of(Recipe.objects.filter(is_active=True).annotate(n=Count('ingredients')).order_by('-n', 'id')),
+    }
+
+
+def pick_user(username=None):
+    """The given user, or the one with the biggest cart that can actually check out"""
+    if username:
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"No user called {username!r}")
+    carts = Cart.objects.annotate(n=Count('items')).filter(n__gt=0).select_related('user').order_by('-n', 'id')
+    for cart in carts[:50]:
+        if cart.priced().is_available:
+            return cart.user
+    raise CommandError("No user has a cart that can check out - run seed_perf or pass --user")
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Request the key pages through the test client and record queries, DB time and wall "
+        "time per view. Fails when a view exceeds its query budget or gets slower than the "
+        "--baseline results by more than --threshold. Run it on a seed_perf database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests per view first")
+        parser.add_argument('--only', nargs='+', metavar='VIEW', help="Benchmark only these views")
+        parser.add_argument('--user', help="Username for the cart and checkout pages")
+        parser.add_argument('--cold', action='store_true',
+                            help="Invalidate the catalog cache before every request")
+        parser.add_argument('--json', metavar='PATH', help="Write the results here ('-' for stdout)")
+        parser.add_argument('--baseline', metavar='PATH', help="Results of an earlier run to compare against")
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help="Allowed p50 slowdown against the baseline, as a fraction")
+        parser.add_argument('--slack-ms', type=float, default=5.0,
+                            help="Slowdowns smaller than this never count, however large the fraction")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+        if options['warmup'] < 0:
+            raise CommandError("--warmup cannot be negative")
+        cases = CASES
+        if options['only']:
+            unknown = set(options['only']) - {case.name for case in CASES}
+            if unknown:
+                raise CommandError(f"Unknown views: {', '.join(sorted(unknown))}")
+            cases = [case for case in CASES if case.name in options['only']]
+
+        targets = pick_targets()
+        missing = [kind for kind, slug in targets.items() if slug is None]
+        if missing:
+            raise CommandError(f"Nothing to benchmark for: {', '.join(missing)} - run seed_perf first")
+        user = pick_user(options['user']) if any(case.login for case in cases) else None
+
+        anonymous, logged_in = Client(), Client()
+        if user:
+            logged_in.force_login(user)
+
+        results = {}
+        self.stdout.write(
+            f"{'view':<28}{'status':>7}{'queries':>9}{'budget':>8}{'db p50':>10}{'p50':>10}{'p95':>10}"
+        )
+        # Sampled requests would carry the metrics and profiler overhead, so p50/p95 would
+        # depend on which requests the dice picked
+        sample_rate, continuous_rate = metrics.SAMPLE_RATE, profiler.CONTINUOUS_RATE
+        metrics.SAMPLE_RATE = profiler.CONTINUOUS_RATE = 0
+        try:
+            # The test client talks to 'testserver'
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for case in cases:
+                    client = logged_in if case.login else anonymous
+                    result = self.measure(client, case, case.url(targets), options)
+                    results[case.name] = result
+                    self.stdout.write(
+                        f"{case.name:<28}{result['status']:>7}{result['queries']:>9}{case.budget:>8}"
+                        f"{result['db_ms_p50']:>8.1f}ms{result['wall_ms_p50']:>8.1f}ms{result['wall_ms_p95']:>8.1f}ms"
+                    )
+        finally:
+            metrics.SAMPLE_RATE, profiler.CONTINUOUS_RATE = sample_rate, continuous_rate
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'debug': settings.DEBUG,
+                'repeat': options['repeat'],
+                'cold': options['cold'],
+                'dataset': {
+                    'products': Product.objects.count(),
+                    'baskets': ProductBasket.objects.count(),
+                    'recipes': Recipe.objects.count(),
+                    'reviews': ProductReview.objects.count(),
+                    'orders': Order.objects.count(),
+                },
+            },
+            'results': results,
+        }
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['json']}")
+
+        failures = self.check_budgets(cases, results)
+        if options['baseline']:
+            failures += self.compare(report, options)
+        if failures:
+            raise CommandError("Benchmark failed:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("All views within their budgets."))
+
+    def measure(self, client, case, url, options):
+        for _ in range(options['warmup']):
+            client.get(url)
+
+        walls, db_times, queries, statuses = [], [], [], set()
+        for _ in range(options['repeat']):
+            if options['cold']:
+                # Outside a transaction this takes effect immediately
+                bump_catalog_version()
+            timer = QueryTimer()
+            with connection.execute_wrapper(timer):
+                start = time.perf_counter()
+                response = client.get(url)
+                walls.append(time.perf_counter() - start)
+            db_times.append(timer.seconds)
+            queries.append(timer.count)
+            statuses.add(response.status_code)
+
+        return {
+            'url': url,
+            'status': max(statuses),
+            'queries': max(queries),
+            'queries_min': min(queries),
+            'budget': case.budget,
+            'db_ms_p50': round(percentile(db_times, 0.5) * 1000, 2),
+            'wall_ms_p50': round(percentile(walls, 0.5) * 1000, 2),
+            'wall_ms_p95': round(percentile(walls, 0.95) * 1000, 2),
+            'wall_ms_max': round(max(walls) * 1000, 2),
+        }
+
+    def check_budgets(self, cases, results):
+        failures = []
+        for case in cases:
+            result = results[case.name]
+            if result['status'] != 200:
+                failures.append(f"{case.name}: {result['url']} returned {result['status']}")
+            if result['queries'] > case.budget:
+                failures.append(f"{case.name}: {result['queries']} queries, budget is {case.budget}")
+        return failures
+
+    def compare(self, report, options):
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('dataset') != report['meta']['dataset']:
+            self.stdout.write(self.style.WARNING("The baseline was measured on a different dataset."))
+
+        failures = []
+        self.stdout.write(f"\n{'view':<28}{'queries':>12}{'p50 before':>12}{'p50 now':>10}{'change':>9}")
+        for name, result in report['results'].items():
+            before = baseline['results'].get(name)
+            if before is None:
+                continue
+            old, new = before['wall_ms_p50'], result['wall_ms_p50']
+            change = (new - old) / old if old else 0.0
+            self.stdout.write(
+                f"{name:<28}{before['queries']:>5} -> {result['queries']:<4}{old:>10.1f}ms{new:>8.1f}ms{change:>+9.0%}"
+            )
+            if change > options['threshold'] and new - old > options['slack_ms']:
+                failures.append(f"{name}: p50 {old:.1f}ms -> {new:.1f}ms ({change:+.0%})")
+        return failures
@@ -0,0 +1,12 @@
+# products/management/commands/rebuild_rating_summaries.py
+from django.core.management.base import BaseCommand
+
+from products.models import ProductRatingSummary
+
+
+class Command(BaseCommand):
+    help = "Recompute every ProductRatingSummary from approved reviews"
+
+    def handle(self, *args, **options):
+        count = ProductRatingSummary.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating summaries for {count} products."))
@@ -0,0 +1,12 @@
+# products/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+
+from products.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for products, baskets, recipes, categories and merchandise"
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} objects."))
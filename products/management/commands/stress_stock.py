@@ -0,0 +1,144 @@
+# products/management/commands/stress_stock.py
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+
+from products.models import Product, ProductBasket, BasketItem, Merchandise
+from products.stock import StockLine, decrement_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer products.stock.decrement_stock from many threads and check that "
+        "stock never goes negative and every successful order was fully taken"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--orders', type=int, default=2000, help="Total orders across all threads")
+        parser.add_argument('--stock', type=int, default=500, help="Starting stock of the test product and merchandise")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--legacy', action='store_true',
+                            help="Use the old read-check-save decrement to show lost updates")
+
+    def handle(self, *args, **options):
+        # The workers use their own connections, so the data has to be committed
+        fixtures = []
+        try:
+            product, merchandise, basket = self.create_fixtures(options['stock'], fixtures)
+            self.run(product, merchandise, basket, options)
+        finally:
+            for instance in reversed(fixtures):
+                instance.delete()
+            self.stdout.write("Stress fixtures deleted.")
+
+    def create_fixtures(self, stock, created):
+        """Create the test rows, appending each to `created` so handle() can always clean up"""
+        suffix = f"{int(time.time() * 1000)}"
+        product = Product.objects.create(
+            product_id=f"STRESS-PRD-{suffix}", name="Stress product", slug=f"stress-product-{suffix}",
+            price=Decimal('100'), stock=stock, description="Stock stress test", image="products/stress.jpg",
+        )
+        created.append(product)
+        merchandise = Merchandise.objects.create(
+            name="Stress merchandise",
+            price=Decimal('100'), stock=stock, description="Stock stress test", image="merchandise/stress.jpg",
+        )
+        created.append(merchandise)
+        basket = ProductBasket.objects.create(
+            basket_id=f"STRESS-BSK-{suffix}", name="Stress basket", slug=f"stress-basket-{suffix}",
+            price=Decimal('300'), description="Stock stress test", image="baskets/stress.jpg",
+        )
+        created.append(basket)
+        BasketItem.objects.create(basket=basket, product=product, quantity=2)
+        return product, merchandise, basket
+
+    def run(self, product, merchandise, basket, options):
+        rng = random.Random(options['seed'])
+        # Each order: the lines plus what it takes from (product, merchandise) if it succeeds
+        shapes = [
+            ([StockLine('product', product.id, 1)], (1, 0)),
+            ([StockLine('basket', basket.id, 1)], (2, 0)),
+            ([StockLine('merchandise', merchandise.id, 1)], (0, 1)),
+            ([StockLine('product', product.id, 1), StockLine('merchandise', merchandise.id, 2)], (1, 2)),
+            ([StockLine('basket', basket.id, 1), StockLine('product', product.id, 3)], (5, 0)),
+        ]
+        orders = [rng.choice(shapes) for _ in range(options['orders'])]
+        place = self.legacy_decrement if options['legacy'] else self.decrement
+
+        def worker(batch):
+            taken_product = taken_merchandise = succeeded = busy = 0
+            try:
+                for lines, (need_product, need_merchandise) in batch:
+                    try:
+                        ok = place(lines)
+                    except OperationalError:
+                        # "database is locked" - the order simply fails, like a timed-out request
+                        busy += 1
+                        continue
+                    if ok:
+                        succeeded += 1
+                        taken_product += need_product
+                        taken_merchandise += need_merchandise
+            finally:
+                connection.close()
+            return succeeded, busy, taken_product, taken_merchandise
+
+        threads = options['threads']
+        batches = [orders[i::threads] for i in range(threads)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(worker, batches))
+        elapsed = time.perf_counter() - start
+
+        succeeded = sum(result[0] for result in results)
+        busy = sum(result[1] for result in results)
+        taken_product = sum(result[2] for result in results)
+        taken_merchandise = sum(result[3] for result in results)
+        product.refresh_from_db(fields=['stock'])
+        merchandise.refresh_from_db(fields=['stock'])
+        initial = options['stock']
+
+        self.stdout.write(
+            f"{len(orders)} orders on {threads} threads in {elapsed:.2f}s: "
+            f"{succeeded} succeeded, {len(orders) - succeeded - busy} out of stock, {busy} lock timeouts"
+        )
+        self.stdout.write(
+            f"product stock {initial} -> {product.stock} (successful orders took {taken_product}); "
+            f"merchandise stock {initial} -> {merchandise.stock} (took {taken_merchandise})"
+        )
+
+        problems = []
+        if product.stock < 0 or merchandise.stock < 0:
+            problems.append("stock went negative")
+        if product.stock != initial - taken_product:
+            problems.append(f"product stock off by {initial - taken_product - product.stock}")
+        if merchandise.stock != initial - taken_merchandise:
+            problems.append(f"merchandise stock off by {initial - taken_merchandise - merchandise.stock}")
+        if problems:
+            raise CommandError("Oversold: " + "; ".join(problems))
+        self.stdout.write(self.style.SUCCESS("No oversell: stock matches the successful orders exactly."))
+
+    def decrement(self, lines):
+        return not decrement_stock(lines)
+
+    def legacy_decrement(self, lines):
+        """The pre-engine approach: read each row, check in Python, save"""
+        for line in lines:
+            if line.kind == 'basket':
+                items = BasketItem.objects.filter(basket_id=line.object_id).select_related('product')
+                targets = [(item.product, item.quantity * line.quantity) for item in items]
+            elif line.kind == 'product':
+                targets = [(Product.objects.get(pk=line.object_id), line.quantity)]
+            else:
+                targets = [(Merchandise.objects.get(pk=line.object_id), line.quantity)]
+            for instance, quantity in targets:
+                if instance.stock < quantity:
+                    return False
+                instance.stock -= quantity
+                instance.save(update_fields=['stock'])
+        return True
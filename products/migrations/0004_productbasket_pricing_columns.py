@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:47
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def populate_basket_pricing(apps, schema_editor):
+    ProductBasket = apps.get_model('products', 'ProductBasket')
+    BasketItem = apps.get_model('products', 'BasketItem')
+
+    totals = {}
+    for basket_id, price, quantity in BasketItem.objects.values_list('basket_id', 'product__price', 'quantity'):
+        totals[basket_id] = totals.get(basket_id, Decimal('0.00')) + price * quantity
+
+    baskets = list(ProductBasket.objects.all())
+    for basket in baskets:
+        total = totals.get(basket.id, Decimal('0.00'))
+        basket.total_original_price = total
+        basket.discount_amount = total - basket.price
+        if total > 0:
+            basket.discount_percentage = round((basket.discount_amount / total) * 100, 1)
+    ProductBasket.objects.bulk_update(
+        baskets, ['total_original_price', 'discount_amount', 'discount_percentage'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_alter_recipeingredient_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productbasket',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='productbasket',
+            name='discount_percentage',
+            field=models.DecimalField(decimal_places=1, default=Decimal('0.0'), editable=False, max_digits=7),
+        ),
+        migrations.AddField(
+            model_name='productbasket',
+            name='total_original_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='productbasket',
+            index=models.Index(fields=['discount_percentage'], name='products_pr_discoun_b48f8d_idx'),
+        ),
+        migrations.RunPython(populate_basket_pricing, migrations.RunPython.noop),
+    ]
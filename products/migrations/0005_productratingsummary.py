@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:49
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Avg, Count, Q
+
+
+def populate_rating_summaries(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductReview = apps.get_model('products', 'ProductReview')
+    ProductRatingSummary = apps.get_model('products', 'ProductRatingSummary')
+
+    aggregates = {'average_rating': Avg('rating'), 'reviews_count': Count('id')}
+    for stars in range(1, 6):
+        aggregates[f'stars_{stars}'] = Count('id', filter=Q(rating=stars))
+
+    rows = {
+        row.pop('product_id'): row
+        for row in ProductReview.objects.filter(is_approved=True).order_by().values('product_id').annotate(**aggregates)
+    }
+    summaries = []
+    for product_id in Product.objects.values_list('id', flat=True):
+        row = rows.get(product_id, {})
+        if row.get('average_rating'):
+            row['average_rating'] = round(Decimal(row['average_rating']), 2)
+        else:
+            row.pop('average_rating', None)
+        summaries.append(ProductRatingSummary(product_id=product_id, **row))
+    ProductRatingSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_productbasket_pricing_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRatingSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='products.product')),
+                ('average_rating', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=3)),
+                ('reviews_count', models.PositiveIntegerField(default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Product Rating Summary',
+                'verbose_name_plural': 'Product Rating Summaries',
+                'indexes': [models.Index(fields=['average_rating'], name='products_pr_average_4b6651_idx'), models.Index(fields=['reviews_count'], name='products_pr_reviews_2b2e77_idx')],
+            },
+        ),
+        migrations.RunPython(populate_rating_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+SEARCH_TABLE = 'products_search_index'
+
+# rowid = pk * 8 + kind code, see products/search.py
+POPULATE_SQL = [
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, title, body)
+        SELECT p.id * 8 + 1, p.name, p.description || ' ' || COALESCE(c.name, '')
+        FROM products_product p LEFT JOIN products_category c ON c.id = p.category_id
+        WHERE p.is_active""",
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, title, body)
+        SELECT id * 8 + 2, name, description FROM products_productbasket WHERE is_active""",
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, title, body)
+        SELECT id * 8 + 3, title, description || ' ' || instructions FROM products_recipe WHERE is_active""",
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, title, body)
+        SELECT id * 8 + 4, name, description FROM products_category WHERE is_active""",
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, title, body)
+        SELECT id * 8 + 5, name, description FROM products_merchandise WHERE is_active""",
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        f"title, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    # Title matches weigh ten times more than body matches
+    schema_editor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+    for sql in POPULATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_productratingsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:58
+
+from django.db import migrations, models
+from django.db.models import Max
+
+SEQUENCES = {
+    'PRD': ('Product', 'product_id'),
+    'BSK': ('ProductBasket', 'basket_id'),
+    'RCP': ('Recipe', 'recipe_id'),
+    'MRCH': ('Merchandise', 'product_id'),
+}
+
+
+def seed_counters(apps, schema_editor):
+    """Start every counter after the highest code (or id) already in use"""
+    SequenceCounter = apps.get_model('products', 'SequenceCounter')
+    for prefix, (model_name, field) in SEQUENCES.items():
+        model = apps.get_model('products', model_name)
+        highest = model.objects.aggregate(Max('id'))['id__max'] or 0
+        for code in model.objects.values_list(field, flat=True).iterator():
+            suffix = (code or '').rsplit('-', 1)[-1]
+            if suffix.isdigit():
+                highest = max(highest, int(suffix))
+        SequenceCounter.objects.update_or_create(name=prefix, defaults={'last_value': highest})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenceCounter',
+            fields=[
+                ('name', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('last_value', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 # products/models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Avg, Count, F, Q, Sum
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 from django.urls import reverse
@@ -75,6 +76,9 @@ class Category(models.Model):
     
     def get_products_count(self):
         """Get count of active products in this category"""
+        # Listing queries can annotate the count to avoid a query per category
+        if hasattr(self, 'active_products_count'):
+            return self.active_products_count
         return self.products.filter(is_active=True).count()
 
 class Product(models.Model):
@@ -86,6 +90,8 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     description = models.TextField()
     image = models.ImageField(upload_to=product_image_path)
+    # Resized WebP/fallback copies - maintained by products/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_new = models.BooleanField(default=False)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='products')
     is_active = models.BooleanField(default=True)
@@ -113,9 +119,8 @@ class Product(models.Model):
         
         # Generate product ID if not exists
         if not self.product_id:
-            last_product = Product.objects.order_by('-id').first()
-            last_id = last_product.id if last_product else 0
-            self.product_id = f"PRD-{str(last_id + 1).zfill(4)}"
+            from .sequences import assign_codes
+            assign_codes([self])
         
         super().save(*args, **kwargs)
         
@@ -135,12 +140,11 @@ class Product(models.Model):
         return self.stock
     
     def reduce_stock(self, quantity):
-        """Reduce stock by given quantity"""
-        if self.stock >= quantity:
-            self.stock -= quantity
-            self.save(update_fields=['stock'])
-            return True
-        return False
+        """Reduce stock by given quantity - a conditional UPDATE, so it never oversells"""
+        updated = Product.objects.filter(pk=self.pk, stock__gte=quantity).update(stock=F('stock') - quantity)
+        if updated:
+            self.refresh_from_db(fields=['stock'])
+        return bool(updated)
     
     @property
     def baskets_included_in(self):
@@ -166,10 +170,17 @@ class ProductBasket(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     image = models.ImageField(upload_to=basket_image_path)
+    # Resized WebP/fallback copies - maintained by products/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Denormalized pricing - kept in sync by refresh_pricing() via products/signals.py
+    total_original_price = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False)
+    discount_percentage = models.DecimalField(max_digits=7, decimal_places=1, default=Decimal('0.0'), editable=False)
+    
     # Products included in this basket (through BasketItem model)
     products = models.ManyToManyField(
         Product, 
@@ -182,6 +193,9 @@ class ProductBasket(models.Model):
         ordering = ['-created_at']
         verbose_name = "Product Basket"
         verbose_name_plural = "Product Baskets"
+        indexes = [
+            models.Index(fields=['discount_percentage']),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.basket_id}"
@@ -191,9 +205,14 @@ class ProductBasket(models.Model):
             self.slug = slugify(self.name)
         
         if not self.basket_id:
-            last_basket = ProductBasket.objects.order_by('-id').first()
-            last_id = last_basket.id if last_basket else 0
-            self.basket_id = f"BSK-{str(last_id + 1).zfill(4)}"
+            from .sequences import assign_codes
+            assign_codes([self])
+        
+        # Price changes only affect the discount, the stored total stays valid
+        self._apply_pricing(self.total_original_price)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'price' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'discount_amount', 'discount_percentage'}
         
         super().save(*args, **kwargs)
     
@@ -203,50 +222,92 @@ class ProductBasket(models.Model):
     @property
     def stock(self):
         """Calculate stock based on included products' availability"""
-        if not self.included_products.exists():
-            return 0
+        stock = getattr(self, '_prefetched_stock', None)
+        if stock is None:
+            stock = ProductBasket.get_stock_map([self.id])[self.id]
+        return stock
+    
+    @classmethod
+    def get_stock_map(cls, basket_ids=None):
+        """
+        Return {basket_id: baskets that can be made} for many baskets at once.
+        Loads every (basket, quantity, product stock) row in one query and takes
+        min(stock // quantity) per basket in a single pass.
+        """
+        rows = BasketItem.objects.order_by().values_list(
+            'basket_id', 'quantity', 'product__stock', 'product__is_active'
+        )
+        if basket_ids is not None:
+            basket_ids = list(basket_ids)
+            rows = rows.filter(basket_id__in=basket_ids)
         
-        min_stock = None
-        for basket_item in self.included_products.select_related('product').all():
-            product = basket_item.product
-            
-            # Check if product is active and has stock
-            if not product.is_active:
-                return 0
-            
-            # Calculate how many baskets can be made with this product
-            baskets_possible = product.stock // basket_item.quantity
-            
-            if min_stock is None or baskets_possible < min_stock:
-                min_stock = baskets_possible
+        stock_map = {}
+        for basket_id, quantity, product_stock, is_active in rows:
+            # An inactive product (or a zero quantity row) makes the basket unavailable
+            possible = product_stock // quantity if is_active and quantity else 0
+            current = stock_map.get(basket_id)
+            if current is None or possible < current:
+                stock_map[basket_id] = possible
         
-        return min_stock or 0
+        # Empty baskets cannot be sold
+        if basket_ids is not None:
+            for basket_id in basket_ids:
+                stock_map.setdefault(basket_id, 0)
+        return stock_map
+    
+    @classmethod
+    def prefetch_stock(cls, baskets):
+        """Compute stock for a list/queryset of baskets so `.stock` runs no queries"""
+        baskets = [basket for basket in baskets if basket is not None]
+        stock_map = cls.get_stock_map({basket.id for basket in baskets})
+        for basket in baskets:
+            basket._prefetched_stock = stock_map[basket.id]
+        return baskets
     
     @property
     def is_in_stock(self):
         """Check if basket is in stock"""
         return self.stock > 0
     
-    @property
-    def total_original_price(self):
-        """Calculate total price if buying products individually"""
-        total = Decimal('0.00')
-        for basket_item in self.included_products.select_related('product').all():
-            total += basket_item.product.price * basket_item.quantity
-        return total
-    
-    @property
-    def discount_amount(self):
-        """Calculate discount amount"""
-        return self.total_original_price - self.price
-    
-    @property
-    def discount_percentage(self):
-        """Calculate discount percentage"""
-        if self.total_original_price > 0:
-            discount = ((self.total_original_price - self.price) / self.total_original_price) * 100
-            return round(discount, 1)
-        return 0
+    def _apply_pricing(self, total_original_price):
+        """Set the pricing columns from the individual-products total"""
+        self.total_original_price = total_original_price
+        self.discount_amount = total_original_price - self.price
+        if total_original_price > 0:
+            discount = (self.discount_amount / total_original_price) * 100
+            self.discount_percentage = round(discount, 1)
+        else:
+            self.discount_percentage = Decimal('0.0')
+    
+    @classmethod
+    def refresh_pricing(cls, basket_ids=None):
+        """Recompute the pricing columns for the given baskets (all if None)"""
+        items = BasketItem.objects.all()
+        baskets = cls.objects.only('id', 'price')
+        if basket_ids is not None:
+            basket_ids = list(basket_ids)
+            if not basket_ids:
+                return
+            items = items.filter(basket_id__in=basket_ids)
+            baskets = baskets.filter(id__in=basket_ids)
+        
+        totals = dict(
+            items.values('basket_id').annotate(
+                total=Sum(
+                    F('product__price') * F('quantity'),
+                    output_field=models.DecimalField(max_digits=12, decimal_places=2)
+                )
+            ).values_list('basket_id', 'total')
+        )
+        
+        baskets = list(baskets)
+        for basket in baskets:
+            basket._apply_pricing(totals.get(basket.id) or Decimal('0.00'))
+        cls.objects.bulk_update(
+            baskets,
+            ['total_original_price', 'discount_amount', 'discount_percentage'],
+            batch_size=500
+        )
     
     @property
     def savings_per_basket(self):
@@ -273,17 +334,11 @@ class ProductBasket(models.Model):
         if not self.can_add_to_cart(quantity_sold):
             return False
         
-        # Update stock for each product in basket
-        for basket_item in self.included_products.select_related('product').all():
-            product = basket_item.product
-            quantity_needed = basket_item.quantity * quantity_sold
-            if product.stock >= quantity_needed:
-                product.stock -= quantity_needed
-                product.save(update_fields=['stock'])
-            else:
-                return False
-        
-        return True
+        # All products are decremented together, or none are
+        from .stock import StockLine, decrement_stock
+        failures = decrement_stock([StockLine('basket', self.id, quantity_sold)])
+        self._prefetched_stock = None
+        return not failures
 
 class BasketItem(models.Model):
     """Individual products included in a basket with quantities"""
@@ -327,6 +382,8 @@ class Recipe(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
     image = models.ImageField(upload_to=recipe_image_path)
+    # Resized WebP/fallback copies - maintained by products/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField(blank=True)
     instructions = models.TextField(help_text="Step-by-step cooking instructions")
     prep_time = models.PositiveIntegerField(help_text="Preparation time in minutes", default=15)
@@ -353,9 +410,8 @@ class Recipe(models.Model):
             self.slug = slugify(self.title)
         
         if not self.recipe_id:
-            last_recipe = Recipe.objects.order_by('-id').first()
-            last_id = last_recipe.id if last_recipe else 0
-            self.recipe_id = f"RCP-{str(last_id + 1).zfill(4)}"
+            from .sequences import assign_codes
+            assign_codes([self])
         
         super().save(*args, **kwargs)
     
@@ -453,21 +509,19 @@ class Merchandise(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.product_id:
-            last_merch = Merchandise.objects.order_by('-id').first()
-            last_id = last_merch.id if last_merch else 0
-            self.product_id = f"MRCH-{str(last_id + 1).zfill(4)}"
+            from .sequences import assign_codes
+            assign_codes([self])
         super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         return reverse('products:merchandise_detail', args=[self.id])
     
     def reduce_stock(self, quantity):
-        """Reduce merchandise stock"""
-        if self.stock >= quantity:
-            self.stock -= quantity
-            self.save(update_fields=['stock'])
-            return True
-        return False
+        """Reduce merchandise stock - a conditional UPDATE, so it never oversells"""
+        updated = Merchandise.objects.filter(pk=self.pk, stock__gte=quantity).update(stock=F('stock') - quantity)
+        if updated:
+            self.refresh_from_db(fields=['stock'])
+        return bool(updated)
 
 
 
@@ -518,4 +572,89 @@ class ProductReview(models.Model):
         """Return filled & empty stars for template"""
         filled = '★' * self.rating
         empty = '☆' * (5 - self.rating)
-        return filled + empty
\ No newline at end of file
+        return filled + empty
+
+class ProductRatingSummary(models.Model):
+    """Materialized review stats per product - approved reviews only"""
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='rating_summary'
+    )
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=Decimal('0.00'))
+    reviews_count = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Product Rating Summary"
+        verbose_name_plural = "Product Rating Summaries"
+        indexes = [
+            models.Index(fields=['average_rating']),
+            models.Index(fields=['reviews_count']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.average_rating} ({self.reviews_count} reviews)"
+
+    @property
+    def histogram(self):
+        """[(stars, count), ...] from 5 stars down to 1"""
+        return [(stars, getattr(self, f'stars_{stars}')) for stars in range(5, 0, -1)]
+
+    @staticmethod
+    def _aggregates():
+        aggregates = {
+            'average_rating': Avg('rating'),
+            'reviews_count': Count('id'),
+        }
+        for stars in range(1, 6):
+            aggregates[f'stars_{stars}'] = Count('id', filter=Q(rating=stars))
+        return aggregates
+
+    @staticmethod
+    def _clean(values):
+        average = values['average_rating']
+        values['average_rating'] = round(Decimal(average), 2) if average else Decimal('0.00')
+        return values
+
+    @classmethod
+    def refresh(cls, product_id):
+        """Recompute the summary of one product from its approved reviews"""
+        with transaction.atomic():
+            values = ProductReview.objects.filter(
+                product_id=product_id, is_approved=True
+            ).aggregate(**cls._aggregates())
+            cls.objects.update_or_create(product_id=product_id, defaults=cls._clean(values))
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every summary with one grouped query"""
+        rows = ProductReview.objects.filter(is_approved=True).order_by().values(
+            'product_id'
+        ).annotate(**cls._aggregates())
+        summaries = {
+            row['product_id']: cls(**cls._clean(row))
+            for row in rows
+        }
+        for product_id in Product.objects.values_list('id', flat=True):
+            summaries.setdefault(product_id, cls(product_id=product_id))
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(summaries.values(), batch_size=500)
+        return len(summaries)
+
+
+class SequenceCounter(models.Model):
+    """Last number handed out for each code prefix (PRD, BSK, ...) - see products/sequences.py"""
+    name = models.CharField(max_length=20, primary_key=True)
+    last_value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
@@ -0,0 +1,192 @@
+# products/pagination.py
+"""
+Keyset (cursor) pagination for the catalog list views.
+
+Django's paginator counts the whole filtered queryset and then has the
+database walk past every earlier row (OFFSET), so deep pages get slower and
+slower. A cursor page is "the next N rows after this sort key" instead: an
+index range scan whatever the depth, and no COUNT.
+
+Views opt in with KeysetPaginationMixin and `cursor_orderings`, which maps
+each supported ordering to the unique key it is paged on. Other orderings
+and old ?page=N links fall back to Django's paginator. The number of pages
+is only computed where the view says counting is cheap (`exact_count`).
+"""
+import base64
+import binascii
+import json
+import math
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+def _parse_keys(keys):
+    return [(key.lstrip('-'), key.startswith('-')) for key in keys]
+
+
+def _after(keys, values):
+    """Q matching rows that come strictly after `values` in `keys` order"""
+    condition = Q(pk__in=[])
+    equal = Q()
+    for (field, descending), value in zip(keys, values):
+        lookup = 'lt' if descending else 'gt'
+        condition |= equal & Q(**{f'{field}__{lookup}': value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+def _json_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+def encode_cursor(ordering, values, number, backwards=False):
+    payload = {'o': ordering, 'v': [_json_value(value) for value in values], 'n': number, 'b': backwards}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, ordering, model, keys):
+    """
+    (values, page number, backwards) of a cursor for `ordering` of `model`,
+    each value converted by its key field. values is None when the cursor
+    was made for another ordering (the user changed the sort order).
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        values, number, backwards = list(payload['v']), max(1, int(payload['n'])), bool(payload['b'])
+        if payload['o'] != ordering or len(values) != len(keys):
+            return None, 1, False
+        typed = []
+        for (field, descending), value in zip(keys, values):
+            value = model._meta.get_field(field).to_python(value)
+            if value is None:
+                raise ValueError("Cursor keys are never NULL")
+            typed.append(value)
+        return typed, number, backwards
+    except (ValueError, KeyError, TypeError, binascii.Error, ValidationError):
+        raise Http404("Invalid page cursor")
+
+
+class CursorPage:
+    """Quacks like django.core.paginator.Page for the templates"""
+
+    def __init__(self, object_list, number, has_next, has_previous, next_cursor, previous_cursor, num_pages=None):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.num_pages = num_pages
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+def paginate_by_cursor(queryset, ordering, keys, page_size, token=None, count=None):
+    """
+    One page of `queryset` ordered by `keys` (e.g. ['-created_at', '-id'], the
+    last one unique), starting from the opaque `token` of a previous page.
+    """
+    parsed = _parse_keys(keys)
+    number, backwards, values = 1, False, None
+    if token:
+        values, number, backwards = decode_cursor(token, ordering, queryset.model, parsed)
+        if values is None:
+            # The user changed the sort order - start again
+            number, backwards = 1, False
+
+    if backwards:
+        # Walk the reversed order from the first row of the later page
+        reverse_keys = [(field, not descending) for field, descending in parsed]
+        queryset = queryset.order_by(*[('-' if d else '') + f for f, d in reverse_keys])
+        rows = list(queryset.filter(_after(reverse_keys, values))[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        queryset = queryset.order_by(*keys)
+        if values is not None:
+            queryset = queryset.filter(_after(parsed, values))
+        rows = list(queryset[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = values is not None
+
+    def key_of(row):
+        return [getattr(row, field) for field, descending in parsed]
+
+    next_cursor = encode_cursor(ordering, key_of(rows[-1]), number + 1) if has_next and rows else None
+    previous_cursor = (
+        encode_cursor(ordering, key_of(rows[0]), number - 1, backwards=True)
+        if has_previous and rows else None
+    )
+    num_pages = max(1, math.ceil(count / page_size)) if count is not None else None
+    return CursorPage(rows, number, has_next and bool(rows), has_previous and bool(rows),
+                      next_cursor, previous_cursor, num_pages)
+
+
+class KeysetPaginationMixin:
+    """ListView mixin: cursor pagination for the orderings in `cursor_orderings`"""
+
+    # ordering name -> unique key to page on, e.g. {'-created_at': ['-created_at', '-id']}
+    cursor_orderings = {}
+    default_ordering = '-created_at'
+    # GET parameter that picks the ordering; None for views with a fixed order
+    ordering_param = 'ordering'
+    # True when COUNT(*) of the filtered queryset is cheap enough to show "page x of y"
+    exact_count = False
+
+    def get_cursor_ordering(self):
+        if self.ordering_param is None:
+            return self.default_ordering
+        return self.request.GET.get(self.ordering_param, self.default_ordering)
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.get_cursor_ordering()
+        keys = self.cursor_orderings.get(ordering)
+        if keys is None or 'page' in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+
+        count = queryset.count() if self.exact_count else None
+        page = paginate_by_cursor(
+            queryset, ordering, keys, page_size, self.request.GET.get('cursor'), count
+        )
+        return (None, page, page.object_list, page.has_other_pages())
+
+    def _page_query(self, page, previous):
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        params.pop('cursor', None)
+        if isinstance(page, CursorPage):
+            params['cursor'] = page.previous_cursor if previous else page.next_cursor
+        else:
+            params['page'] = page.previous_page_number() if previous else page.next_page_number()
+        return params.urlencode()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context.get('page_obj')
+        if page is not None:
+            # Query strings for the prev/next links, keeping the filters and sort order
+            context['previous_page_query'] = self._page_query(page, previous=True) if page.has_previous() else None
+            context['next_page_query'] = self._page_query(page, previous=False) if page.has_next() else None
+            context['page_count'] = page.num_pages if isinstance(page, CursorPage) else page.paginator.num_pages
+        return context
@@ -0,0 +1,261 @@
+# products/search.py
+"""
+Catalog full-text search backed by an SQLite FTS5 table.
+
+Every active Product, ProductBasket, Recipe, Category and Merchandise has one
+row in `products_search_index`. The row id encodes both the model and the
+primary key (pk * 8 + kind code) so a row can be replaced or deleted with a
+rowid lookup instead of a scan. Rows are maintained by products/signals.py;
+run `manage.py rebuild_search_index` after bulk imports.
+
+On a non-SQLite database the functions fall back to the old icontains
+filters so the site keeps working, just without ranking.
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product, ProductBasket, Recipe, Category, Merchandise
+
+SEARCH_TABLE = 'products_search_index'
+
+# Title matches count ten times more than body matches
+RANK_WEIGHTS = (10.0, 1.0)
+
+# kind -> (code, model); codes must stay below 8, they live in the low rowid bits
+KINDS = {
+    'product': (1, Product),
+    'basket': (2, ProductBasket),
+    'recipe': (3, Recipe),
+    'category': (4, Category),
+    'merchandise': (5, Merchandise),
+}
+KIND_BY_CODE = {code: kind for kind, (code, model) in KINDS.items()}
+KIND_BY_MODEL = {model: kind for kind, (code, model) in KINDS.items()}
+
+# Keys used by search_grouped() and the search results template
+GROUP_KEYS = {
+    'product': 'products',
+    'basket': 'baskets',
+    'recipe': 'recipes',
+    'category': 'categories',
+    'merchandise': 'merchandise',
+}
+
+# Fields searched by the icontains fallback
+FALLBACK_FIELDS = {
+    'product': ['name', 'description', 'category__name'],
+    'basket': ['name', 'description'],
+    'recipe': ['title', 'description', 'instructions'],
+    'category': ['name', 'description'],
+    'merchandise': ['name', 'description'],
+}
+
+# Saves limited to other fields (e.g. stock) leave the search row alone
+INDEXED_FIELDS = {'name', 'title', 'description', 'instructions', 'category', 'is_active'}
+
+SearchResult = namedtuple('SearchResult', ['kind', 'object', 'rank'])
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def build_match_query(query):
+    """
+    Turn free text into a safe FTS5 query: every word must match and the
+    last one is a prefix, so results update while the user is still typing.
+    """
+    tokens = TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens[:-1]]
+    terms.append(f'"{tokens[-1]}"*')
+    return ' '.join(terms)
+
+
+def document_for(instance):
+    """Return (title, body) for an indexable instance, or None if it should not be searchable"""
+    if not instance.is_active:
+        return None
+    if isinstance(instance, Product):
+        category = instance.category.name if instance.category_id else ''
+        return instance.name, f"{instance.description} {category}"
+    if isinstance(instance, Recipe):
+        return instance.title, f"{instance.description} {instance.instructions}"
+    return instance.name, instance.description
+
+
+def _rowid(kind, pk):
+    return pk * 8 + KINDS[kind][0]
+
+
+def index_instance(instance):
+    """Insert, replace or drop the search row for one instance"""
+    index_instances([instance])
+
+
+def index_instances(instances):
+    """Insert, replace or drop the search rows for many instances of any kind"""
+    if not fts_available():
+        return
+    deletes, inserts = [], []
+    for instance in instances:
+        rowid = _rowid(KIND_BY_MODEL[type(instance)], instance.pk)
+        deletes.append((rowid,))
+        document = document_for(instance)
+        if document is not None:
+            inserts.append((rowid, *document))
+
+    # Delete + insert must be one unit, or two concurrent saves can insert the same rowid
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", deletes)
+        if inserts:
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) VALUES (%s, %s, %s)", inserts
+            )
+
+
+def remove_instance(instance):
+    if not fts_available():
+        return
+    rowid = _rowid(KIND_BY_MODEL[type(instance)], instance.pk)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [rowid])
+
+
+def rebuild_index(chunk_size=2000):
+    """Drop and re-create every search row. Returns the number of indexed objects."""
+    if not fts_available():
+        return 0
+    insert_sql = f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) VALUES (%s, %s, %s)"
+    total = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        for kind, (code, model) in KINDS.items():
+            queryset = model.objects.filter(is_active=True)
+            if model is Product:
+                queryset = queryset.select_related('category')
+            rows = []
+            for instance in queryset.iterator(chunk_size=chunk_size):
+                rows.append((_rowid(kind, instance.pk), *document_for(instance)))
+                if len(rows) >= chunk_size:
+                    cursor.executemany(insert_sql, rows)
+                    total += len(rows)
+                    rows = []
+            cursor.executemany(insert_sql, rows)
+            total += len(rows)
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', %s)",
+            [f"bm25({', '.join(str(weight) for weight in RANK_WEIGHTS)})"]
+        )
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def matching_ids_sql(query, kind):
+    """
+    RawSQL selecting the primary keys of `kind` that match `query`, for use as
+    `queryset.filter(id__in=...)`. Returns None when the query has no words.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return None
+    return RawSQL(
+        f"SELECT rowid >> 3 FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND (rowid & 7) = %s",
+        [match, KINDS[kind][0]]
+    )
+
+
+def filter_queryset(queryset, query, kind):
+    """Restrict a queryset of `kind` to objects matching the search query"""
+    if not fts_available():
+        condition = Q()
+        for field in FALLBACK_FIELDS[kind]:
+            condition |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(condition)
+    ids = matching_ids_sql(query, kind)
+    if ids is None:
+        return queryset.none()
+    return queryset.filter(id__in=ids)
+
+
+def _hydrate(kind, ids):
+    model = KINDS[kind][1]
+    queryset = model.objects.all()
+    if model is Product:
+        queryset = queryset.select_related('category')
+    elif model is ProductBasket:
+        queryset = queryset.prefetch_related('included_products')
+    return queryset.in_bulk(ids)
+
+
+def search(query, kinds=None, per_kind=None, limit=50):
+    """
+    Ranked search across catalog types in one FTS query.
+
+    Returns a list of SearchResult sorted best match first. `per_kind` caps
+    the number of results of each kind before the overall `limit` applies.
+    """
+    kinds = list(kinds or KINDS)
+    if not fts_available():
+        return _fallback_search(query, kinds, per_kind, limit)
+
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    codes = ', '.join(str(KINDS[kind][0]) for kind in kinds)
+    where = f"{SEARCH_TABLE} MATCH %s AND (rowid & 7) IN ({codes})"
+    if per_kind and len(kinds) > 1:
+        # `rank` is bm25 with RANK_WEIGHTS (configured by rebuild_index / the migration);
+        # unlike bm25() itself it can be used inside the window function
+        sql = (
+            f"SELECT rowid, rank FROM ("
+            f"  SELECT rowid, rank, ROW_NUMBER() OVER (PARTITION BY rowid & 7 ORDER BY rank) AS position"
+            f"  FROM {SEARCH_TABLE} WHERE {where}"
+            f") WHERE position <= %s ORDER BY rank LIMIT %s"
+        )
+        params = [match, per_kind, limit]
+    else:
+        sql = f"SELECT rowid, rank FROM {SEARCH_TABLE} WHERE {where} ORDER BY rank LIMIT %s"
+        params = [match, limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    ids_by_kind = {}
+    for rowid, score in rows:
+        ids_by_kind.setdefault(KIND_BY_CODE[rowid & 7], []).append(rowid >> 3)
+    objects = {kind: _hydrate(kind, ids) for kind, ids in ids_by_kind.items()}
+
+    results = []
+    for rowid, score in rows:
+        kind = KIND_BY_CODE[rowid & 7]
+        instance = objects[kind].get(rowid >> 3)
+        if instance is not None:
+            # bm25 is negative, lower is better - flip it so higher means more relevant
+            results.append(SearchResult(kind, instance, -score))
+    return results
+
+
+def _fallback_search(query, kinds, per_kind, limit):
+    results = []
+    for kind in kinds:
+        queryset = filter_queryset(KINDS[kind][1].objects.filter(is_active=True), query, kind)
+        for instance in queryset[:per_kind or limit]:
+            results.append(SearchResult(kind, instance, 0.0))
+    return results[:limit]
+
+
+def search_grouped(query, per_kind=5):
+    """search() results bucketed by kind: {'products': [...], 'baskets': [...], ...}"""
+    grouped = {key: [] for key in GROUP_KEYS.values()}
+    for result in search(query, per_kind=per_kind, limit=per_kind * len(KINDS)):
+        grouped[GROUP_KEYS[result.kind]].append(result.object)
+    return grouped
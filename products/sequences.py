@@ -0,0 +1,136 @@
+# products/sequences.py
+"""
+Human-readable codes (PRD-0042, BSK-0007, RCP-0003, MRCH-0012) from a counter table.
+
+Each prefix has one SequenceCounter row. A process reserves a block of
+numbers with a single UPDATE of that row and then hands them out from
+memory, so an insert no longer reads the model table and two processes can
+never be given the same number. Codes stay increasing but can have gaps
+(the unused part of a block is dropped when the process exits).
+
+Inside a transaction only the numbers needed right now are reserved: if the
+transaction rolls back, the counter rolls back with it, and a cached block
+would then be handed out a second time by another process.
+"""
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max
+
+from .models import Product, ProductBasket, Recipe, Merchandise, SequenceCounter
+
+BLOCK_SIZE = getattr(settings, 'SEQUENCE_BLOCK_SIZE', 100)
+
+# prefix -> (model, code field)
+SEQUENCES = {
+    'PRD': (Product, 'product_id'),
+    'BSK': (ProductBasket, 'basket_id'),
+    'RCP': (Recipe, 'recipe_id'),
+    'MRCH': (Merchandise, 'product_id'),
+}
+PREFIX_BY_MODEL = {model: prefix for prefix, (model, field) in SEQUENCES.items()}
+
+_lock = threading.Lock()
+# prefix -> [next number, last number] of this process's current block
+_blocks = {}
+
+
+def format_code(prefix, number):
+    return f"{prefix}-{str(number).zfill(4)}"
+
+
+def highest_existing(prefix):
+    """Largest number already used by the model's codes (or ids, which the old codes were based on)"""
+    model, field = SEQUENCES[prefix]
+    highest = model.objects.aggregate(Max('id'))['id__max'] or 0
+    for code in model.objects.values_list(field, flat=True).iterator():
+        suffix = (code or '').rsplit('-', 1)[-1]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+
+def _returns_from_update():
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return connection.vendor == 'postgresql'
+
+
+def _take(prefix, count):
+    """UPDATE ... RETURNING: the counter's new last_value in one statement, or None if it has no row"""
+    opts = SequenceCounter._meta
+    quote = connection.ops.quote_name
+    last_value, name = quote(opts.get_field('last_value').column), quote(opts.get_field('name').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {quote(opts.db_table)} SET {last_value} = {last_value} + %s WHERE {name} = %s "
+            f"RETURNING {last_value}",
+            [count, prefix],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def reserve(prefix, count):
+    """Atomically take `count` numbers from the counter; returns the first one"""
+    if _returns_from_update():
+        # A single statement is atomic on its own: no savepoint, no read back
+        last_value = _take(prefix, count)
+        if last_value is not None:
+            return last_value - count + 1
+
+    with transaction.atomic():
+        updated = SequenceCounter.objects.filter(name=prefix).update(last_value=F('last_value') + count)
+        if not updated:
+            # First use on a database the migration did not seed
+            try:
+                with transaction.atomic():
+                    SequenceCounter.objects.create(name=prefix, last_value=highest_existing(prefix) + count)
+            except IntegrityError:
+                # Another process created it first
+                SequenceCounter.objects.filter(name=prefix).update(last_value=F('last_value') + count)
+        last_value = SequenceCounter.objects.filter(name=prefix).values_list('last_value', flat=True).get()
+    return last_value - count + 1
+
+
+def next_numbers(prefix, count):
+    """`count` unused numbers for `prefix`, taken from the process block when possible"""
+    numbers = []
+    with _lock:
+        block = _blocks.get(prefix)
+        if block and block[0] <= block[1]:
+            take = min(count, block[1] - block[0] + 1)
+            numbers.extend(range(block[0], block[0] + take))
+            block[0] += take
+
+        missing = count - len(numbers)
+        if missing:
+            if connection.in_atomic_block:
+                start = reserve(prefix, missing)
+            else:
+                size = max(missing, BLOCK_SIZE)
+                start = reserve(prefix, size)
+                _blocks[prefix] = [start + missing, start + size - 1]
+            numbers.extend(range(start, start + missing))
+    return numbers
+
+
+def assign_codes(instances):
+    """
+    Give every instance without a code a new one. Instances of several models
+    can be mixed; each model costs at most one counter UPDATE, so this is what
+    bulk_create imports should call before inserting.
+    """
+    pending = defaultdict(list)
+    for instance in instances:
+        prefix = PREFIX_BY_MODEL[type(instance)]
+        if not getattr(instance, SEQUENCES[prefix][1]):
+            pending[prefix].append(instance)
+
+    for prefix, group in pending.items():
+        field = SEQUENCES[prefix][1]
+        for instance, number in zip(group, next_numbers(prefix, len(group))):
+            setattr(instance, field, format_code(prefix, number))
+    return instances
@@ -1,8 +1,14 @@
 # products/signals.py
-from django.db.models.signals import post_save, pre_save
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
 from django.utils.text import slugify
-from .models import Product, ProductBasket, Recipe, Category
+from .models import (
+    Product, ProductBasket, BasketItem, Recipe, RecipeIngredient, Category, Merchandise,
+    ProductReview, ProductRatingSummary
+)
+from . import images, search
+from .cache import bump_catalog_version
 
 @receiver(pre_save, sender=Category)
 def category_pre_save(sender, instance, **kwargs):
@@ -26,4 +32,92 @@ def basket_pre_save(sender, instance, **kwargs):
 def recipe_pre_save(sender, instance, **kwargs):
     """Auto-generate slug for recipe if not provided"""
     if not instance.slug:
-        instance.slug = slugify(instance.title)
\ No newline at end of file
+        instance.slug = slugify(instance.title)
+
+@receiver(post_save, sender=BasketItem)
+@receiver(post_delete, sender=BasketItem)
+def basket_item_changed(sender, instance, **kwargs):
+    """Keep the basket's denormalized pricing in sync with its contents"""
+    ProductBasket.refresh_pricing([instance.basket_id])
+
+@receiver(post_save, sender=Product)
+def product_price_changed(sender, instance, created, update_fields=None, **kwargs):
+    """Re-price every basket that includes this product"""
+    if created or (update_fields is not None and 'price' not in update_fields):
+        return
+    basket_ids = instance.basket_items.values_list('basket_id', flat=True)
+    ProductBasket.refresh_pricing(basket_ids)
+
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def review_changed(sender, instance, origin=None, **kwargs):
+    """Keep the product's rating summary in step with its reviews"""
+    # The product itself is being deleted - its summary goes with it
+    if isinstance(origin, Product) or (isinstance(origin, QuerySet) and origin.model is Product):
+        return
+    ProductRatingSummary.refresh(instance.product_id)
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductBasket)
+@receiver(post_save, sender=Recipe)
+def update_image_variants(sender, instance, **kwargs):
+    """Resize a newly uploaded image (before catalog_changed drops the cached pages)"""
+    if kwargs.get('raw'):
+        return
+    images.refresh_variants(instance)
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductBasket)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Merchandise)
+def update_search_index(sender, instance, **kwargs):
+    """Keep the full-text search row in step with the object"""
+    if kwargs.get('raw'):
+        return
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not search.INDEXED_FIELDS.intersection(update_fields):
+        return
+    search.index_instance(instance)
+    # Product rows include their category name
+    if sender is Category and not kwargs.get('created'):
+        search.index_instances(instance.products.select_related('category'))
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductBasket)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Merchandise)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_instance(instance)
+
+@receiver(pre_delete, sender=Category)
+def note_category_products(sender, instance, **kwargs):
+    """Remember the products whose search rows carry the category's name (SET_NULL sends no signal)"""
+    if search.fts_available():
+        instance._indexed_product_ids = list(instance.products.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Category)
+def reindex_category_products(sender, instance, **kwargs):
+    """Re-index them without it, as saving a category does"""
+    product_ids = getattr(instance, '_indexed_product_ids', None)
+    if product_ids:
+        search.index_instances(Product.objects.filter(pk__in=product_ids).select_related('category'))
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductBasket)
+@receiver(post_save, sender=BasketItem)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Merchandise)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductBasket)
+@receiver(post_delete, sender=BasketItem)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Merchandise)
+def catalog_changed(sender, instance, **kwargs):
+    """Drop the cached home page context and cart summaries"""
+    bump_catalog_version()
@@ -0,0 +1,98 @@
+# products/stock.py
+"""
+Stock decrements that cannot oversell.
+
+Every decrement is a conditional UPDATE (`stock = stock - n WHERE stock >= n`)
+so the check and the write happen in the database under its write lock, not
+in Python. All products of a call are decremented with one statement (and all
+merchandise with another) inside one transaction: either every line is taken
+or nothing is, and the failing lines are reported back.
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .cache import bump_catalog_version
+from .models import Product, BasketItem, Merchandise
+
+# kind is 'product', 'basket' or 'merchandise'
+StockLine = namedtuple('StockLine', ['kind', 'object_id', 'quantity'])
+
+# The stock-holding item (a product or merchandise) that could not cover `line`
+StockFailure = namedtuple('StockFailure', ['line', 'kind', 'object_id', 'requested', 'available'])
+
+
+def _conditional_decrement(model, needs):
+    """One UPDATE that takes needs[pk] from every row that has enough; returns rows updated"""
+    amount = Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in needs.items()],
+        output_field=IntegerField()
+    )
+    return model.objects.filter(pk__in=needs.keys(), stock__gte=amount).update(stock=F('stock') - amount)
+
+
+def _shortfalls(model, needs):
+    """{pk: available} for rows that cannot cover their need (missing rows count as 0)"""
+    available = dict(model.objects.filter(pk__in=needs.keys()).values_list('pk', 'stock'))
+    return {
+        pk: available.get(pk, 0)
+        for pk, quantity in needs.items()
+        if available.get(pk, 0) < quantity
+    }
+
+
+def decrement_stock(lines):
+    """
+    Take stock for every line in one transaction.
+
+    Basket lines are expanded into their products. Returns a list of
+    StockFailure - empty when everything was decremented. If anything fails,
+    nothing is decremented.
+    """
+    lines = [line for line in lines if line.quantity > 0]
+    product_needs = defaultdict(int)
+    merchandise_needs = defaultdict(int)
+    # (kind, pk) -> lines that need it, to map failures back to order lines
+    contributors = defaultdict(list)
+
+    basket_ids = {line.object_id for line in lines if line.kind == 'basket'}
+    composition = defaultdict(list)
+    if basket_ids:
+        for basket_id, product_id, quantity in BasketItem.objects.filter(
+            basket_id__in=basket_ids
+        ).order_by().values_list('basket_id', 'product_id', 'quantity'):
+            composition[basket_id].append((product_id, quantity))
+
+    for line in lines:
+        if line.kind == 'product':
+            product_needs[line.object_id] += line.quantity
+            contributors['product', line.object_id].append(line)
+        elif line.kind == 'merchandise':
+            merchandise_needs[line.object_id] += line.quantity
+            contributors['merchandise', line.object_id].append(line)
+        elif line.kind == 'basket':
+            for product_id, quantity in composition[line.object_id]:
+                product_needs[product_id] += quantity * line.quantity
+                contributors['product', product_id].append(line)
+        else:
+            raise ValueError(f"Unknown stock line kind: {line.kind}")
+
+    failures = []
+    with transaction.atomic():
+        for kind, model, needs in (
+            ('product', Product, product_needs),
+            ('merchandise', Merchandise, merchandise_needs),
+        ):
+            if not needs or _conditional_decrement(model, needs) == len(needs):
+                continue
+            # Rows that were short were not touched, so their stock is still accurate here
+            for pk, available in _shortfalls(model, needs).items():
+                for line in contributors[kind, pk]:
+                    failures.append(StockFailure(line, kind, pk, needs[pk], available))
+        if failures:
+            transaction.set_rollback(True)
+        elif product_needs or merchandise_needs:
+            # The home page shows stock levels
+            bump_catalog_version()
+    return failures
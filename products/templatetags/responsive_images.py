@@ -0,0 +1,47 @@
+# products/templatetags/responsive_images.py
+from django import template
+from django.utils.html import format_html
+
+from products.images import srcset, usable, variant_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(obj, sizes='100vw', alt='', css_class='', style=''):
+    """
+    <img> for obj.image with WebP and fallback srcsets from obj.image_variants.
+    Usage: {% responsive_image product "(max-width: 576px) 50vw, 25vw" alt=product.name css_class="product-image-1" %}
+    """
+    image = getattr(obj, 'image', None)
+    if not image:
+        return ''
+    variants = usable(getattr(obj, 'image_variants', None))
+    if not variants:
+        # Not resized (yet - run backfill_image_variants) - serve the original
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}" loading="lazy">',
+            image.url, alt, css_class, style
+        )
+    fallback = variants['fallback']
+    # display: contents keeps <picture> out of the layout, so CSS written for a bare <img> still applies
+    return format_html(
+        '<picture style="display: contents">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" style="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        srcset(variants, 'webp'), sizes,
+        variant_url(variants, 640, fallback), srcset(variants, fallback), sizes, alt, css_class, style
+    )
+
+
+@register.filter
+def thumbnail_url(obj, width=160):
+    """URL of a small copy of obj.image, for fixed-size thumbnails"""
+    image = getattr(obj, 'image', None)
+    if not image:
+        return ''
+    variants = usable(getattr(obj, 'image_variants', None))
+    if not variants:
+        return image.url
+    return variant_url(variants, int(width))
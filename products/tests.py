@@ -1,3 +1,327 @@
-from django.test import TestCase
+import base64
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import search, sequences
+from .bulk import BulkUploadError, _parse, read_rows
+from .models import BasketItem, Category, Merchandise, Product, ProductBasket, SequenceCounter
+from .pagination import encode_cursor, paginate_by_cursor
+from .stock import StockFailure, StockLine, decrement_stock
+
+
+def make_product(name, stock):
+    return Product.objects.create(name=name, slug=name.lower().replace(' ', '-'), price=Decimal('100'),
+                                  stock=stock, description=name)
+
+
+class BulkParseTests(SimpleTestCase):
+    """Cells of a price/stock upload: bad ones must raise ValueError (a row error), never crash the upload"""
+
+    def test_valid_values(self):
+        self.assertEqual(_parse('price', ' 120.5 '), Decimal('120.50'))
+        self.assertEqual(_parse('price', '99999999.99'), Decimal('99999999.99'))
+        self.assertEqual(_parse('stock', '40'), 40)
+        self.assertEqual(_parse('stock', '40.0'), 40)
+
+    def test_rejected_prices(self):
+        for raw in ['', 'abc', 'NaN', 'sNaN', 'Infinity', '-Infinity', '-1', '1.005', '1e20', '100000000', '1e40']:
+            with self.subTest(raw=raw):
+                with self.assertRaises(ValueError):
+                    _parse('price', raw)
+
+    def test_rejected_stock(self):
+        too_many = str(connection.ops.integer_field_range('PositiveIntegerField')[1] + 1)
+        for raw in ['', 'abc', 'NaN', 'sNaN', 'Infinity', '-Infinity', '-1', '2.5', '1e40', too_many]:
+            with self.subTest(raw=raw):
+                with self.assertRaises(ValueError):
+                    _parse('stock', raw)
+
+
+class ReadRowsTests(SimpleTestCase):
+    def test_unreadable_files_are_upload_errors(self):
+        for name, data in [
+            ('latin1.csv', 'product_id,price\nPRD-0001,10\nPRD-0002,caf\xe9\n'.encode('latin-1')),
+            ('broken.xlsx', b'PK\x03\x04not a workbook'),
+        ]:
+            with self.subTest(name=name):
+                with self.assertRaises(BulkUploadError):
+                    list(read_rows(SimpleUploadedFile(name, data)))
+
+    def test_csv_rows(self):
+        upload = SimpleUploadedFile('ok.csv', '\ufeffproduct_id,Price\nPRD-0001, 10\n,\n'.encode('utf-8'))
+        self.assertEqual(list(read_rows(upload)), [(2, {'product_id': 'PRD-0001', 'price': ' 10'})])
+
+
+class DecrementStockTests(TestCase):
+    def setUp(self):
+        self.product = make_product("Stock product", 5)
+        self.merchandise = Merchandise.objects.create(name="Stock mug", price=Decimal('50'), stock=2, description="Mug")
+        self.basket = ProductBasket.objects.create(name="Stock basket", slug="stock-basket", price=Decimal('300'),
+                                                   description="Basket")
+        BasketItem.objects.create(basket=self.basket, product=self.product, quantity=2)
+
+    def stock(self):
+        self.product.refresh_from_db()
+        self.merchandise.refresh_from_db()
+        return self.product.stock, self.merchandise.stock
+
+    def test_takes_every_line(self):
+        failures = decrement_stock([
+            StockLine('product', self.product.id, 1),
+            StockLine('basket', self.basket.id, 1),
+            StockLine('merchandise', self.merchandise.id, 2),
+        ])
+        self.assertEqual(failures, [])
+        self.assertEqual(self.stock(), (2, 0))
+
+    def test_all_or_nothing(self):
+        basket_line = StockLine('basket', self.basket.id, 2)
+        failures = decrement_stock([
+            StockLine('merchandise', self.merchandise.id, 1),
+            basket_line,
+            StockLine('product', self.product.id, 2),
+        ])
+        # The basket's 4 plus the direct 2 need 6 of the product's 5; the mug is not taken either
+        self.assertEqual(self.stock(), (5, 2))
+        self.assertEqual(len(failures), 2)
+        self.assertIn(StockFailure(basket_line, 'product', self.product.id, 6, 5), failures)
+        self.assertEqual({failure.kind for failure in failures}, {'product'})
+
+    def test_missing_item_fails(self):
+        line = StockLine('merchandise', 999999, 1)
+        self.assertEqual(decrement_stock([line]), [StockFailure(line, 'merchandise', 999999, 1, 0)])
+
+
+class ConcurrentDecrementTests(TransactionTestCase):
+    """Many threads racing for the last units never take more than there is"""
+    THREADS = 8
+    ATTEMPTS = 6
+
+    def test_no_oversell(self):
+        product = make_product("Race product", 20)
+        basket = ProductBasket.objects.create(name="Race basket", slug="race-basket", price=Decimal('300'),
+                                              description="Basket")
+        BasketItem.objects.create(basket=basket, product=product, quantity=2)
+        taken = []
+        start = threading.Barrier(self.THREADS)
+
+        def worker(number):
+            lines = [StockLine('basket', basket.id, 1)] if number % 2 else [StockLine('product', product.id, 1)]
+            units = 2 if number % 2 else 1
+            try:
+                start.wait()
+                for _ in range(self.ATTEMPTS):
+                    try:
+                        if not decrement_stock(lines):
+                            taken.append(units)
+                    except OperationalError:
+                        # "database is locked": the order fails, like a timed-out request
+                        pass
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        # 72 units were asked for, 20 exist: every successful order was taken in full, and no more
+        self.assertGreater(len(taken), 0)
+        self.assertLessEqual(sum(taken), 20)
+        self.assertEqual(product.stock, 20 - sum(taken))
+
+
+class CursorPaginationTests(TestCase):
+    """Cursor pages: every row exactly once in either direction, and bad cursors are never a 500"""
+    PAGE_SIZE = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        # Three prices and one creation time for all: the sort keys tie, only the id breaks them
+        created = timezone.now() - timedelta(days=1)
+        for n in range(11):
+            product = make_product(f"Paged {n:02}", 1)
+            product.price = Decimal(['10', '20', '30'][n % 3])
+            product.save()
+        Product.objects.update(created_at=created)
+
+    def walk(self, ordering, keys):
+        """Pages forward to the end, then back to the start; the rows of each page, by number"""
+        queryset = Product.objects.all()
+        forward, page = {}, paginate_by_cursor(queryset, ordering, keys, self.PAGE_SIZE)
+        while True:
+            forward[page.number] = [p.id for p in page]
+            if not page.has_next():
+                break
+            page = paginate_by_cursor(queryset, ordering, keys, self.PAGE_SIZE, page.next_cursor)
+        backward = {page.number: [p.id for p in page]}
+        while page.has_previous():
+            page = paginate_by_cursor(queryset, ordering, keys, self.PAGE_SIZE, page.previous_cursor)
+            backward[page.number] = [p.id for p in page]
+        return forward, backward
+
+    def test_forward_and_back_with_ties(self):
+        for ordering, keys in [('price', ['price', 'id']), ('-price', ['-price', '-id']),
+                               ('-created_at', ['-created_at', '-id'])]:
+            with self.subTest(ordering=ordering):
+                forward, backward = self.walk(ordering, keys)
+                expected = list(Product.objects.order_by(*keys).values_list('id', flat=True))
+                self.assertEqual(list(forward), [1, 2, 3])
+                self.assertEqual([row for number in sorted(forward) for row in forward[number]], expected)
+                self.assertEqual(backward, forward)
+
+    def test_list_view_pages(self):
+        for n in range(11, 16):
+            make_product(f"Paged {n:02}", 1)
+        url = reverse('products:product_list')
+        response = self.client.get(url, {'ordering': 'price'})
+        self.assertEqual(response.status_code, 200)
+        first = [p.id for p in response.context['products']]
+        response = self.client.get(f"{url}?{response.context['next_page_query']}")
+        self.assertEqual(response.context['page_obj'].number, 2)
+        second = [p.id for p in response.context['products']]
+        self.assertEqual(len(first) + len(second), 16)
+        self.assertTrue(set(first).isdisjoint(second))
+        response = self.client.get(f"{url}?{response.context['previous_page_query']}")
+        self.assertEqual([p.id for p in response.context['products']], first)
+
+    def test_cursor_of_another_ordering_starts_over(self):
+        cursor = encode_cursor('-created_at', [timezone.now(), 5], 3)
+        response = self.client.get(reverse('products:product_list'), {'ordering': 'price', 'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_malformed_cursors_are_not_found(self):
+        def token(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+        for cursor in [
+            'not-a-cursor', '%%%', token([1, 2]), token({'o': 'price'}),
+            token({'o': 'price', 'v': ['abc', 1], 'n': 2, 'b': False}),
+            token({'o': 'price', 'v': ['10', 'x'], 'n': 2, 'b': False}),
+            token({'o': 'price', 'v': [None, 1], 'n': 2, 'b': False}),
+            token({'o': 'price', 'v': [{'a': 1}, 1], 'n': 2, 'b': False}),
+            token({'o': 'price', 'v': ['10', 1], 'n': 'two', 'b': False}),
+            token({'o': 'price', 'v': 7, 'n': 2, 'b': False}),
+        ]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('products:product_list'), {'ordering': 'price', 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class CategorySearchIndexTests(TestCase):
+    """Product search rows include the category name, so they follow the category"""
+
+    def setUp(self):
+        if not search.fts_available():
+            self.skipTest("No FTS5 in this SQLite")
+        self.category = Category.objects.create(name="Brassicas", description="Cabbages and kale")
+        self.product = make_product("Curly kale", 3)
+        self.product.category = self.category
+        self.product.save()
+
+    def matches(self, query):
+        return list(search.filter_queryset(Product.objects.all(), query, 'product').values_list('pk', flat=True))
+
+    def test_renamed_category(self):
+        self.assertEqual(self.matches("brassicas"), [self.product.pk])
+        self.category.name = "Greens"
+        self.category.save()
+        self.assertEqual(self.matches("brassicas"), [])
+        self.assertEqual(self.matches("greens"), [self.product.pk])
+
+    def test_deleted_category(self):
+        self.category.delete()
+        self.assertEqual(self.matches("brassicas"), [])
+        self.assertEqual(self.matches("kale"), [self.product.pk])
+
+
+class SequenceTests(TransactionTestCase):
+    """Codes come from SequenceCounter blocks: never reused, gaps allowed"""
+
+    def setUp(self):
+        for prefix in sequences.SEQUENCES:
+            SequenceCounter.objects.update_or_create(name=prefix, defaults={'last_value': 0})
+        # Each test starts like a fresh process, without a cached block
+        patcher = mock.patch.object(sequences, '_blocks', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def allocate(self, blocks, returning, count):
+        """next_numbers() as a process with its own cached blocks and counter UPDATE would run it"""
+        with mock.patch.object(sequences, '_blocks', blocks), \
+                mock.patch.object(sequences, '_returns_from_update', return_value=returning):
+            return sequences.next_numbers('PRD', count)
+
+    @mock.patch.object(sequences, 'BLOCK_SIZE', 5)
+    def test_processes_never_share_a_number(self):
+        # One process on UPDATE ... RETURNING, one on the update-then-read fallback, both handing out blocks
+        first, second = {}, {}
+        numbers = {id(first): [], id(second): []}
+        for blocks, returning, count in [
+            (first, True, 3), (second, False, 2), (first, True, 4),
+            (second, False, 7), (first, True, 1), (second, False, 5),
+        ]:
+            numbers[id(blocks)] += self.allocate(blocks, returning, count)
+
+        handed_out = numbers[id(first)] + numbers[id(second)]
+        self.assertEqual(len(handed_out), 22)
+        self.assertEqual(len(set(handed_out)), len(handed_out))
+        for taken in numbers.values():
+            self.assertEqual(taken, sorted(taken))
+        # Blocks of 5 (or the whole request when it is bigger) were taken from the one counter
+        self.assertGreaterEqual(SequenceCounter.objects.get(name='PRD').last_value, max(handed_out))
+
+    def test_block_is_used_before_the_counter(self):
+        with mock.patch.object(sequences, 'BLOCK_SIZE', 10):
+            self.assertEqual(sequences.next_numbers('PRD', 3), [1, 2, 3])
+            self.assertEqual(sequences.next_numbers('PRD', 9), [4, 5, 6, 7, 8, 9, 10, 11, 12])
+        # 3 + 7 from the first block, then 2 from a second block of 10
+        self.assertEqual(SequenceCounter.objects.get(name='PRD').last_value, 20)
+
+    def test_transaction_reserves_only_what_it_uses(self):
+        with transaction.atomic():
+            self.assertEqual(sequences.next_numbers('PRD', 2), [1, 2])
+        self.assertEqual(SequenceCounter.objects.get(name='PRD').last_value, 2)
+        self.assertNotIn('PRD', sequences._blocks)
+
+    def test_counter_created_on_first_use(self):
+        SequenceCounter.objects.filter(name='PRD').delete()
+        Product.objects.bulk_create([Product(product_id='PRD-0041', name="Imported", slug="imported",
+                                             price=Decimal('10'), description="Imported")])
+        # The new counter starts after the codes (and ids) already in the table
+        self.assertEqual(make_product("First after import", 1).product_id, 'PRD-0042')
+
+    def test_assign_codes_for_bulk_lists(self):
+        products = [Product(name=f"Bulk {n}", slug=f"bulk-{n}", price=Decimal('10'), description="Bulk")
+                    for n in range(4)]
+        products[1].product_id = 'PRD-9000'
+        merchandise = [Merchandise(name=f"Bulk mug {n}", price=Decimal('5'), description="Mug") for n in range(3)]
+
+        # One counter UPDATE per model, however many instances
+        with CaptureQueriesContext(connection) as queries:
+            sequences.assign_codes(products + merchandise)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+
+        self.assertEqual([p.product_id for p in products], ['PRD-0001', 'PRD-9000', 'PRD-0002', 'PRD-0003'])
+        self.assertEqual([m.product_id for m in merchandise], ['MRCH-0001', 'MRCH-0002', 'MRCH-0003'])
+        Product.objects.bulk_create(products)
+        Merchandise.objects.bulk_create(merchandise)
+        self.assertEqual(Product.objects.count(), 4)
+
+        # Saving one by one continues from the cached block
+        self.assertEqual(make_product("After bulk", 1).product_id, 'PRD-0004')
@@ -1,6 +1,6 @@
 # products/utils.py
-from django.db.models import Q
 from .models import Product, ProductBasket, Recipe, Category
+from . import search
 
 def get_featured_items():
     """Get featured items for homepage"""
@@ -13,39 +13,12 @@ def get_featured_items():
 
 def calculate_basket_stock(basket):
     """Calculate available stock for a basket"""
-    if not basket.included_products.exists():
-        return 0
-    
-    min_stock = None
-    for item in basket.included_products.all():
-        product_stock = item.product.stock // item.quantity
-        if min_stock is None or product_stock < min_stock:
-            min_stock = product_stock
-    
-    return min_stock or 0
+    return ProductBasket.get_stock_map([basket.id])[basket.id]
 
 def search_all(query):
     """Search across all product types"""
-    results = {
-        'products': Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query),
-            is_active=True
-        ),
-        'baskets': ProductBasket.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query),
-            is_active=True
-        ),
-        'recipes': Recipe.objects.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query),
-            is_active=True
-        ),
-        'categories': Category.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query),
-            is_active=True
-        ),
-    }
-    return results
\ No newline at end of file
+    results = {}
+    for kind, (code, model) in search.KINDS.items():
+        queryset = model.objects.filter(is_active=True)
+        results[search.GROUP_KEYS[kind]] = search.filter_queryset(queryset, query, kind)
+    return results
@@ -11,19 +11,24 @@ from django.contrib import messages
 # Import models
 from .models import (
     Product, ProductBasket, Recipe, Merchandise, 
-    Category, BasketItem, ProductReview
+    Category, BasketItem, ProductReview, ProductRatingSummary
 )
 
+from . import bulk, search
+from .cache import get_home_context
+from .pagination import KeysetPaginationMixin
+
 # Import forms
 from .forms import (
     SearchForm, FilterForm, ProductForm, ProductBasketForm, 
     RecipeForm, MerchandiseForm, CategoryForm, RecipeIngredientForm, 
-    BasketItemForm, ProductReviewForm
+    BasketItemForm, ProductReviewForm, BulkUpdateForm
 )
 from django.db.models import Avg, Count, Q
 from django.views.generic import ListView
-from django.db.models import Avg, Count, Q, Value
+from django.db.models import Avg, Count, Q, Value, DecimalField, IntegerField
 from django.db.models.functions import Coalesce
+from decimal import Decimal
 from django.views.generic import ListView
 from django.shortcuts import get_object_or_404
 from .models import Product, Category
@@ -31,26 +36,45 @@ from .models import Product, Category
 
 # Create your views here.
 
+def annotate_ratings(queryset):
+    """Attach average_rating / reviews_count from the materialized rating summary"""
+    return queryset.annotate(
+        average_rating=Coalesce(
+            'rating_summary__average_rating', Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=3, decimal_places=2)
+        ),
+        reviews_count=Coalesce(
+            'rating_summary__reviews_count', Value(0),
+            output_field=IntegerField()
+        ),
+    )
+
 class HomeView(TemplateView):
     template_name = 'products/home.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['featured_products'] = Product.objects.filter(
-            is_active=True, 
-            is_new=True
-        )[:8]
-        context['product_baskets'] = ProductBasket.objects.filter(
-            is_active=True
-        ).prefetch_related('included_products__product')[:4]
-        context['featured_recipes'] = Recipe.objects.filter(
-            is_active=True, 
-            is_featured=True
-        ).prefetch_related('ingredients__product')[:4]
-        context['categories'] = Category.objects.filter(is_active=True)[:8]
-        context['merchandise'] = Merchandise.objects.filter(is_active=True)[:4]
+        context.update(get_home_context('products', self.build_home_context))
         return context
 
+    @staticmethod
+    def build_home_context():
+        return {
+            'featured_products': list(Product.objects.filter(
+                is_active=True, 
+                is_new=True
+            )[:8]),
+            'product_baskets': list(ProductBasket.objects.filter(
+                is_active=True
+            ).prefetch_related('included_products__product')[:4]),
+            'featured_recipes': list(Recipe.objects.filter(
+                is_active=True, 
+                is_featured=True
+            ).prefetch_related('ingredients__product')[:4]),
+            'categories': list(Category.objects.filter(is_active=True)[:8]),
+            'merchandise': list(Merchandise.objects.filter(is_active=True)[:4]),
+        }
+
 # products/views.py
 
 
@@ -59,19 +83,22 @@ class HomeView(TemplateView):
 
 
 
-class ProductListView(ListView):
+class ProductListView(KeysetPaginationMixin, ListView):
     model = Product
     template_name = 'products/product_list.html'
     context_object_name = 'products'
     paginate_by = 12
+    cursor_orderings = {
+        '-created_at': ['-created_at', '-id'],
+        'name': ['name', 'id'],
+        '-name': ['-name', '-id'],
+        'price': ['price', 'id'],
+        '-price': ['-price', '-id'],
+    }
 
     def get_queryset(self):
-        qs = Product.objects.filter(is_active=True).select_related('category')
-
-        # This line now works perfectly
-        qs = qs.annotate(
-            average_rating=Coalesce(Avg('reviews__rating'), Value(0.0)),
-            reviews_count=Count('reviews', filter=Q(reviews__is_approved=True))
+        qs = annotate_ratings(
+            Product.objects.filter(is_active=True).select_related('category')
         )
 
         # Category filter
@@ -82,11 +109,7 @@ class ProductListView(ListView):
 
         # Search
         if q := self.request.GET.get('q'):
-            qs = qs.filter(
-                Q(name__icontains=q) |
-                Q(description__icontains=q) |
-                Q(category__name__icontains=q)
-            )
+            qs = search.filter_queryset(qs, q, 'product')
 
         # Price filter
         if min_price := self.request.GET.get('min_price'):
@@ -100,7 +123,7 @@ class ProductListView(ListView):
 
         # Sorting
         ordering = self.request.GET.get('ordering', '-created_at')
-        allowed = ['name', '-name', 'price', '-price', '-created_at', '-reviews_count']
+        allowed = ['name', '-name', 'price', '-price', '-created_at', '-reviews_count', '-average_rating']
         if ordering in allowed:
             qs = qs.order_by(ordering)
 
@@ -108,7 +131,9 @@ class ProductListView(ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.filter(is_active=True)
+        context['categories'] = Category.objects.filter(is_active=True).annotate(
+            active_products_count=Count('products', filter=Q(products__is_active=True))
+        )
         context['total_products'] = Product.objects.filter(is_active=True).count()
         if hasattr(self, 'category'):
             context['category'] = self.category
@@ -122,7 +147,7 @@ class ProductDetailView(DetailView):
     context_object_name = 'product'
 
     def get_queryset(self):
-        return Product.objects.filter(is_active=True).select_related('category')
+        return Product.objects.filter(is_active=True).select_related('category', 'rating_summary')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -143,10 +168,14 @@ class ProductDetailView(DetailView):
         reviews = self.object.reviews.filter(is_approved=True).select_related('user')
         context['reviews'] = reviews
 
-        # Average rating
-        avg_rating = reviews.aggregate(avg_rating=Avg('rating'))['avg_rating']
-        context['average_rating'] = round(avg_rating, 1) if avg_rating else 0
-        context['total_reviews'] = reviews.count()
+        # Average rating, count and histogram from the materialized summary
+        summary = getattr(self.object, 'rating_summary', None)
+        if summary is None:
+            summary = ProductRatingSummary(product=self.object)
+        self.object.average_rating = summary.average_rating
+        context['average_rating'] = round(summary.average_rating, 1)
+        context['total_reviews'] = summary.reviews_count
+        context['rating_histogram'] = summary.histogram
 
         # Review form for authenticated users
         if self.request.user.is_authenticated:
@@ -191,13 +220,24 @@ class BasketListView(ListView):
     paginate_by = 9
     
     def get_queryset(self):
-        return ProductBasket.objects.filter(is_active=True).prefetch_related(
-            'included_products__product'
+        # Pricing is stored on the basket, so only the item count needs a join
+        qs = ProductBasket.objects.filter(is_active=True).annotate(
+            items_count=Count('included_products')
         )
+        
+        # Sorting
+        ordering = self.request.GET.get('ordering', '-created_at')
+        allowed = ['name', '-name', 'price', '-price', '-created_at', '-discount_percentage']
+        if ordering in allowed:
+            qs = qs.order_by(ordering, '-id')
+        
+        return qs
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = 'Combo Offers'
+        # One query for the availability of every basket on the page
+        ProductBasket.prefetch_stock(context['baskets'])
         return context
 
 class BasketDetailView(DetailView):
@@ -218,6 +258,7 @@ class BasketDetailView(DetailView):
         context['basket_items'] = basket_items
         
         # Calculate basket details
+        ProductBasket.prefetch_stock([self.object])
         context['original_price'] = self.object.total_original_price
         context['discount_percentage'] = self.object.discount_percentage
         context['savings'] = self.object.savings_per_basket
@@ -229,11 +270,13 @@ class BasketDetailView(DetailView):
         
         return context
 
-class RecipeListView(ListView):
+class RecipeListView(KeysetPaginationMixin, ListView):
     model = Recipe
     template_name = 'products/recipe_list.html'
     context_object_name = 'recipes'
     paginate_by = 9
+    cursor_orderings = {'-created_at': ['-created_at', '-id']}
+    ordering_param = None
     
     def get_queryset(self):
         queryset = Recipe.objects.filter(is_active=True).prefetch_related('ingredients__product')
@@ -241,11 +284,7 @@ class RecipeListView(ListView):
         # Search functionality
         search_query = self.request.GET.get('q')
         if search_query:
-            queryset = queryset.filter(
-                Q(title__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(instructions__icontains=search_query)
-            )
+            queryset = search.filter_queryset(queryset, search_query, 'recipe')
         
         return queryset
     
@@ -349,33 +388,13 @@ def search_view(request):
         'products': [],
         'recipes': [],
         'baskets': [],
-        'categories': []
+        'categories': [],
+        'merchandise': [],
     }
     
     if query:
-        results['products'] = Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query),
-            is_active=True
-        )[:5]
-        
-        results['recipes'] = Recipe.objects.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query),
-            is_active=True
-        ).prefetch_related('ingredients__product')[:5]
-        
-        results['baskets'] = ProductBasket.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query),
-            is_active=True
-        ).prefetch_related('included_products__product')[:5]
-        
-        results['categories'] = Category.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query),
-            is_active=True
-        )[:5]
+        # One ranked full-text query across every catalog type
+        results = search.search_grouped(query, per_kind=5)
     
     return render(request, 'products/search_results.html', {
         'query': query,
@@ -722,19 +741,36 @@ def admin_merchandise_edit(request, merchandise_id):
 @user_passes_test(is_admin)
 def admin_bulk_operations(request):
     """Bulk operations page"""
+    form = BulkUpdateForm()
+    result = None
     if request.method == 'POST':
         action = request.POST.get('action')
         
-        if action == 'update_prices':
-            # Handle price updates
-            pass
-        elif action == 'update_stock':
-            # Handle stock updates
-            pass
+        if action in bulk.UPDATE_FIELDS:
+            # Handle price / stock updates
+            form = BulkUpdateForm(request.POST, request.FILES)
+            if form.is_valid():
+                try:
+                    result = bulk.apply_upload(
+                        form.cleaned_data['file'],
+                        bulk.UPDATE_FIELDS[action],
+                        dry_run=form.cleaned_data['dry_run'],
+                    )
+                except bulk.BulkUploadError as e:
+                    messages.error(request, str(e))
+                else:
+                    verb = 'would be updated' if result.dry_run else 'updated'
+                    messages.success(
+                        request,
+                        f'{len(result.changes)} {result.field} values {verb}, '
+                        f'{result.unchanged} unchanged, {len(result.errors)} rows with errors.'
+                    )
         elif action == 'export_data':
             # Handle data export
-            pass
+            return bulk.export_response()
     
     return render(request, 'products/admin_bulk_operations.html', {
         'title': 'Bulk Operations',
+        'form': form,
+        'result': result,
     })
\ No newline at end of file